@@ -38,6 +38,28 @@ class Debug:
     jumping_enemies = False
 
 
+class Rendering:
+    bloom_downsample = 0  # 1, 2 or 4 to render the glow at that fraction of the resolution, 0 to pick automatically
+    scale_bloom_with_resolution = True
+    scanline_darkness = 0  # 0 to 1
+    threads = 1  # more than 1 to render the neon effect in parallel, 0 for one per CPU core
+    pipelined = False  # render the neon effect in another process, one frame behind
+    dynamic_resolution = False  # render the neon effect at a lower resolution when the frame rate drops
+    # "blur", "stamp" or "jit". stamping is faster when there's only a few lines on a big screen (frames with lots of
+    # lines, like during gameplay, get blurred anyways), "jit" needs numba (python -m rendering.jitneon to see if it's
+    # faster here)
+    neon_algorithm = "blur"
+    temporal_bloom = 0  # 0 to 1, how much of the previous frames' glow to keep (makes trails), 0 to turn it off
+    presentation = "surface"  # "surface" or "texture", to put frames on the window with SDL's renderer instead
+    tunnel_cache_mb = 0  # memory for keeping rendered frames of the tunnel to reuse (256 is plenty), 0 to turn it off
+
+
+class Gameplay:
+    # how far ahead of the player to generate the level on a background thread (something past the 150 units you can
+    # see, like 400), 0 to generate it when it comes into view instead
+    pregenerate_distance = 0
+
+
 class KeyBinds:
     class Game:
         jump = [pygame.K_w, pygame.K_UP, pygame.K_SPACE]
@@ -93,6 +115,23 @@ _default_configs = {
         "jumping_enemies": False
         },
 
+    "Rendering": {
+        "bloom_downsample": 0,
+        "scale_bloom_with_resolution": True,
+        "scanline_darkness": 0,
+        "threads": 1,
+        "pipelined": False,
+        "dynamic_resolution": False,
+        "neon_algorithm": "blur",
+        "temporal_bloom": 0,
+        "presentation": "surface",
+        "tunnel_cache_mb": 0
+        },
+
+    "Gameplay": {
+        "pregenerate_distance": 0
+        },
+
     "KeyBinds": {
         "Game": {
             "jump": [pygame.K_w, pygame.K_UP, pygame.K_SPACE],
@@ -139,6 +178,21 @@ def _apply_configs_from_json(configuration):
     Debug.fps_test = configuration["Debug"]["fps_test"]
     Debug.jumping_enemies = configuration["Debug"]["jumping_enemies"]
 
+    # older config files won't have these
+    rendering = {**_default_configs["Rendering"], **configuration.get("Rendering", {})}
+    Rendering.bloom_downsample = rendering["bloom_downsample"]
+    Rendering.scale_bloom_with_resolution = rendering["scale_bloom_with_resolution"]
+    Rendering.scanline_darkness = rendering["scanline_darkness"]
+    Rendering.threads = rendering["threads"]
+    Rendering.pipelined = rendering["pipelined"]
+    Rendering.dynamic_resolution = rendering["dynamic_resolution"]
+    Rendering.neon_algorithm = rendering["neon_algorithm"]
+    Rendering.temporal_bloom = rendering["temporal_bloom"]
+    Rendering.presentation = rendering["presentation"]
+    Rendering.tunnel_cache_mb = rendering["tunnel_cache_mb"]
+    gameplay = {**_default_configs["Gameplay"], **configuration.get("Gameplay", {})}
+    Gameplay.pregenerate_distance = gameplay["pregenerate_distance"]
+
     KeyBinds.Game.jump = configuration["KeyBinds"]["Game"]["jump"]
     KeyBinds.Game.left = configuration["KeyBinds"]["Game"]["left"]
     KeyBinds.Game.right = configuration["KeyBinds"]["Game"]["right"]
@@ -177,6 +231,17 @@ def _get_configs_as_json_dict():
     configuration["Debug"]["use_neon"] = Debug.use_neon
     configuration["Debug"]["fps_test"] = Debug.fps_test
     configuration["Debug"]["jumping_enemies"] = Debug.jumping_enemies
+    configuration["Rendering"]["bloom_downsample"] = Rendering.bloom_downsample
+    configuration["Rendering"]["scale_bloom_with_resolution"] = Rendering.scale_bloom_with_resolution
+    configuration["Rendering"]["scanline_darkness"] = Rendering.scanline_darkness
+    configuration["Rendering"]["threads"] = Rendering.threads
+    configuration["Rendering"]["pipelined"] = Rendering.pipelined
+    configuration["Rendering"]["dynamic_resolution"] = Rendering.dynamic_resolution
+    configuration["Rendering"]["neon_algorithm"] = Rendering.neon_algorithm
+    configuration["Rendering"]["temporal_bloom"] = Rendering.temporal_bloom
+    configuration["Rendering"]["presentation"] = Rendering.presentation
+    configuration["Rendering"]["tunnel_cache_mb"] = Rendering.tunnel_cache_mb
+    configuration["Gameplay"]["pregenerate_distance"] = Gameplay.pregenerate_distance
 
     configuration["KeyBinds"]["Game"]["jump"] = KeyBinds.Game.jump
     configuration["KeyBinds"]["Game"]["left"] = KeyBinds.Game.left
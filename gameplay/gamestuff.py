@@ -1,4 +1,5 @@
 import pygame
+import numpy
 
 import config
 import main
@@ -7,9 +8,11 @@ import gameplay.levels as levels
 import rendering.neon as neon
 import rendering.threedee as threedee
 import rendering.levelbuilder3d as levelbuilder3d
+import rendering.tunnelcache as tunnelcache
 import keybinds
 import util.utility_functions as utility_functions
 import util.fonts as fonts
+import rendering.presentation as presentation
 import gameplay.highscores as highscores
 from sound_manager.SoundManager import SoundManager
 
@@ -35,7 +38,10 @@ class GameplayMode(main.GameMode):
         self.current_rotation = 0
 
         self.foresight = 150
-        self.neon_renderer = neon.NeonRenderer()
+        self.neon_renderer = neon.create_renderer()
+        self._lines = threedee.Line3DBuffer()  # reused every frame
+        self.cull_stats = levelbuilder3d.CullingStats()
+        self.geometry_cache = levelbuilder3d.GeometryCache()
 
         self.score_font = fonts.get_font(30, name="cool")
         self.update_level_rotation(1000, snap=True)
@@ -51,12 +57,18 @@ class GameplayMode(main.GameMode):
         self.update_level_rotation(dt)
 
         self.current_level.unload_obstacles(self.camera.position.z + self.unload_offset)
+        if config.Gameplay.pregenerate_distance > 0:
+            self.current_level.pregenerate_obstacles(self.player.z,
+                                                     self.player.z + config.Gameplay.pregenerate_distance)
 
         if self.player.is_dead():
             score = self.player.get_score()
             highscores.add_new_score(score)
             self.loop.set_mode(RetryMenu(self.loop, score, self.player.get_death_message(), self))
 
+    def get_debug_info(self):
+        return str(self.cull_stats)
+
     def handle_events(self, events):
         for e in events:
             if e.type == pygame.KEYDOWN:
@@ -96,25 +108,19 @@ class GameplayMode(main.GameMode):
             else:
                 self.current_level.set_rotation(cur_rotation + change_in_rotation)
 
-    def draw_to_screen(self, screen, extra_darkness_factor=1, show_score=True):
-        screen.fill((0, 0, 0))
-        all_lines = []
+    def draw_to_screen(self, screen, extra_darkness_factor=1, show_score=True, tint=None, tint_amount=0):
+        if not config.Debug.use_neon:
+            screen.fill((0, 0, 0))  # otherwise the neon renderer overwrites every pixel anyways
+        all_lines = self._lines
+        all_lines.clear()
         cell_length = self.current_level.get_cell_length()
         z = self.camera.position.z
-        n_lanes = self.current_level.number_of_lanes()
         cell_start = int(z / cell_length)
         cell_end = int((z + self.foresight) / cell_length + 1)
 
-        for i in range(cell_start, cell_end):
-            all_lines.extend(levelbuilder3d.build_section(i * cell_length, cell_length, self.current_level))
-
-        for n in range(n_lanes):
-            obstacles = self.current_level.get_all_obstacles_between(n, z, z + self.foresight)
-            for obs in reversed(obstacles):
-                # add them from from back to front so they overlap properly
-                all_lines.extend(levelbuilder3d.build_obstacle(obs, self.current_level, self.player))
-
-        all_lines.extend(levelbuilder3d.get_player_shape(self.player, self.current_level))
+        # geometry is built without the level's rotation, the camera applies it instead
+        self.camera.roll = self.current_level.get_rotation(z)
+        self.geometry_cache.evict_before(z)
 
         if config.Display.depth_shade:
             # sorry tank, I just think it's a cool option <3
@@ -122,13 +128,90 @@ class GameplayMode(main.GameMode):
         else:
             depth_shading = None
 
-        all_2d_lines = self.camera.project_to_surface(screen, all_lines, depth_shading=depth_shading)
-        neon_lines = neon.NeonLine.convert_line2ds_to_neon_lines(all_2d_lines)
-
-        self.neon_renderer.draw_lines(screen, neon_lines, extra_darkness_factor=extra_darkness_factor)
+        # the tunnel either comes out of the cache (and gets drawn underneath everything else at the end), or it's
+        # projected on its own and drawn along with everything else
+        self.cull_stats.reset()
+        tunnel_layer = None
+        if tunnelcache.is_enabled():
+            tunnel_layer = tunnelcache.get_instance().get_layer(screen, self.current_level, self.camera,
+                                                                self._project_tunnel, depth_shading=depth_shading,
+                                                                extra_darkness_factor=extra_darkness_factor,
+                                                                tint=tint, tint_amount=tint_amount)
+        tunnel_2d = None
+        obstacle_camera = self.camera
+        if tunnel_layer is None:
+            tunnel_2d = self._project_tunnel(self.camera, screen, depth_shading)
+            all_lines.clear()
+        else:
+            # the cached tunnel was rendered from a camera snapped to a grid, so the obstacles have to be seen from
+            # there too, otherwise they'd slide around against the tunnel's cells
+            obstacle_camera = tunnelcache.get_instance().snap_camera(self.current_level, self.camera)
+
+        # skip building the obstacles that are out of view
+        visible_obstacles = levelbuilder3d.get_visible_cells(cell_start, cell_end, cell_length, self.current_level,
+                                                             self.camera, screen.get_size(), height=1,
+                                                             stats=self.cull_stats)
+
+        self.current_level.load_obstacles(z, z + self.foresight)
+        obstacles_to_build = []
+        for n, obstacles in enumerate(self.current_level.get_obstacles_between(z, z + self.foresight)):
+            for obs in reversed(obstacles):
+                cell = int(obs.z / cell_length) - cell_start
+                if 0 <= cell < visible_obstacles.shape[1] and not visible_obstacles[n, cell] and obs.get_time_dead() <= 0:
+                    continue  # out of view (exploding ones can fly out of their cell, so they're always built)
+                # add them from from back to front so they overlap properly
+                obstacles_to_build.append(obs)
+        self.geometry_cache.build_obstacles(obstacles_to_build, self.current_level, self.player, out=all_lines)
+
+        n_obstacle_lines = len(all_lines)
+        levelbuilder3d.get_player_shape(self.player, self.current_level, out=all_lines)
+
+        if obstacle_camera is self.camera:
+            points_2d, colors, inner_colors, widths = self.camera.project_batch_to_surface(screen,
+                                                                                          all_lines.points,
+                                                                                          all_lines.colors,
+                                                                                          all_lines.widths,
+                                                                                          depth_shading=depth_shading)
+        else:
+            # the player isn't attached to any cell, so it's seen from the real camera and doesn't jitter
+            obstacles_2d = obstacle_camera.project_batch_to_surface(screen, all_lines.points[:n_obstacle_lines],
+                                                                    all_lines.colors[:n_obstacle_lines],
+                                                                    all_lines.widths[:n_obstacle_lines],
+                                                                    depth_shading=depth_shading)
+            player_2d = self.camera.project_batch_to_surface(screen, all_lines.points[n_obstacle_lines:],
+                                                             all_lines.colors[n_obstacle_lines:],
+                                                             all_lines.widths[n_obstacle_lines:],
+                                                             depth_shading=depth_shading)
+            points_2d, colors, inner_colors, widths = (numpy.concatenate([a, b]) for a, b in
+                                                       zip(obstacles_2d, player_2d))
+        if tunnel_2d is not None:
+            points_2d, colors, inner_colors, widths = (numpy.concatenate([a, b]) for a, b in
+                                                       zip(tunnel_2d, (points_2d, colors, inner_colors, widths)))
+        neon_lines = neon.NeonLineBatch(points_2d, colors, widths, inner_colors=inner_colors)
+
+        self.neon_renderer.draw_lines(screen, neon_lines, extra_darkness_factor=extra_darkness_factor,
+                                      tint=tint, tint_amount=tint_amount)
+        if tunnel_layer is not None:
+            tunnelcache.get_instance().draw_layer(screen, tunnel_layer)
 
         if show_score:
-            screen.blit(self.score_font.render(str(self.player.get_score()), False, neon.LIME), (20, 20))
+            score_surface = presentation.render_text(self.score_font, str(self.player.get_score()), False, neon.LIME)
+            presentation.blit_text(screen, score_surface, (20, 20))
+
+    def _project_tunnel(self, camera, surface, depth_shading=None):
+        """Projects the level's surface onto the surface, as far as the camera can see.
+        :return: (points_2d, colors, inner_colors, widths), same as Camera3D.project_batch_to_surface.
+        """
+        cell_length = self.current_level.get_cell_length()
+        z = camera.position.z
+        cell_start = int(z / cell_length)
+        cell_end = int((z + self.foresight) / cell_length + 1)
+
+        self._lines.clear()
+        return levelbuilder3d.project_level_surface(cell_start, cell_end, cell_length, self.current_level, camera,
+                                                    surface, depth_shading=depth_shading,
+                                                    geometry_cache=self.geometry_cache, stats=self.cull_stats,
+                                                    out=self._lines)
 
 
 class PauseMenu(main.GameMode):
@@ -189,11 +272,11 @@ class PauseMenu(main.GameMode):
         self.gameplay_mode.draw_to_screen(screen, extra_darkness_factor=current_darkness)
 
         screen_size = screen.get_size()
-        title_surface = self.title_font.render('PAUSE', True, neon.WHITE)
+        title_surface = presentation.render_text(self.title_font, 'PAUSE', True, neon.WHITE)
 
         title_size = title_surface.get_size()
         title_y = screen_size[1] // 3 - title_size[1] // 2
-        screen.blit(title_surface, dest=(screen_size[0] // 2 - title_size[0] // 2, title_y))
+        presentation.blit_text(screen, title_surface, dest=(screen_size[0] // 2 - title_size[0] // 2, title_y))
 
         option_y = max(screen_size[1] // 2, title_y + title_size[1])
         for i in range(len(self.options)):
@@ -201,9 +284,9 @@ class PauseMenu(main.GameMode):
             is_selected = i == self.selected_option_idx
             color = neon.WHITE if not is_selected else neon.RED
 
-            option_surface = self.option_font.render(option_text.upper(), True, color)
+            option_surface = presentation.render_text(self.option_font, option_text.upper(), True, color)
             option_size = option_surface.get_size()
-            screen.blit(option_surface, dest=(screen_size[0] // 2 - option_size[0] // 2, option_y))
+            presentation.blit_text(screen, option_surface, dest=(screen_size[0] // 2 - option_size[0] // 2, option_y))
             option_y += option_size[1]
 
 
@@ -272,25 +355,25 @@ class RetryMenu(main.GameMode):
 
         screen_size = screen.get_size()
 
-        title_surface = self.title_font.render('GAME OVER', True, neon.WHITE)
+        title_surface = presentation.render_text(self.title_font, 'GAME OVER', True, neon.WHITE)
         title_size = title_surface.get_size()
         title_y = screen_size[1] // 3 - title_size[1] // 2
-        screen.blit(title_surface, dest=(screen_size[0] // 2 - title_size[0] // 2, title_y))
+        presentation.blit_text(screen, title_surface, dest=(screen_size[0] // 2 - title_size[0] // 2, title_y))
         cur_y = title_y + int(title_size[1] * 0.9)
 
-        death_msg_surface = self.info_font.render(self.death_message.upper(), True, neon.WHITE)
+        death_msg_surface = presentation.render_text(self.info_font, self.death_message.upper(), True, neon.WHITE)
         death_msg_size = death_msg_surface.get_size()
-        screen.blit(death_msg_surface, dest=(screen_size[0] // 2 - death_msg_size[0] // 2, cur_y))
+        presentation.blit_text(screen, death_msg_surface, dest=(screen_size[0] // 2 - death_msg_size[0] // 2, cur_y))
         cur_y += int(death_msg_size[1] * 2)
 
-        subtitle_surface1 = self.info_font.render("SCORE: {}".format(self.score), True, neon.WHITE)
+        subtitle_surface1 = presentation.render_text(self.info_font, "SCORE: {}".format(self.score), True, neon.WHITE)
         subtitle_surface1_size = subtitle_surface1.get_size()
-        screen.blit(subtitle_surface1, dest=(screen_size[0] // 2 - subtitle_surface1_size[0] // 2, cur_y))
+        presentation.blit_text(screen, subtitle_surface1, dest=(screen_size[0] // 2 - subtitle_surface1_size[0] // 2, cur_y))
         cur_y += subtitle_surface1_size[1]
 
-        subtitle_surface2 = self.info_font.render("BEST: {}".format(self.best_score), True, neon.WHITE)
+        subtitle_surface2 = presentation.render_text(self.info_font, "BEST: {}".format(self.best_score), True, neon.WHITE)
         subtitle_surface2_size = subtitle_surface2.get_size()
-        screen.blit(subtitle_surface2, dest=(screen_size[0] // 2 - subtitle_surface2_size[0] // 2, cur_y))
+        presentation.blit_text(screen, subtitle_surface2, dest=(screen_size[0] // 2 - subtitle_surface2_size[0] // 2, cur_y))
         cur_y += int(subtitle_surface2_size[1] * 2)
 
         option_y = max(screen_size[1] // 2, cur_y)
@@ -299,7 +382,7 @@ class RetryMenu(main.GameMode):
             is_selected = i == self.selected_option_idx
             color = neon.WHITE if not is_selected else neon.RED
 
-            option_surface = self.option_font.render(option_text.upper(), True, color)
+            option_surface = presentation.render_text(self.option_font, option_text.upper(), True, color)
             option_size = option_surface.get_size()
-            screen.blit(option_surface, dest=(screen_size[0] // 2 - option_size[0] // 2, option_y))
+            presentation.blit_text(screen, option_surface, dest=(screen_size[0] // 2 - option_size[0] // 2, option_y))
             option_y += option_size[1]
@@ -1,11 +1,14 @@
 from typing import List
 from pygame import Vector3, Color
-from rendering.threedee import Line3D
+from rendering.threedee import Line3D, Line3DBuffer
 import rendering.neon as neon
 from sound_manager.SoundManager import SoundManager
 import util.utility_functions as utils
+import gameplay.pregeneration as pregeneration
 import time
 import random
+import bisect
+import numpy
 
 
 class Obstacle:
@@ -29,7 +32,7 @@ class Obstacle:
         self._dead_since = 0  # time of death, in seconds (since the the epoch)
 
         # used to avoid recreating the 3D model every frame
-        # will be a List[Line3D] if present
+        # will be a Line3DBuffer if present
         self._cached_3d_model = None
 
     def get_death_message(self):
@@ -95,14 +98,14 @@ class Obstacle:
     def can_slide_through(self):
         return self._can_slide_through
 
-    def get_model(self) -> List[Line3D]:
+    def get_model(self) -> Line3DBuffer:
         """
         :return: a 3D representation of the obstacle, as if its corners were at:
             [(-1, 1, 0), (1, 1, 0), (1, -1, 0), (-1, -1, 0)],
             and facing upwards in the z-axis.
         """
         if self._cached_3d_model is None:
-            self._cached_3d_model = self.generate_3d_model_at_origin()
+            self._cached_3d_model = Line3DBuffer.from_lines(self.generate_3d_model_at_origin())
 
         return self._cached_3d_model
 
@@ -248,18 +251,39 @@ class Level:
         """returns: radius of level at the given z coordinate."""
         return 10
 
+    def has_constant_radius(self) -> bool:
+        """returns: whether get_radius is the same everywhere, which lets the level's surface be drawn faster.
+        Subclasses that override get_radius are assumed not to be, unless they override this too."""
+        return type(self).get_radius is Level.get_radius
+
     def get_all_obstacles_between(self, n, z_start, z_end) -> List[Obstacle]:
         """returns: Obstacles in lane n, between the two z coordinates."""
         return []
 
+    def get_lane_obstacles_between(self, n, z_start, z_end) -> List[Obstacle]:
+        """returns: Obstacles in lane n, between the two z coordinates. Unlike get_all_obstacles_between, this doesn't
+        load anything, so load_obstacles should be called for the range first."""
+        return self.get_all_obstacles_between(n, z_start, z_end)
+
+    def get_obstacles_between(self, z_start, z_end) -> List[List[Obstacle]]:
+        """returns: for each lane, the obstacles between the two z coordinates. Same as get_lane_obstacles_between, this
+        doesn't load anything."""
+        return [self.get_lane_obstacles_between(n, z_start, z_end) for n in range(self.number_of_lanes())]
+
     def load_obstacles(self, z_start, z_end):
-        """If necessary, loads (or generates) obstacles between the two z coordinates."""
+        """If necessary, loads (or generates) obstacles between the two z coordinates. Does nothing if they're
+        already loaded."""
         pass
 
     def unload_obstacles(self, z_end):
         """If necessary, unload all obstacles prior to the given z coordinate."""
         pass
 
+    def pregenerate_obstacles(self, z_start, z_end):
+        """Hints that the obstacles between the two z coordinates will be loaded soon, so they can be generated ahead
+        of time (in the background)."""
+        pass
+
 
 class GenerationParameters:
 
@@ -283,12 +307,168 @@ class GenerationParameters:
                     return utils.lerp((z - z1) / (z2 - z1), self.speeds[i-1][1], self.speeds[i][1])
 
 
+_OBSTACLE_TYPES = [None]  # obstacle classes, indexed by their type code (0 means no obstacle)
+
+
+def get_obstacle_type_code(obs_type) -> int:
+    if obs_type not in _OBSTACLE_TYPES:
+        _OBSTACLE_TYPES.append(obs_type)
+    return _OBSTACLE_TYPES.index(obs_type)
+
+
+class ObstacleGrid:
+    """
+    Holds the obstacles of a range of cells (at most one per lane per cell), in arrays that are used as ring buffers.
+    Loading cells at either end of the range, or unloading them from the start, only touches the cells that changed.
+
+    Every cell is stored twice, capacity apart, so any part of the loaded range is a contiguous slice of the arrays
+    (see get_lane).
+    """
+
+    def __init__(self, n_lanes, capacity=64):
+        self.n_lanes = n_lanes
+        self.cell_start = 0  # the loaded cells are [cell_start, cell_end)
+        self.cell_end = 0
+        self._allocate(capacity)
+
+        # for each lane, the (sorted) cells that have an obstacle, and those obstacles. queries bisect these, so they
+        # only cost as much as what they find.
+        self._lane_cells = [[] for _ in range(n_lanes)]
+        self._lane_obstacles = [[] for _ in range(n_lanes)]
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        shape = (self.n_lanes, 2 * capacity)
+        self.types = numpy.zeros(shape, dtype=numpy.int16)           # see get_obstacle_type_code
+        self.z_offsets = numpy.zeros(shape, dtype=numpy.float32)     # obstacle's z, relative to the start of its cell
+        self.lengths = numpy.zeros(shape, dtype=numpy.float32)
+        self.obstacles = numpy.full(shape, None, dtype=object)      # the Obstacles themselves, which keep their state
+
+    def __len__(self):
+        return self.cell_end - self.cell_start
+
+    def __repr__(self):
+        return "{}(cells=[{}, {}), capacity={})".format(type(self).__name__, self.cell_start, self.cell_end,
+                                                        self.capacity)
+
+    def is_loaded(self, i) -> bool:
+        return self.cell_start <= i < self.cell_end
+
+    def load(self, cell_start, cell_end, generate, cell_length):
+        """Makes sure the cells [cell_start, cell_end) are loaded, calling generate(n, i) for each lane of each cell
+        that isn't already. The loaded cells are always kept as one range, so any gap in between gets loaded too.
+        :param generate: a function returning the Obstacle for lane n of cell i, or None.
+        """
+        if cell_end <= cell_start or (self.cell_start <= cell_start and cell_end <= self.cell_end):
+            return  # nothing to load
+        if len(self) == 0:
+            self.cell_start = self.cell_end = cell_start
+        new_start, new_end = min(cell_start, self.cell_start), max(cell_end, self.cell_end)
+        if new_end - new_start > self.capacity:
+            self._grow(new_end - new_start)
+
+        for cells in (range(new_start, self.cell_start), range(self.cell_end, new_end)):
+            for n in range(self.n_lanes):
+                for i in cells:
+                    self._put(n, i, generate(n, i), cell_length)
+
+        if new_start < self.cell_start:
+            self.cell_start, self.cell_end = new_start, new_end
+            self._reindex(self.cell_start, self.cell_end)
+        else:
+            old_end, self.cell_end = self.cell_end, new_end
+            self._reindex(old_end, new_end)
+
+    def unload_before(self, i):
+        """Drops all the cells before cell i."""
+        if i <= self.cell_start:
+            return
+        i = min(i, self.cell_end)
+        for cell in range(self.cell_start, i):
+            idx = cell % self.capacity
+            self.types[:, [idx, idx + self.capacity]] = 0
+            self.obstacles[:, [idx, idx + self.capacity]] = None
+        self.cell_start = i
+        if len(self) == 0:
+            self.cell_start = self.cell_end = 0
+
+        for cells, obstacles in zip(self._lane_cells, self._lane_obstacles):
+            k = bisect.bisect_left(cells, i)
+            del cells[:k]
+            del obstacles[:k]
+
+    def get(self, n, i):
+        """:return: the obstacle in lane n of cell i, or None if there isn't one (or the cell isn't loaded, or there's
+                 no lane n)."""
+        if not self.is_loaded(i) or not 0 <= n < self.n_lanes:
+            return None
+        return self.obstacles[n, i % self.capacity]
+
+    def get_lane(self, n, cell_start, cell_end):
+        """Finds the obstacles of lane n in the loaded part of [cell_start, cell_end).
+        :return: (first cell, types, z_offsets, lengths, obstacles), where the last four are views of the arrays, one
+                 entry per cell starting at the first cell. Cells without an obstacle have a type of 0.
+        """
+        cell_start, cell_end = max(cell_start, self.cell_start), min(cell_end, self.cell_end)
+        start = cell_start % self.capacity
+        end = start + max(cell_end - cell_start, 0)
+        return (cell_start, self.types[n, start:end], self.z_offsets[n, start:end], self.lengths[n, start:end],
+                self.obstacles[n, start:end])
+
+    def get_lane_obstacles(self, n, cell_start, cell_end) -> list:
+        """:return: the obstacles of lane n in the loaded part of [cell_start, cell_end), in order."""
+        cells = self._lane_cells[n]
+        return self._lane_obstacles[n][bisect.bisect_left(cells, cell_start):bisect.bisect_left(cells, cell_end)]
+
+    def get_obstacles(self, cell_start, cell_end) -> List[list]:
+        """Same as get_lane_obstacles, but for every lane at once."""
+        return [obstacles[bisect.bisect_left(cells, cell_start):bisect.bisect_left(cells, cell_end)]
+                for cells, obstacles in zip(self._lane_cells, self._lane_obstacles)]
+
+    def _reindex(self, cell_start, cell_end):
+        """Adds the obstacles of [cell_start, cell_end) to the per-lane index. If that's the whole loaded range, the
+        index is rebuilt from scratch, otherwise they're appended (so they have to be after everything else)."""
+        rebuild = cell_start == self.cell_start
+        for n in range(self.n_lanes):
+            first_cell, types, _, _, obstacles = self.get_lane(n, cell_start, cell_end)
+            idxs = numpy.flatnonzero(types)
+            if rebuild:
+                self._lane_cells[n] = []
+                self._lane_obstacles[n] = []
+            self._lane_cells[n].extend((idxs + first_cell).tolist())
+            self._lane_obstacles[n].extend(obstacles[idxs].tolist())
+
+    def _put(self, n, i, obs, cell_length):
+        idx = i % self.capacity
+        for j in (idx, idx + self.capacity):
+            if obs is None:
+                self.types[n, j] = 0
+                self.obstacles[n, j] = None
+            else:
+                self.types[n, j] = get_obstacle_type_code(type(obs))
+                self.z_offsets[n, j] = obs.z - i * cell_length
+                self.lengths[n, j] = obs.length
+                self.obstacles[n, j] = obs
+
+    def _grow(self, min_capacity):
+        old_capacity = self.capacity
+        old_idxs = numpy.arange(self.cell_start, self.cell_end) % old_capacity
+        old = (self.types[:, old_idxs], self.z_offsets[:, old_idxs], self.lengths[:, old_idxs],
+               self.obstacles[:, old_idxs])
+
+        self._allocate(max(min_capacity, 2 * old_capacity))
+        new_idxs = numpy.arange(self.cell_start, self.cell_end) % self.capacity
+        for arr, vals in zip((self.types, self.z_offsets, self.lengths, self.obstacles), old):
+            arr[:, new_idxs] = vals
+            arr[:, new_idxs + self.capacity] = vals
+
+
 class InfiniteGeneratingLevel(Level):
 
     def __init__(self, lanes, gen_params=None):
         super().__init__(lanes)
-        self._obstacle_grid = {}  # (lane_n, cell_idx) -> Obstacle
-        self._currently_loaded_cell_range = None  # will be [int, int] if populated
+        self._obstacle_grid = ObstacleGrid(lanes)
+        self._pregenerator = None  # see pregenerate_obstacles
         self._gen_params = gen_params if gen_params is not None else GenerationParameters()
 
         self.color_dist = 1000  # color changes every X cells
@@ -307,14 +487,18 @@ class InfiniteGeneratingLevel(Level):
         return self._gen_params.get_player_speed(z)
 
     def _generate_obstacles(self, cell_start, cell_end):
-        for n in range(self.number_of_lanes()):
-            for i in range(cell_start, cell_end):
-                obs = self.generate_obstacle_at_cell(n, i)
-                if obs is not None:
-                    self._obstacle_grid[(n, i)] = obs
+        self._obstacle_grid.load(cell_start, cell_end, self._get_or_generate_obstacle, self.get_cell_length())
+
+    def _get_or_generate_obstacle(self, n, i):
+        if self._pregenerator is not None:
+            cell = self._pregenerator.take(i)
+            if cell is not None:
+                return cell[n]
+        return self.generate_obstacle_at_cell(n, i)
 
     def generate_obstacle_at_cell(self, n, i) -> Obstacle:
-        """Subclasses can override this to implement custom generation logic."""
+        """Subclasses can override this to implement custom generation logic. Levels that do don't get pregenerated,
+        since this gets called from a worker thread then (see pregenerate_obstacles)."""
         if n == 0 and i < 5:
             # don't let obstacles spawn right in your face at the start of a run
             return None
@@ -333,58 +517,42 @@ class InfiniteGeneratingLevel(Level):
             return None
 
     def get_obstacle_at_cell_if_loaded(self, n, i):
-        if (n, i) in self._obstacle_grid:
-            return self._obstacle_grid[(n, i)]
-        else:
-            return None
+        return self._obstacle_grid.get(n, i)
+
+    def _get_cell_range(self, z_start, z_end):
+        cs = self.get_cell_length()
+        return int(z_start / cs), int(z_end / cs + 1)
+
+    def load_obstacles(self, z_start, z_end):
+        self._generate_obstacles(*self._get_cell_range(z_start, z_end))
 
     def unload_obstacles(self, z_end):
-        cell_end = int(z_end / self.get_cell_length())
-        if self._currently_loaded_cell_range is None or self._currently_loaded_cell_range[0] >= cell_end:
-            pass  # nothing to unload
-        else:
-            self._obstacle_grid = {p: self._obstacle_grid[p] for p in self._obstacle_grid if p[1] >= cell_end}
-            if cell_end < self._currently_loaded_cell_range[1]:
-                # we unloaded a portion of the loaded cells
-                self._currently_loaded_cell_range[0] = cell_end
-            else:
-                # we unloaded everything
-                self._currently_loaded_cell_range = None
+        self._obstacle_grid.unload_before(int(z_end / self.get_cell_length()))
+        if self._pregenerator is not None:
+            self._pregenerator.forget_before(self._obstacle_grid.cell_start)
+
+    def pregenerate_obstacles(self, z_start, z_end):
+        if type(self).generate_obstacle_at_cell is not InfiniteGeneratingLevel.generate_obstacle_at_cell:
+            return  # it'd get called from another thread, and there's no telling whether an override is ok with that
+        cell_start, cell_end = self._get_cell_range(z_start, z_end)
+        if self._pregenerator is None:
+            # it only works forwards, from wherever the loaded cells end
+            first_cell = self._obstacle_grid.cell_end if len(self._obstacle_grid) > 0 else cell_start
+            self._pregenerator = pregeneration.ObstaclePregenerator(self.generate_obstacle_at_cell,
+                                                                    self.number_of_lanes(), first_cell)
+        self._pregenerator.request(cell_end)
+
+    def get_obstacles_between(self, z_start, z_end) -> List[List[Obstacle]]:
+        return self._obstacle_grid.get_obstacles(*self._get_cell_range(z_start, z_end))
+
+    def get_lane_obstacles_between(self, n, z_start, z_end) -> List[Obstacle]:
+        return self._obstacle_grid.get_lane_obstacles(n % self.number_of_lanes(),
+                                                      *self._get_cell_range(z_start, z_end))
 
     def get_all_obstacles_between(self, n, z_start, z_end) -> List[Obstacle]:
         """
         Fetches all the obstacles in the specified lane between the two z coordinates. Will generate
         that portion of the level if necessary.
         """
-        n = n % self.number_of_lanes()
-        cs = self.get_cell_length()
-        cell_start = int(z_start / cs)
-        cell_end = int(z_end / cs + 1)
-
-        new_range = [cell_start, cell_end]
-        old_range = self._currently_loaded_cell_range
-
-        if old_range is None:
-            # starting from scratch
-            self._generate_obstacles(new_range[0], new_range[1])
-            self._currently_loaded_cell_range = [new_range[0], new_range[1]]
-            old_range = self._currently_loaded_cell_range
-        elif new_range[1] <= old_range[0]:
-            # new region is completely before the already-generated region
-            self._generate_obstacles(cell_start, self._currently_loaded_cell_range[0])
-        elif old_range[1] <= new_range[0]:
-            # new region is completely after the already-generated region
-            self._generate_obstacles(self._currently_loaded_cell_range[0], cell_end)
-        elif old_range[0] <= new_range[0] and new_range[1] <= old_range[1]:
-            pass  # we've already generated the requested region
-        else:
-            # new and old regions are overlapping
-            if new_range[0] < old_range[0]:
-                self._generate_obstacles(new_range[0], old_range[0])
-            if old_range[1] < new_range[1]:
-                self._generate_obstacles(old_range[1], new_range[1])
-
-        self._currently_loaded_cell_range[0] = min(new_range[0], old_range[0])
-        self._currently_loaded_cell_range[1] = max(new_range[1], old_range[1])
-
-        return [self._obstacle_grid[(n, i)] for i in range(cell_start, cell_end) if (n, i) in self._obstacle_grid]
+        self.load_obstacles(z_start, z_end)
+        return self.get_lane_obstacles_between(n, z_start, z_end)
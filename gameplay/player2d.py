@@ -170,7 +170,8 @@ class Player:
             return
         else:
             lane_n = self.get_lane(level.number_of_lanes())
-            obstacles = level.get_all_obstacles_between(lane_n, self.last_z_pos, self.z + self.length)
+            level.load_obstacles(self.last_z_pos, self.z + self.length)
+            obstacles = level.get_lane_obstacles_between(lane_n, self.last_z_pos, self.z + self.length)
             for obs in obstacles:
                 if obs.handle_potential_collision(self):
                     self.set_mode('dead')
@@ -0,0 +1,157 @@
+import collections
+import threading
+import time
+import traceback
+import weakref
+
+
+# Generates the level's cells on a worker thread, some distance ahead of where they're needed, so that (slow)
+# generation doesn't happen in the middle of a frame. Finished chunks of cells get handed to the main thread through
+# a deque, which it only ever reads from. If it needs a cell the worker hasn't gotten to yet, it generates that cell
+# itself, and the worker skips past it. The same goes for cells the worker isn't working on anymore (say, ones the
+# main thread already forgot about), or that it's taking too long with.
+
+CHUNK_CELLS = 8  # cells the worker generates at a time
+IDLE_CHECK_INTERVAL = 1  # seconds between the worker checking whether it's still needed, while it's idle
+WORKER_WAIT_TIMEOUT = 0.1  # seconds the main thread waits for a cell the worker's on, before generating it itself
+
+
+def _worker_main(pregenerator_ref, wake: threading.Event):
+    # only a weak reference is held, so the worker goes away along with its level
+    while True:
+        wake.wait(IDLE_CHECK_INTERVAL)
+        pregenerator = pregenerator_ref()
+        if pregenerator is None:
+            return
+        wake.clear()
+        pregenerator._generate_requested_cells()
+        del pregenerator
+
+
+class ObstaclePregenerator:
+    """
+    Generates cells in the background, from first_cell onwards, as far as it's been asked to (see request).
+    """
+
+    def __init__(self, generate, n_lanes, first_cell):
+        """
+        :param generate: a function returning the Obstacle (or None) for lane n of cell i. It's called from the
+                         worker thread.
+        :param first_cell: the first cell to generate. Anything before it is left to the main thread.
+        """
+        self.generate = generate
+        self.n_lanes = n_lanes
+        self.first_cell = first_cell
+
+        self._lock = threading.Lock()  # only held while claiming cells
+        self._next_cell = first_cell   # the first cell nobody's claimed yet
+        self._working_on = None  # (start, end) of the cells the worker's generating right now
+        self._target_cell = first_cell
+        self._broken = False  # if generating failed on the worker, everything is generated on the main thread
+
+        self._ready = collections.deque()  # (first cell, [[obstacle for each lane] for each cell]), from the worker
+        # cell -> [obstacle for each lane], once the main thread has taken it out of _ready. or None, for the cells the
+        # main thread generated itself.
+        self._cells = {}
+        self._published = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return "{}(next_cell={}, target_cell={}, ready={})".format(type(self).__name__, self._next_cell,
+                                                                   self._target_cell, len(self._cells))
+
+    def request(self, cell_end):
+        """Asks for the cells up to cell_end to be generated. Doesn't wait for them."""
+        if cell_end <= self._target_cell or self._broken:
+            return
+        self._target_cell = cell_end
+        if self._thread is None:
+            self._thread = threading.Thread(target=_worker_main, args=(weakref.ref(self), self._wake),
+                                            name="level pregeneration", daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def take(self, i):
+        """Gets a cell that the worker generated. If it's still working on it, this waits (up to WORKER_WAIT_TIMEOUT)
+        for it to finish.
+        :return: the obstacle (or None) for each lane of cell i, or None if the cell needs to be generated on the main
+                 thread. In that case, whatever the worker comes up with for it gets ignored.
+        """
+        if i < self.first_cell:
+            return None
+        self._take_ready()
+        if i not in self._cells:
+            with self._lock:
+                if i >= self._next_cell:
+                    # the worker hasn't gotten this far, so it's up to us
+                    self._next_cell = i + 1
+                    self._cells[i] = None
+                    return None
+            if not self._wait_for(i):
+                self._cells[i] = None
+                return None
+        return self._cells.get(i)
+
+    def _wait_for(self, i):
+        """Waits for the worker to finish cell i, as long as it's working on it.
+        :return: whether the cell's ready, False if the main thread should generate it.
+        """
+        deadline = time.perf_counter() + WORKER_WAIT_TIMEOUT
+        while True:
+            self._published.clear()
+            # the worker publishes its cells before it moves on, so if it's not on cell i anymore, it's in _ready
+            working_on = self._working_on
+            self._take_ready()
+            if i in self._cells:
+                return True
+            if self._broken or working_on is None or not working_on[0] <= i < working_on[1] \
+                    or not self._thread.is_alive():
+                return False
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                print("WARN: gave up waiting for cell {} to be pregenerated, generating it on the main thread"
+                      .format(i))
+                return False
+            self._published.wait(timeout)
+
+    def forget_before(self, i):
+        """Drops generated cells before cell i, since they won't be needed anymore."""
+        self._take_ready()
+        for cell in [cell for cell in self._cells if cell < i]:
+            del self._cells[cell]
+
+    def _take_ready(self):
+        while len(self._ready) > 0:
+            start, cells = self._ready.popleft()
+            for i, cell in enumerate(cells):
+                # the main thread might've given up on the worker and generated it already
+                self._cells.setdefault(start + i, cell)
+
+    def _generate_requested_cells(self):
+        while True:
+            with self._lock:
+                if self._broken or self._next_cell >= self._target_cell:
+                    return
+                start = self._next_cell
+                end = min(start + CHUNK_CELLS, self._target_cell)
+                self._next_cell = end
+                self._working_on = (start, end)
+
+            try:
+                cells = []
+                for i in range(start, end):
+                    cells.append([self.generate(n, i) for n in range(self.n_lanes)])
+                    time.sleep(0)  # lets the main thread have the GIL back, if it's been waiting for it
+            except Exception:
+                print("ERROR: failed to pregenerate cells {} to {}, generating on the main thread from now on"
+                      .format(start, end))
+                traceback.print_exc()
+                self._broken = True
+                self._working_on = None
+                self._published.set()
+                return
+
+            self._ready.append((start, cells))
+            self._working_on = None
+            self._published.set()
@@ -2,6 +2,9 @@ import pygame
 
 import keybinds
 import rendering.neon as neon
+import rendering.pipelined as pipelined
+import rendering.governor as governor
+import rendering.presentation as presentation
 import config
 import util.profiling as profiling
 import util.fonts as fonts
@@ -19,17 +22,24 @@ class GameLoop:
     def __init__(self):
         self.running = True
         self.clock = pygame.time.Clock()
-        self.screen = pygame.display.get_surface()
         self.current_mode = MainMenuMode(self)
         self.current_mode.on_mode_start()
 
     def set_mode(self, next_mode):
         if self.current_mode != next_mode:
             self.current_mode.on_mode_end()
+            neon.reset_temporal_buffers()  # so the last mode's glow doesn't trail into the next one
+            pipelined.flush()  # and its last frame doesn't get shown in the next one
         self.current_mode = next_mode
         self.current_mode.on_mode_start()
 
     def start(self):
+        try:
+            self._run()
+        finally:
+            pipelined.stop()  # shuts down the render worker, if there is one
+
+    def _run(self):
         dt = 0
         while self.running:
             events = []
@@ -52,14 +62,17 @@ class GameLoop:
             cur_mode = self.current_mode
 
             cur_mode.update(dt, events)
-            cur_mode.draw_to_screen(self.screen)
+            cur_mode.draw_to_screen(presentation.get_screen())  # it's a new surface after the window's recreated
 
-            pygame.display.flip()
+            presentation.get_instance().present()
 
             if config.Debug.fps_test:
-                pygame.display.set_caption(f"{config.Display.title} {int(self.clock.get_fps())} FPS")
+                presentation.get_instance().set_caption(
+                    f"{config.Display.title} {int(self.clock.get_fps())} FPS "
+                    f"{governor.get_instance().get_debug_info()} {cur_mode.get_debug_info()}")
 
             dt = self.clock.tick(TARGET_FPS) / 1000.0
+            governor.get_instance().add_frame_time(self.clock.get_rawtime() / 1000.0)  # not counting the waiting
 
 
 class GameMode:
@@ -81,6 +94,10 @@ class GameMode:
     def draw_to_screen(self, screen):
         pass
 
+    def get_debug_info(self) -> str:
+        """Extra info to show next to the FPS when config.Debug.fps_test is enabled."""
+        return ""
+
 
 class MainMenuMode(GameMode):
 
@@ -103,7 +120,10 @@ class MainMenuMode(GameMode):
         import rendering.neon as neon
         self.bg_level = levels.InfiniteGeneratingLevel(10)
         self.bg_camera = threedee.Camera3D()
-        self.bg_renderer = neon.NeonRenderer()
+        self.bg_renderer = neon.create_renderer()
+        self.bg_lines = threedee.Line3DBuffer()  # reused every frame
+        self.bg_cull_stats = levelbuilder3d.CullingStats()
+        self.bg_geometry_cache = levelbuilder3d.GeometryCache()
 
     def on_mode_start(self):
         SoundManager.play_song("menu_theme", fadein_ms=0)
@@ -148,17 +168,17 @@ class MainMenuMode(GameMode):
         self._update_bg(dt)
 
     def draw_to_screen(self, screen: pygame.Surface):
-        screen.fill((0, 0, 0))
+        if not config.Debug.use_neon:
+            screen.fill((0, 0, 0))  # otherwise the neon renderer overwrites every pixel anyways
 
         self._draw_bg(screen)
 
         screen_size = screen.get_size()
-        title_surface = self.title_font.render('TEMPEST RUN', True, neon.WHITE)
+        title_surface = presentation.render_text(self.title_font, 'TEMPEST RUN', True, neon.WHITE)
 
         title_size = title_surface.get_size()
         title_y = screen_size[1] // 3 - title_size[1] // 2
-        screen.blit(title_surface, dest=(screen_size[0] // 2 - title_size[0] // 2,
-                                         title_y))
+        presentation.blit_text(screen, title_surface, dest=(screen_size[0] // 2 - title_size[0] // 2, title_y))
 
         option_y = max(screen_size[1] // 2, title_y + title_size[1])
         for i in range(len(self.options)):
@@ -166,11 +186,14 @@ class MainMenuMode(GameMode):
             is_selected = i == self.selected_option_idx
             color = neon.WHITE if not is_selected else neon.RED
 
-            option_surface = self.option_font.render(option_text.upper(), True, color)
+            option_surface = presentation.render_text(self.option_font, option_text.upper(), True, color)
             option_size = option_surface.get_size()
-            screen.blit(option_surface, dest=(screen_size[0] // 2 - option_size[0] // 2, option_y))
+            presentation.blit_text(screen, option_surface, dest=(screen_size[0] // 2 - option_size[0] // 2, option_y))
             option_y += option_size[1]
 
+    def get_debug_info(self):
+        return str(self.bg_cull_stats)
+
     def _update_bg(self, dt):
         rot_speed = 10    # degrees per sec
         move_speed = 5  # units per sec
@@ -179,25 +202,42 @@ class MainMenuMode(GameMode):
         self.bg_level.set_rotation(self.bg_level.get_rotation(self.bg_camera.position.z) + rot_speed * dt)
 
     def _draw_bg(self, screen):
-        import rendering.levelbuilder3d as levelbuilder3d
         import rendering.neon as neon
-        cur_z = self.bg_camera.position.z
+        import rendering.tunnelcache as tunnelcache
+        self.bg_camera.roll = self.bg_level.get_rotation(self.bg_camera.position.z)
+        self.bg_cull_stats.reset()
+
+        if tunnelcache.is_enabled():
+            # there's nothing but the tunnel back here, so it can all come out of the cache
+            layer = tunnelcache.get_instance().get_layer(screen, self.bg_level, self.bg_camera, self._project_bg,
+                                                         depth_shading=(0, 100))
+            if layer is not None:
+                tunnelcache.get_instance().draw_layer(screen, layer, on_top=False)
+                return
+
+        points_2d, colors, inner_colors, widths = self._project_bg(self.bg_camera, screen, depth_shading=(0, 100))
+        self.bg_renderer.draw_lines(screen, neon.NeonLineBatch(points_2d, colors, widths, inner_colors=inner_colors))
+
+    def _project_bg(self, camera, surface, depth_shading=None):
+        import rendering.levelbuilder3d as levelbuilder3d
+        cur_z = camera.position.z
         cell_len = 20
 
-        all_3d_lines = []
-        for i in range(-1, 20):
-            all_3d_lines.extend(levelbuilder3d.build_section((i + cur_z // cell_len) * cell_len, cell_len, self.bg_level))
-
-        lines_to_draw = self.bg_camera.project_to_surface(screen, all_3d_lines, depth_shading=(0, 100))
-        self.bg_renderer.draw_lines(screen, neon.NeonLine.convert_line2ds_to_neon_lines(lines_to_draw))
+        self.bg_lines.clear()
+        cell_start = int(cur_z // cell_len) - 1
+        cell_end = int(cur_z // cell_len) + 20
+        self.bg_geometry_cache.evict_before(cur_z - cell_len)
+        return levelbuilder3d.project_level_surface(cell_start, cell_end, cell_len, self.bg_level, camera, surface,
+                                                    depth_shading=depth_shading,
+                                                    geometry_cache=self.bg_geometry_cache, stats=self.bg_cull_stats,
+                                                    out=self.bg_lines)
 
 
 def create_or_recreate_window():
     size = config.Display.width, config.Display.height
 
-    pygame.display.set_mode(size, pygame.SCALED | pygame.RESIZABLE)
-    pygame.display.set_caption(config.Display.title)
-    pygame.display.set_icon(pygame.image.load(utils.resource_path("assets/icon/icon.png")))
+    icon = pygame.image.load(utils.resource_path("assets/icon/icon.png"))
+    presentation.get_instance().create_window(size, config.Display.title, icon)
 
 
 def _main():
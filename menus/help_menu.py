@@ -7,6 +7,7 @@ import rendering.neon as neon
 import keybinds
 from main import GameMode, GameLoop
 import util.fonts as fonts
+import rendering.presentation as presentation
 import config
 from sound_manager.SoundManager import SoundManager
 
@@ -32,7 +33,7 @@ class HelpMenuMode(GameMode):
         self.info_font = fonts.get_font(config.FontSize.info)
 
     def _generate_square(self):
-        screen_w, screen_h = pygame.display.get_surface().get_size()
+        screen_w, screen_h = presentation.get_screen().get_size()
         return [random.randint(0, screen_w),  # x position
                 screen_h + 25,                # y position
                 random.randint(0, 360),       # angle
@@ -92,12 +93,11 @@ class HelpMenuMode(GameMode):
         for i in self.squares:
             pygame.draw.lines(screen, (0, 255, 0), True, self.get_square_points(i[0], i[1], i[2]))
         screen_size = screen.get_size()
-        title_surface = self.title_font.render('HELP', False, neon.WHITE)
+        title_surface = presentation.render_text(self.title_font, 'HELP', False, neon.WHITE)
 
         title_size = title_surface.get_size()
         title_y = screen_size[1] // 4 - title_size[1] // 2
-        screen.blit(title_surface, dest=(screen_size[0] // 2 - title_size[0] // 2,
-                                         title_y))
+        presentation.blit_text(screen, title_surface, dest=(screen_size[0] // 2 - title_size[0] // 2, title_y))
 
         option_y = max(screen_size[1] // 2, title_y + title_size[1])
         msgs = []
@@ -121,9 +121,9 @@ class HelpMenuMode(GameMode):
                 elif i == 2:
                     msgs = ['press ESCAPE to go back']
 
-            option_surface = self.option_font.render(option_text.upper(), True, color)
+            option_surface = presentation.render_text(self.option_font, option_text.upper(), True, color)
             option_size = option_surface.get_size()
-            screen.blit(option_surface, dest=((screen_size[0] // (len(self.options) + 1)) * (i + 1) - option_size[0] // 2, option_y))
+            presentation.blit_text(screen, option_surface, dest=((screen_size[0] // (len(self.options) + 1)) * (i + 1) - option_size[0] // 2, option_y))
             for index, msg in enumerate(msgs):
-                msg_surf = self.info_font.render(msg, True, neon.WHITE)
-                screen.blit(msg_surf, msg_surf.get_rect(center=(screen_size[0] // 2, screen_size[1] * 2 / 3 + msg_surf.get_size()[1] * index)))
+                msg_surf = presentation.render_text(self.info_font, msg, True, neon.WHITE)
+                presentation.blit_text(screen, msg_surf, msg_surf.get_rect(center=(screen_size[0] // 2, screen_size[1] * 2 / 3 + msg_surf.get_size()[1] * index)))
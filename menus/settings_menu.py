@@ -4,6 +4,7 @@ import config
 import keybinds
 import rendering.neon as neon
 import util.fonts as fonts
+import rendering.presentation as presentation
 import main
 from sound_manager.SoundManager import SoundManager
 
@@ -86,12 +87,11 @@ class SettingsMenuMode(main.GameMode):
     def draw_to_screen(self, screen: pygame.Surface):
         screen.fill((0, 0, 0))
         screen_size = screen.get_size()
-        title_surface = self.title_font.render('SETTINGS', True, neon.WHITE)
+        title_surface = presentation.render_text(self.title_font, 'SETTINGS', True, neon.WHITE)
 
         title_size = title_surface.get_size()
         title_y = screen_size[1] // 3 - title_size[1] // 2
-        screen.blit(title_surface, dest=(screen_size[0] // 2 - title_size[0] // 2,
-                                         title_y))
+        presentation.blit_text(screen, title_surface, dest=(screen_size[0] // 2 - title_size[0] // 2, title_y))
 
         option_y = max(screen_size[1] // 2, title_y + title_size[1])
         for i in range(len(self.options)):
@@ -106,7 +106,7 @@ class SettingsMenuMode(main.GameMode):
                     text = text + "  >"
             else:
                 text = option_text.upper()
-            option_surface = self.option_font.render(text, True, color)
+            option_surface = presentation.render_text(self.option_font, text, True, color)
             option_size = option_surface.get_size()
-            screen.blit(option_surface, dest=(screen_size[0] // 2 - option_size[0] // 2, option_y))
+            presentation.blit_text(screen, option_surface, dest=(screen_size[0] // 2 - option_size[0] // 2, option_y))
             option_y += option_size[1]
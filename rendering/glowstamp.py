@@ -0,0 +1,256 @@
+import cv2
+import numpy
+import rendering.neon as neon
+
+
+# An alternative to NeonRenderer's algorithm that doesn't blur the whole screen. The glow around a line only depends
+# on how far away from the line a pixel is, so it's worked out ahead of time as a 1D profile (for each width and
+# kernel size), and each line just stamps its glow onto the pixels around it. The cost goes with how much line there
+# is, instead of how big the screen is, so it's cheaper when there's only a few lines on a big screen.
+#
+# A line's stamp is made out of two copies of the same texture, the glow of a line that starts at one end and goes
+# on forever. One copy is put at each end of the line, pointing at the other end, and the dimmer of the two wins.
+# That's exactly the glow of the line in between, since a point's distance to the line is the bigger of its distances
+# to the two half-infinite ones.
+#
+# Glows from different lines are added together, which is pretty much what blurring does too. The profiles are
+# exact for horizontal and vertical lines, diagonal ones come out a little different from the blurred version.
+
+PROFILE_OVERSAMPLE = 8  # profile samples per pixel
+STAMP_BODY_LENGTH = 2  # columns of the texture past the end of the line, they get repeated to make the rest of it
+
+# roughly how long stamping takes compared to blurring a pixel of the screen, for deciding which one to use. Stamping
+# costs something for every line, and for every pixel of the box around its glow (long diagonal lines have big boxes,
+# so the tunnel during gameplay is usually a lot cheaper to blur). Measured with python -m rendering.glowstamp.
+STAMP_COST_PER_LINE = 10000
+STAMP_COST_PER_PIXEL = 4.5
+
+_CACHED_PROFILES = {}  # (width, inner width, ambient kernel, mid tone kernel) -> profile
+_CACHED_STAMPS = {}  # profile key -> texture
+
+
+def _box_blur_1d(signal, size):
+    size = max(1, int(round(size * PROFILE_OVERSAMPLE)))
+    return numpy.convolve(signal, numpy.full(size, 1 / size), mode="same")
+
+
+def get_glow_profile(width, inner_width, ambient_kernel_size, mid_tone_kernel_size, part=None) -> numpy.ndarray:
+    """
+    Works out what NeonRenderer's 1st and 2nd passes do to a (long, straight) line, as a function of the distance
+    from the line.
+    :param part: "ambient" for just the 1st pass's glow (after both blurs), "mid tone" for just what the 2nd pass adds
+                 on top of it, or None for all of it. The two parts add up to the whole thing, since blurring is linear.
+    :return: an array of brightness multipliers (from 0 to 1), one for every 1 / PROFILE_OVERSAMPLE pixels of distance
+             from the middle of the line. Everything past the end is 0.
+    """
+    key = (width, inner_width, ambient_kernel_size, mid_tone_kernel_size, part)
+    if key in _CACHED_PROFILES:
+        return _CACHED_PROFILES[key]
+
+    radius = max(width, inner_width) / 2 + ambient_kernel_size / 2 + mid_tone_kernel_size / 2 + 1
+    n = int(numpy.ceil(radius * PROFILE_OVERSAMPLE))
+    dists = numpy.abs(numpy.arange(-n, n + 1) / PROFILE_OVERSAMPLE)
+
+    # 1st pass, a dark line blurred with the big kernel
+    ambient = _box_blur_1d(numpy.where(dists <= width / 2, 0.85, 0), ambient_kernel_size)
+    # 2nd pass, the full color line drawn on top, then blurred with the small kernel
+    if part == "ambient":
+        profile = ambient
+    elif part == "mid tone":
+        profile = numpy.where(dists <= inner_width / 2, 1 - ambient, 0)
+    else:
+        profile = numpy.where(dists <= inner_width / 2, 1, ambient)
+    profile = _box_blur_1d(profile, mid_tone_kernel_size)
+
+    profile = numpy.append(profile[n:], 0)
+    _CACHED_PROFILES[key] = profile
+    return profile
+
+
+def get_glow_stamp(width, inner_width, ambient_kernel_size, mid_tone_kernel_size, part=None) -> numpy.ndarray:
+    """
+    :param part: which part of the glow, see get_glow_profile.
+    :return: the glow of a horizontal line starting at (radius, radius) and going right forever, as a grayscale image
+             (255 being the line's full color). The last column repeats forever, as do the (black) edges.
+    """
+    key = (width, inner_width, ambient_kernel_size, mid_tone_kernel_size, part)
+    if key in _CACHED_STAMPS:
+        return _CACHED_STAMPS[key]
+
+    profile = get_glow_profile(*key)
+    radius = int(numpy.ceil((len(profile) - 1) / PROFILE_OVERSAMPLE))
+    us = numpy.arange(-radius, STAMP_BODY_LENGTH + 1)[numpy.newaxis, :]
+    vs = numpy.arange(-radius, radius + 1)[:, numpy.newaxis]
+    dists = numpy.hypot(numpy.minimum(us, 0), vs)
+    brightness = numpy.interp(dists * PROFILE_OVERSAMPLE, numpy.arange(len(profile)), profile, right=0)
+
+    stamp = numpy.rint(brightness * 255).astype(numpy.uint8)
+    _CACHED_STAMPS[key] = stamp
+    return stamp
+
+
+def _kernel_size(kernel):
+    # the profiles are symmetric, so non-square kernels get averaged out
+    return 1 if kernel is None else (kernel[0] + kernel[1]) / 2
+
+
+class GlowStampRenderer(neon.NeonRenderer):
+    """
+    A NeonRenderer that stamps precomputed glows around each line instead of blurring the screen.
+    Only the highlights (the 3rd pass) are drawn the normal way.
+    With temporal bloom, the ambient glow gets stamped on its own first, so it can be mixed into the previous frames'
+    like NeonRenderer does, and then the rest of the glow gets stamped on top.
+    Frames with too many lines for stamping to pay off (see is_stamping_faster) get blurred like NeonRenderer does.
+    """
+
+    always_stamp = False  # stamps even when blurring would be faster, for comparing the two
+
+
+    def _render(self, buf, lines: neon.NeonLineBatch, kernel_scale, downsample, transposed=True, channels=None):
+        points = lines.points[:, :, ::-1] if transposed else lines.points
+        stamp_sizes = (_kernel_size(neon.scale_kernel(self.ambient_bloom_kernel, kernel_scale)),
+                       _kernel_size(neon.scale_kernel(self.mid_tone_bloom_kernel, kernel_scale)))
+        if not self.always_stamp and not self.is_stamping_faster(points, lines.widths, lines.inner_widths,
+                                                                 buf.shape[:2], stamp_sizes):
+            super()._render(buf, lines, kernel_scale, downsample, transposed=transposed, channels=channels)
+            return
+
+        # downsampling and threads don't help here, so they're ignored
+        buf[...] = 0
+
+        # 1st and 2nd passes, stamped one line at a time
+        lines_to_stamp = list(zip(points.tolist(), lines.colors.tolist(), lines.widths.tolist(),
+                                  lines.inner_widths.tolist()))
+        if self.temporal_bloom > 0:
+            # the stamps are already fully blurred, so there's nothing more to do when starting over
+            self._stamp_lines(buf, lines_to_stamp, stamp_sizes, channels, part="ambient")
+            self._accumulate_glow(buf, neon.scale_kernel(self.ambient_bloom_kernel, kernel_scale / 3), None,
+                                  self._scratch)
+            self._stamp_lines(buf, lines_to_stamp, stamp_sizes, channels, part="mid tone")
+        else:
+            self._stamp_lines(buf, lines_to_stamp, stamp_sizes, channels)
+
+        # 3rd pass, same as NeonRenderer
+        int_points = lines.np_points if transposed else numpy.ascontiguousarray(lines.np_points[:, :, ::-1])
+        for color, width, idxs in neon.NeonLineBatch.group_by_color_and_width(lines.inner_colors, lines.inner_widths):
+            self.polylines(buf, int_points[idxs], False, neon.to_native_color(color, channels, buf.shape[2]), width,
+                           lineType=cv2.LINE_AA)
+        self._blur(buf, neon.scale_kernel(self.highlight_bloom_kernel, kernel_scale), self._scratch)
+
+    @staticmethod
+    def is_stamping_faster(points, widths, inner_widths, size, stamp_sizes) -> bool:
+        """Guesses whether stamping the lines would be faster than blurring the screen.
+        :param points: an N x 2 x 2 array of the lines' endpoints, as (column, row).
+        :param size: the (rows, columns) of the screen.
+        :param stamp_sizes: the (ambient, mid tone) kernel sizes for the stamps.
+        """
+        if len(points) == 0:
+            return True
+        # same as the stamps' radius, see get_glow_profile
+        radius = numpy.maximum(widths, inner_widths) / 2 + stamp_sizes[0] / 2 + stamp_sizes[1] / 2 + 1
+        mins, maxes = points.min(axis=1), points.max(axis=1)
+        cols = numpy.clip(maxes[:, 0] + radius, 0, size[1]) - numpy.clip(mins[:, 0] - radius, 0, size[1])
+        rows = numpy.clip(maxes[:, 1] + radius, 0, size[0]) - numpy.clip(mins[:, 1] - radius, 0, size[0])
+        stamp_cost = len(points) * STAMP_COST_PER_LINE + numpy.dot(cols, rows) * STAMP_COST_PER_PIXEL
+        return stamp_cost < size[0] * size[1]
+
+    def _stamp_lines(self, buf, lines_to_stamp, stamp_sizes, channels, part=None):
+        """Adds the lines' glows onto buf.
+        :param lines_to_stamp: (endpoints, color, width, inner width) for each line, with the endpoints in buf.
+        :param stamp_sizes: the (ambient, mid tone) kernel sizes for the stamps.
+        :param part: which part of the glow, see get_glow_profile.
+        """
+        for (p1, p2), color, width, inner_width in lines_to_stamp:
+            stamp = get_glow_stamp(width, inner_width, *stamp_sizes, part=part)
+            self._stamp(buf, p1, p2, stamp, neon.to_native_color(color, channels, buf.shape[2]))
+
+    def _stamp(self, buf, p1, p2, stamp, color):
+        """Adds a line's glow onto buf.
+        :param p1: the line's start, as (column, row) in buf.
+        :param p2: the line's end.
+        :param stamp: the glow, from get_glow_stamp.
+        :param color: the line's color, in buf's pixel format.
+        """
+        radius = stamp.shape[0] // 2
+        x1, x2 = max(0, int(min(p1[0], p2[0])) - radius), min(buf.shape[1], int(max(p1[0], p2[0])) + radius + 2)
+        y1, y2 = max(0, int(min(p1[1], p2[1])) - radius), min(buf.shape[0], int(max(p1[1], p2[1])) + radius + 2)
+        if x1 >= x2 or y1 >= y2:
+            return  # off screen
+
+        dx, dy = p2[0] - p1[0], p2[1] - p1[1]
+        length = (dx * dx + dy * dy) ** 0.5
+        dx, dy = (dx / length, dy / length) if length > 0 else (1, 0)
+
+        # the stamps are drawn onto scratch memory, so they can be colored in and added to what's already there
+        size = (y2 - y1) * (x2 - x1)
+        if self._scratch.get("stamps") is None or self._scratch["stamps"].shape[1] < size * buf.shape[2]:
+            self._scratch["stamps"] = numpy.zeros((3, max(size * buf.shape[2], 1 << 16)), dtype=numpy.uint8)
+        from_start, from_end = (s[:size].reshape((y2 - y1, x2 - x1)) for s in self._scratch["stamps"][:2])
+        colored = self._scratch["stamps"][2, :size * buf.shape[2]].reshape((y2 - y1, x2 - x1, buf.shape[2]))
+
+        for dst, (px, py), (ux, uy) in ((from_start, p1, (dx, dy)), (from_end, p2, (-dx, -dy))):
+            # maps each pixel of dst to where it is in the stamp, with the stamp pointing along (ux, uy)
+            rel_x, rel_y = x1 - px, y1 - py
+            transform = numpy.array([[ux, uy, rel_x * ux + rel_y * uy + radius],
+                                     [-uy, ux, -rel_x * uy + rel_y * ux + radius]])
+            cv2.warpAffine(stamp, transform, (x2 - x1, y2 - y1), dst=dst,
+                           flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+
+        cv2.min(from_start, from_end, dst=from_start)
+        cv2.transform(from_start[:, :, numpy.newaxis], numpy.array(color, dtype=numpy.float32).reshape((-1, 1)) / 255,
+                      dst=colored)
+        roi = buf[y1:y2, x1:x2]
+        cv2.add(roi, colored, dst=roi)
+
+
+def compare_with_blur(lines: neon.NeonLineBatch, size, n_frames=10, **renderer_settings):
+    """Renders the lines with both algorithms, to see how close they look and how long they take.
+    :return: (the mean and the max difference between the two images, ms per frame with blurring, ms with stamping)
+    """
+    import time
+
+    res = []
+    for renderer_class in (neon.NeonRenderer, GlowStampRenderer):
+        renderer = renderer_class(**renderer_settings)
+        if isinstance(renderer, GlowStampRenderer):
+            renderer.always_stamp = True  # otherwise it'd just blur when that's faster
+        buf = numpy.zeros((size[0], size[1], 3), dtype=numpy.uint8)
+        renderer.render_to_array(buf, lines)  # warming up the caches
+        start_time = time.perf_counter()
+        for _ in range(n_frames):
+            renderer.render_to_array(buf, lines)
+        res.append((buf, (time.perf_counter() - start_time) / n_frames * 1000))
+
+    (blurred, blur_ms), (stamped, stamp_ms) = res
+    diff = numpy.abs(blurred.astype(numpy.int16) - stamped)
+    return diff.mean(), diff.max(), blur_ms, stamp_ms
+
+
+def make_square_scene(size, n_squares) -> neon.NeonLineBatch:
+    """A scene like the one behind the credits and help menus, some spinning squares. Uses the random module."""
+    import random
+    import pygame
+
+    points, colors = [], []
+    for _ in range(n_squares):
+        center = pygame.Vector2(random.randint(0, size[0]), random.randint(0, size[1]))
+        angle = random.randint(0, 360)
+        corners = [center + pygame.Vector2(x, y).rotate(angle)
+                   for x, y in ((-25, -25), (25, -25), (25, 25), (-25, 25))]
+        for i in range(4):
+            points.append((corners[i], corners[(i + 1) % 4]))
+            colors.append(tuple(random.choice(neon.ALL_COLORS))[:3])
+    return neon.NeonLineBatch(points, colors, [random.randint(1, 3) for _ in points])
+
+
+if __name__ == "__main__":
+    import random
+
+    random.seed(0)
+    for size in ((960, 540), (1920, 1080), (3840, 2160)):
+        for n_squares in (5, 25, 100):
+            mean_diff, max_diff, blur_ms, stamp_ms = compare_with_blur(
+                make_square_scene(size, n_squares), size, kernel_reference_height=neon.REFERENCE_HEIGHT,
+                bloom_downsample=1)
+            print("{}x{}, {} lines: mean difference {:.2f}, max {}, blur {:.1f} ms, stamp {:.1f} ms".format(
+                size[0], size[1], 4 * n_squares, mean_diff, max_diff, blur_ms, stamp_ms))
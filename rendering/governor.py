@@ -0,0 +1,75 @@
+import collections
+import config
+
+# Renders the neon effect at a lower resolution when frames are taking too long, and goes back up once there's
+# room for it again. Only the lines are affected, text is drawn on top at the full resolution.
+
+_instance = None
+
+SCALES = (1.0, 0.85, 0.7, 0.5)  # fractions of the display's resolution to render at, best looking first
+WINDOW_SIZE = 30  # number of frames to average over
+DOWNSCALE_THRESHOLD = 1.05  # drop a step when frames take this much of the frame budget
+UPSCALE_THRESHOLD = 0.8  # go up a step when it'd (probably) fit in this much of the frame budget
+COOLDOWN = 60  # frames to wait after a change before changing again
+
+
+def get_instance():
+    global _instance
+    if _instance is None:
+        _instance = ResolutionGovernor()
+
+    return _instance
+
+
+class ResolutionGovernor:
+
+    def __init__(self, scales=SCALES, window_size=WINDOW_SIZE):
+        self.scales = scales
+        self.scale_idx = 0
+        self.frame_times = collections.deque(maxlen=window_size)
+        self.cooldown = 0
+
+    def get_scale(self) -> float:
+        """:return: the fraction of the display's resolution the neon effect should be rendered at."""
+        if not config.Rendering.dynamic_resolution:
+            return 1.0
+        return self.scales[self.scale_idx]
+
+    def get_frame_budget(self) -> float:
+        return 1 / max(1, config.Display.fps)
+
+    def add_frame_time(self, dt):
+        """Call once per frame.
+        :param dt: how long (in seconds) the frame took to update and draw, not counting time spent waiting on
+                   the frame rate limit.
+        """
+        if not config.Rendering.dynamic_resolution:
+            return
+        self.frame_times.append(dt)
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return
+        if len(self.frame_times) < self.frame_times.maxlen:
+            return
+
+        avg_time = sum(self.frame_times) / len(self.frame_times)
+        budget = self.get_frame_budget()
+        if avg_time > budget * DOWNSCALE_THRESHOLD and self.scale_idx < len(self.scales) - 1:
+            self.set_scale_idx(self.scale_idx + 1)
+        elif self.scale_idx > 0:
+            # rendering cost goes with the number of pixels, so guess what the frame time would be one step up.
+            # the thresholds are far enough apart that it won't just bounce back down again.
+            cur, bigger = self.scales[self.scale_idx], self.scales[self.scale_idx - 1]
+            if avg_time * (bigger / cur) ** 2 < budget * UPSCALE_THRESHOLD:
+                self.set_scale_idx(self.scale_idx - 1)
+
+    def set_scale_idx(self, idx):
+        print("INFO: changing render scale from {} to {}".format(self.scales[self.scale_idx], self.scales[idx]))
+        self.scale_idx = idx
+        self.frame_times.clear()  # the old times don't mean anything anymore
+        self.cooldown = COOLDOWN
+
+    def get_debug_info(self) -> str:
+        if not config.Rendering.dynamic_resolution:
+            return ""
+        return "SCALE={:.0%}".format(self.get_scale())
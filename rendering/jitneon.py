@@ -0,0 +1,391 @@
+import math
+import numpy
+import rendering.neon as neon
+
+try:
+    import numba
+except ImportError:
+    numba = None  # it's optional, NeonRenderer's cv2 version gets used instead
+
+
+# NeonRenderer's glow passes (drawing thick lines and box blurring) written out as plain loops and compiled with
+# numba. The lines are drawn a block of rows at a time and blurred a row (or a strip of columns) at a time, so the
+# rows get split up between all the CPU's cores. Everything is done the same way cv2 does it, down to the fixed point
+# math, so the pictures come out exactly the same. The highlights are still drawn with cv2, since anti-aliasing is a
+# pain.
+
+AVAILABLE = numba is not None
+
+ROWS_PER_BLOCK = 16  # rows of pixels each thread draws lines onto at a time
+COLUMNS_PER_STRIP = 32  # columns of pixels each thread blurs at a time
+XY_SHIFT = 16  # bits of fraction in cv2's fixed point coordinates
+
+
+if AVAILABLE:
+    @numba.njit(cache=True, inline="always")
+    def _reflect(i, n):
+        # same as cv2's default border, BORDER_REFLECT_101
+        if i < 0:
+            i = -i
+        if i >= n:
+            i = 2 * n - 2 - i
+        return min(max(i, 0), n - 1)
+
+    @numba.njit(cache=True, inline="always")
+    def _div(a, b):
+        # C's integer division, which rounds towards 0
+        q = abs(a) // abs(b)
+        return q if (a < 0) == (b < 0) else -q
+
+    @numba.njit(cache=True, inline="always")
+    def _put_point(array, x, y, color, rows):
+        if rows[0] <= y < rows[1] and 0 <= x < array.shape[1]:
+            for c in range(array.shape[2]):
+                array[y, x, c] = color[c]
+
+    @numba.njit(cache=True, inline="always")
+    def _put_span(array, y, x1, x2, color, rows):
+        if rows[0] <= y < rows[1]:
+            for x in range(max(0, x1), min(array.shape[1] - 1, x2) + 1):
+                for c in range(array.shape[2]):
+                    array[y, x, c] = color[c]
+
+    @numba.njit(cache=True)
+    def _clip_line(width, height, x1, y1, x2, y2):
+        """cv2's clipLine, cuts the line off at the edges of a width x height image.
+        :return: (whether any of it is left, x1, y1, x2, y2)
+        """
+        right, bottom = width - 1, height - 1
+        c1 = (x1 < 0) + (x1 > right) * 2 + (y1 < 0) * 4 + (y1 > bottom) * 8
+        c2 = (x2 < 0) + (x2 > right) * 2 + (y2 < 0) * 4 + (y2 > bottom) * 8
+        if (c1 & c2) == 0 and (c1 | c2) != 0:
+            if c1 & 12:
+                a = 0 if c1 < 8 else bottom
+                x1 += int(float(a - y1) * (x2 - x1) / (y2 - y1))
+                y1 = a
+                c1 = (x1 < 0) + (x1 > right) * 2
+            if c2 & 12:
+                a = 0 if c2 < 8 else bottom
+                x2 += int(float(a - y2) * (x2 - x1) / (y2 - y1))
+                y2 = a
+                c2 = (x2 < 0) + (x2 > right) * 2
+            if (c1 & c2) == 0 and (c1 | c2) != 0:
+                if c1:
+                    a = 0 if c1 == 1 else right
+                    y1 += int(float(a - x1) * (y2 - y1) / (x2 - x1))
+                    x1 = a
+                    c1 = 0
+                if c2:
+                    a = 0 if c2 == 1 else right
+                    y2 += int(float(a - x2) * (y2 - y1) / (x2 - x1))
+                    x2 = a
+                    c2 = 0
+        return (c1 | c2) == 0, x1, y1, x2, y2
+
+    @numba.njit(cache=True)
+    def _draw_thin_line(array, x1, y1, x2, y2, color, rows):
+        """cv2's 4-connected line, for lines 1 pixel wide."""
+        height, width = array.shape[0], array.shape[1]
+        if not (0 <= x1 < width and 0 <= x2 < width and 0 <= y1 < height and 0 <= y2 < height):
+            visible, x1, y1, x2, y2 = _clip_line(width, height, x1, y1, x2, y2)
+            if not visible:
+                return
+        if x2 < x1:
+            x1, y1, x2, y2 = x2, y2, x1, y1
+        dx, dy = x2 - x1, y2 - y1
+        step_y = 1
+        if dy < 0:
+            dy, step_y = -dy, -1
+        vertical = dy > dx
+        if vertical:
+            dx, dy = dy, dx
+        if dx == 0:
+            _put_point(array, x1, y1, color, rows)
+            return
+
+        # cv2 steps along the long axis (j) whenever it's caught up on the short one (i), so after j steps along it,
+        # it's covered i from ceil((j - 1) * dy / dx) to ceil(j * dy / dx). that means each row can be found directly.
+        if vertical:
+            j_first, j_last = (rows[0] - y1, rows[1] - 1 - y1) if step_y > 0 else (y1 - rows[1] + 1, y1 - rows[0])
+        elif dy == 0:
+            j_first, j_last = 0, dx
+        else:
+            i_first, i_last = (rows[0] - y1, rows[1] - 1 - y1) if step_y > 0 else (y1 - rows[1] + 1, y1 - rows[0])
+            j_first, j_last = (i_first - 1) * dx // dy, i_last * dx // dy + 1
+        for j in range(max(0, j_first), min(dx, j_last) + 1):
+            i_start = 0 if j == 0 else ((j - 1) * dy + dx - 1) // dx
+            i_end = (j * dy + dx - 1) // dx
+            for i in range(i_start, i_end + 1):
+                if vertical:
+                    _put_point(array, x1 + i, y1 + step_y * j, color, rows)
+                else:
+                    _put_point(array, x1 + j, y1 + step_y * i, color, rows)
+
+    @numba.njit(cache=True)
+    def _draw_edge(array, x1, y1, x2, y2, color, rows):
+        """cv2's Line2, the outline of a polygon, with the points in 16.16 fixed point."""
+        visible, x1, y1, x2, y2 = _clip_line(array.shape[1] << XY_SHIFT, array.shape[0] << XY_SHIFT, x1, y1, x2, y2)
+        if not visible:
+            return
+        dx, dy = x2 - x1, y2 - y1
+        if abs(dx) > abs(dy):
+            if dx < 0:
+                x1, y1, x2, y2 = x2, y2, x1, y1
+                dy = -dy
+            step = _div(dy << XY_SHIFT, abs(dx) | 1)
+            count = (x2 - x1) >> XY_SHIFT
+        else:
+            if dy < 0:
+                x1, y1, x2, y2 = x2, y2, x1, y1
+                dx = -dx
+            step = _div(dx << XY_SHIFT, abs(dy) | 1)
+            count = (y2 - y1) >> XY_SHIFT
+        half = 1 << (XY_SHIFT - 1)
+        _put_point(array, (x2 + half) >> XY_SHIFT, (y2 + half) >> XY_SHIFT, color, rows)
+        x1 += half
+        y1 += half
+        if abs(dx) > abs(dy):
+            x1 >>= XY_SHIFT
+            # skipping straight to (about) where the line gets to the rows being drawn
+            first, last = 0, count
+            if step != 0:
+                k_a = ((rows[0] << XY_SHIFT) - y1) / step
+                k_b = ((rows[1] << XY_SHIFT) - y1) / step
+                first = max(first, int(math.floor(min(k_a, k_b))) - 1)
+                last = min(last, int(math.ceil(max(k_a, k_b))) + 1)
+            for k in range(first, last + 1):
+                _put_point(array, x1 + k, (y1 + k * step) >> XY_SHIFT, color, rows)
+        else:
+            y1 >>= XY_SHIFT
+            for k in range(max(0, rows[0] - y1), min(count, rows[1] - 1 - y1) + 1):
+                _put_point(array, (x1 + k * step) >> XY_SHIFT, y1 + k, color, rows)
+
+    @numba.njit(cache=True, inline="always")
+    def _next_edge(xs, ys, idx0, di, y, edges):
+        """Finds the next side of a polygon that goes below row y, going around it in direction di.
+        :return: (the index of the side's last point, the row it ends on, its x at row y, how much x changes per row,
+                 how many sides are left)
+        """
+        half = 1 << (XY_SHIFT - 1)
+        n = len(xs)
+        idx = (idx0 + di) % n
+        while edges > 0:
+            edges -= 1
+            end = (ys[idx] + half) >> XY_SHIFT
+            if end > y:
+                return idx, end, xs[idx0], _div((xs[idx] - xs[idx0]) * 2 + (end - y), 2 * (end - y)), edges
+            idx0 = idx
+            idx = (idx + di) % n
+        return idx0, y, xs[idx0], 0, edges - 1
+
+    @numba.njit(cache=True)
+    def _fill_quad(array, xs, ys, color, rows):
+        """cv2's FillConvexPoly, for 4 points in 16.16 fixed point."""
+        half = 1 << (XY_SHIFT - 1)
+        i_min = 0
+        for i in range(4):
+            _draw_edge(array, xs[i - 1], ys[i - 1], xs[i], ys[i], color, rows)
+            if ys[i] < ys[i_min]:
+                i_min = i
+        x_min = (min(xs[0], xs[1], xs[2], xs[3]) + half) >> XY_SHIFT
+        x_max = (max(xs[0], xs[1], xs[2], xs[3]) + half) >> XY_SHIFT
+        y_min = (ys[i_min] + half) >> XY_SHIFT
+        y_max = (max(ys[0], ys[1], ys[2], ys[3]) + half) >> XY_SHIFT
+        if x_max < 0 or y_max < 0 or x_min >= array.shape[1] or y_min >= array.shape[0]:
+            return
+        y_max = min(y_max, array.shape[0] - 1, rows[1] - 1)
+
+        # walking down both sides at the same time, one row at a time
+        idx_a = idx_b = i_min
+        end_a = end_b = y_min
+        x_a = x_b = dx_a = dx_b = 0
+        edges = 4
+        y = y_min
+        while y <= y_max:
+            if y >= end_a:
+                idx_a, end_a, x_a, dx_a, edges = _next_edge(xs, ys, idx_a, 1, y, edges)
+            if y >= end_b:
+                idx_b, end_b, x_b, dx_b, edges = _next_edge(xs, ys, idx_b, 3, y, edges)
+            if edges < 0:
+                break
+            if y < rows[0]:
+                # the sides are straight, so skip ahead to the first row being drawn (or the next corner)
+                skip = min(end_a, end_b, rows[0]) - y
+                x_a += dx_a * skip
+                x_b += dx_b * skip
+                y += skip
+                continue
+            _put_span(array, y, (min(x_a, x_b) + half) >> XY_SHIFT, (max(x_a, x_b) + half) >> XY_SHIFT, color, rows)
+            x_a += dx_a
+            x_b += dx_b
+            y += 1
+
+    @numba.njit(cache=True)
+    def _fill_circle(array, cx, cy, radius, color, rows):
+        """cv2's filled Circle."""
+        err, dx, dy, plus, minus = 0, radius, 0, 1, (radius << 1) - 1
+        while dx >= dy:
+            _put_span(array, cy - dy, cx - dx, cx + dx, color, rows)
+            _put_span(array, cy + dy, cx - dx, cx + dx, color, rows)
+            _put_span(array, cy - dx, cx - dy, cx + dy, color, rows)
+            _put_span(array, cy + dx, cx - dy, cx + dy, color, rows)
+            dy += 1
+            err += plus
+            plus += 2
+            if err > 0:
+                err -= minus
+                dx -= 1
+                minus -= 2
+
+    @numba.njit(parallel=True, nogil=True, cache=True)
+    def _draw_lines(array, points, colors, widths, order):
+        """Draws thick lines with round ends onto array, pixel for pixel the same as cv2.polylines with LINE_4.
+        :param points: an N x 2 x 2 array of the lines' endpoints, as (column, row).
+        :param order: the indices of the lines to draw, later ones on top of earlier ones.
+        """
+        height = array.shape[0]
+        n_blocks = (height + ROWS_PER_BLOCK - 1) // ROWS_PER_BLOCK
+        for block in numba.prange(n_blocks):
+            rows = (block * ROWS_PER_BLOCK, min(height, (block + 1) * ROWS_PER_BLOCK))
+            xs = numpy.empty(4, dtype=numpy.int64)
+            ys = numpy.empty(4, dtype=numpy.int64)
+            for i in order:
+                x1, y1 = numpy.int64(points[i, 0, 0]), numpy.int64(points[i, 0, 1])
+                x2, y2 = numpy.int64(points[i, 1, 0]), numpy.int64(points[i, 1, 1])
+                thickness = numpy.int64(widths[i])
+                radius = (thickness + 1) // 2
+                if max(y1, y2) + radius < rows[0] or min(y1, y2) - radius >= rows[1]:
+                    continue
+                color = colors[i]
+                if thickness <= 1:
+                    _draw_thin_line(array, x1, y1, x2, y2, color, rows)
+                    continue
+
+                # same as cv2's ThickLine, a rectangle with a circle on each end
+                if x1 != x2 or y1 != y2:
+                    dx, dy = float(x1 - x2), float(y2 - y1)
+                    r = (thickness + (thickness & 1)) * (1 << (XY_SHIFT - 1)) / math.sqrt(dx * dx + dy * dy)
+                    dp_x, dp_y = numpy.int64(numpy.rint(dy * r)), numpy.int64(numpy.rint(dx * r))
+                    x1s, y1s, x2s, y2s = x1 << XY_SHIFT, y1 << XY_SHIFT, x2 << XY_SHIFT, y2 << XY_SHIFT
+                    xs[0], ys[0] = x1s + dp_x, y1s + dp_y
+                    xs[1], ys[1] = x1s - dp_x, y1s - dp_y
+                    xs[2], ys[2] = x2s - dp_x, y2s - dp_y
+                    xs[3], ys[3] = x2s + dp_x, y2s + dp_y
+                    _fill_quad(array, xs, ys, color, rows)
+                _fill_circle(array, x1, y1, radius, color, rows)
+                _fill_circle(array, x2, y2, radius, color, rows)
+
+    @numba.njit(parallel=True, nogil=True, cache=True)
+    def _sum_rows(array, size, sums):
+        """Adds up size pixels around each pixel of each row of array, into sums."""
+        height, width, n_channels = array.shape
+        half = size // 2
+        for y in numba.prange(height):
+            totals = numpy.zeros(n_channels, dtype=numpy.int32)
+            for k in range(-half, size - half):
+                for c in range(n_channels):
+                    totals[c] += array[y, _reflect(k, width), c]
+            for x in range(width):
+                for c in range(n_channels):
+                    sums[y, x, c] = totals[c]
+                    totals[c] += numpy.int32(array[y, _reflect(x + size - half, width), c]) - \
+                        numpy.int32(array[y, _reflect(x - half, width), c])
+
+    @numba.njit(parallel=True, nogil=True, cache=True)
+    def _blur_columns(sums, size, n, array):
+        """Adds up size of the row sums around each pixel of each column, and puts the average of the n pixels that
+        makes into array. Columns are done in strips, so the memory gets read in order.
+        """
+        height, width, n_channels = array.shape
+        half = size // 2
+        # dividing by multiplying. the + 0.5 keeps it away from whole numbers, so it rounds the same as cv2 does
+        scale = 1 / n
+        n_strips = (width + COLUMNS_PER_STRIP - 1) // COLUMNS_PER_STRIP
+        for strip in numba.prange(n_strips):
+            strip_start = strip * COLUMNS_PER_STRIP
+            strip_end = min(width, strip_start + COLUMNS_PER_STRIP)
+            totals = numpy.full((strip_end - strip_start, n_channels), n // 2, dtype=numpy.int32)
+            for k in range(-half, size - half):
+                row = sums[_reflect(k, height)]
+                for x in range(strip_start, strip_end):
+                    for c in range(n_channels):
+                        totals[x - strip_start, c] += row[x, c]
+            for y in range(height):
+                row_in, row_out = sums[_reflect(y + size - half, height)], sums[_reflect(y - half, height)]
+                for x in range(strip_start, strip_end):
+                    for c in range(n_channels):
+                        array[y, x, c] = numpy.uint8((totals[x - strip_start, c] + 0.5) * scale)
+                        totals[x - strip_start, c] += row_in[x, c] - row_out[x, c]
+
+
+class JitNeonRenderer(neon.NeonRenderer):
+    """
+    A NeonRenderer that does the glow passes with numba instead of cv2. Needs numba to be installed.
+    """
+
+    def _draw_glow_lines(self, array, points, colors, widths, subset=None):
+        # same order as NeonRenderer draws them in, so the overlaps come out the same
+        groups = neon.NeonLineBatch.group_by_color_and_width(colors, widths)
+        order = numpy.concatenate([idxs for _, _, idxs in groups]) if len(groups) > 0 else numpy.zeros(0, numpy.int64)
+        if subset is not None:
+            order = order[subset[order]]
+        _draw_lines(array, points, colors, widths, order)
+
+    def _blur(self, array, kernel, scratch=None):
+        if kernel is None or kernel == (1, 1):
+            return
+        if scratch is None:
+            scratch = {}
+        # the glow and the highlights are different sizes, so they share one buffer that's big enough for either
+        if scratch.get("blur_sums") is None or scratch["blur_sums"].size < array.size:
+            scratch["blur_sums"] = numpy.empty(array.size, dtype=numpy.int32)
+        sums = scratch["blur_sums"][:array.size].reshape(array.shape)
+        # like cv2, the rows get added up first and everything gets rounded once at the end
+        _sum_rows(array, kernel[0], sums)
+        _blur_columns(sums, kernel[1], kernel[0] * kernel[1], array)
+
+
+def compare_with_cv2(lines: neon.NeonLineBatch, size, n_frames=10, **renderer_settings):
+    """Renders the lines with both versions, to check they match up and see which one's faster here.
+    :return: (the mean and the max difference between the two images, ms per frame with cv2, ms with numba)
+    """
+    import time
+
+    res = []
+    for renderer_class in (neon.NeonRenderer, JitNeonRenderer):
+        renderer = renderer_class(**renderer_settings)
+        buf = numpy.zeros((size[0], size[1], 3), dtype=numpy.uint8)
+        renderer.render_to_array(buf, lines)  # compiling, if it hasn't been yet
+        start_time = time.perf_counter()
+        for _ in range(n_frames):
+            renderer.render_to_array(buf, lines)
+        res.append((buf, (time.perf_counter() - start_time) / n_frames * 1000))
+
+    (cv2_buf, cv2_ms), (jit_buf, jit_ms) = res
+    diff = numpy.abs(cv2_buf.astype(numpy.int16) - jit_buf)
+    return diff.mean(), diff.max(), cv2_ms, jit_ms
+
+
+if __name__ == "__main__":
+    import random
+
+    if not AVAILABLE:
+        raise SystemExit("numba isn't installed")
+    print("INFO: using {} thread(s)".format(numba.get_num_threads()))
+
+    def random_lines(size, n):
+        points = [((random.uniform(0, size[0]), random.uniform(0, size[1])),
+                   (random.uniform(0, size[0]), random.uniform(0, size[1]))) for _ in range(n)]
+        colors = [tuple(random.choice(neon.ALL_COLORS))[:3] for _ in range(n)]
+        return neon.NeonLineBatch(points, colors, [random.randint(1, 3) for _ in range(n)])
+
+    random.seed(0)
+    for size in ((960, 540), (1920, 1080)):
+        for n_lines in (50, 500):
+            for bloom_downsample in (1, 2):
+                mean_diff, max_diff, cv2_ms, jit_ms = compare_with_cv2(
+                    random_lines(size, n_lines), size, kernel_reference_height=neon.REFERENCE_HEIGHT,
+                    bloom_downsample=bloom_downsample)
+                print("{}x{}, {} lines, downsampled {}x: mean difference {:.2f}, max {}, "
+                      "cv2 {:.1f} ms, numba {:.1f} ms".format(size[0], size[1], n_lines, bloom_downsample,
+                                                             mean_diff, max_diff, cv2_ms, jit_ms))
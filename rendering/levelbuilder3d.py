@@ -1,6 +1,8 @@
 from typing import List
+from collections import OrderedDict
 from pygame import Vector3, Vector2
 import math
+import numpy
 import os
 import traceback
 import json
@@ -11,29 +13,384 @@ import rendering.neon as neon
 import util.utility_functions as utility_functions
 
 
+# Note: the builders below all work in level-local space, meaning the level's rotation isn't baked into what they
+# build. It's applied by the camera instead (see Camera3D.roll), so geometry can be reused while the level rotates.
+
+
 def get_ring_points(z, level, rotation=None) -> List[Vector3]:
+    return [Vector3(p) for p in get_ring_array(z, level, rotation=rotation).tolist()]
+
+
+def get_ring_array(z, level, rotation=None) -> numpy.ndarray:
+    """Same as get_ring_points, but as an N x 3 array."""
+    return get_ring_arrays([z], level, rotation=rotation)[0]
+
+
+_CACHED_LANE_DIRECTIONS = {}  # number of lanes -> N x 2 array of unit vectors
+_CACHED_RINGS = OrderedDict()  # (number of lanes, z, radius, rotation) -> N x 3 array, least recently used first
+_MAX_CACHED_RINGS = 512
+
+
+def _get_lane_directions(n_lanes) -> numpy.ndarray:
+    if n_lanes not in _CACHED_LANE_DIRECTIONS:
+        angles = numpy.radians(numpy.arange(n_lanes) * 360 / n_lanes)
+        _CACHED_LANE_DIRECTIONS[n_lanes] = numpy.stack([numpy.cos(angles), numpy.sin(angles)], axis=1)
+    return _CACHED_LANE_DIRECTIONS[n_lanes]
+
+
+def get_ring_arrays(zs, level, rotation=None) -> numpy.ndarray:
+    """Finds the ring points at several z coordinates at once.
+    Recently used rings are cached, since neighboring cells share them.
+    :return: a len(zs) x N x 3 array.
+    """
     n = level.number_of_lanes()
-    radius = level.get_radius(z)
-    if rotation is None:
-        rotation = level.get_rotation(z)
+    res = numpy.empty((len(zs), n, 3), dtype=numpy.float32)
+
+    missing_idxs = []
+    missing_keys = []
+    for i, z in enumerate(zs):
+        key = (n, z, level.get_radius(z), level.get_rotation(z) if rotation is None else rotation)
+        ring = _CACHED_RINGS.get(key)
+        if ring is not None:
+            _CACHED_RINGS.move_to_end(key)
+            res[i] = ring
+        else:
+            missing_idxs.append(i)
+            missing_keys.append(key)
+
+    if len(missing_keys) > 0:
+        _, zs, radii, rotations = (numpy.array(vals, dtype=numpy.float32) for vals in zip(*missing_keys))
+
+        # rotate the (cached) unit directions by each ring's rotation, then scale them by its radius
+        directions = _get_lane_directions(n)
+        cos = numpy.cos(numpy.radians(rotations))[:, numpy.newaxis]
+        sin = numpy.sin(numpy.radians(rotations))[:, numpy.newaxis]
+        rings = numpy.empty((len(missing_keys), n, 3), dtype=numpy.float32)
+        rings[:, :, 0] = radii[:, numpy.newaxis] * (directions[:, 0] * cos - directions[:, 1] * sin)
+        rings[:, :, 1] = radii[:, numpy.newaxis] * (directions[:, 0] * sin + directions[:, 1] * cos)
+        rings[:, :, 2] = zs[:, numpy.newaxis]
+        res[missing_idxs] = rings
+
+        for key, ring in zip(missing_keys, rings):
+            _CACHED_RINGS[key] = ring
+        while len(_CACHED_RINGS) > _MAX_CACHED_RINGS:
+            _CACHED_RINGS.popitem(last=False)
+
+    return res
+
+
+def build_section(z, length, level, out: threedee.Line3DBuffer = None, lanes=None,
+                  longitudinal_edges=True) -> threedee.Line3DBuffer:
+    """Builds the lines of the level's surface between z and z + length.
+    :param out: if provided, the lines are appended to this buffer instead of a new one.
+    :param lanes: optional boolean array of which lanes to build (see get_visible_cells).
+    :param longitudinal_edges: whether to build the lines running along the z-axis, or just the far ring.
+    """
+    if out is None:
+        out = threedee.Line3DBuffer()
+    near_ring, far_ring = get_ring_arrays([z, z + length], level, rotation=0)
+
+    # for each lane, a line along the lane's edge and a line across its far end
+    pts = numpy.empty((len(near_ring), 2, 2, 3), dtype=numpy.float32)
+    pts[:, 0, 0] = near_ring
+    pts[:, 0, 1] = far_ring
+    pts[:, 1, 0] = far_ring
+    pts[:, 1, 1] = numpy.roll(far_ring, 1, axis=0)
+    if lanes is not None:
+        pts = pts[lanes]
+    if not longitudinal_edges:
+        pts = pts[:, 1]
+
+    return out.append_arrays(pts, level.get_color(z), 1)
+
+
+LOD_MERGE_PX = 8         # neighboring cells are merged into one section while it's shorter than this on screen
+LOD_MIN_EDGE_PX = 1      # sections shorter than this on screen don't get lines along the z-axis
+LOD_MAX_MERGE = 8        # the most cells that can be merged into one section (should be a power of 2)
+
+
+def get_section_lods(cell_start, cell_end, cell_length, level, camera, surface_size):
+    """Decides how to split the cells into sections, so that far away cells (which are only a few pixels long on
+    screen) can be merged together. Merged sections are aligned to their size, so they don't shimmer as the
+    camera moves.
+    :return: list of (first_cell, n_cells, longitudinal_edges), to pass along to build_section.
+    """
+    n_cells = cell_end - cell_start
+    if n_cells <= 0:
+        return []
+
+    # how far the ring at each cell boundary is from the previous one, on screen. the level's edges at the sides,
+    # top and bottom are used as probes, since that's where the rings move the most.
+    zs = (cell_start + numpy.arange(n_cells + 1)) * cell_length
+    radii = numpy.array([level.get_radius(z) for z in zs], dtype=numpy.float32)
+    probes = numpy.empty((n_cells + 1, 4, 3), dtype=numpy.float32)
+    probes[:, :, 0] = numpy.array((1, -1, 0, 0)) * radii[:, numpy.newaxis]
+    probes[:, :, 1] = numpy.array((0, 0, 1, -1)) * radii[:, numpy.newaxis]
+    probes[:, :, 2] = zs[:, numpy.newaxis]
+    screen_xy, w = camera.project_points_to_screen(surface_size, probes)
+    in_front = numpy.all(w > camera.get_near_clip_w(), axis=1)
+
+    def screen_length(first, last):
+        # on-screen length of the section from boundary first to boundary last
+        if not (in_front[first] and in_front[last]):
+            return float('inf')
+        return numpy.max(numpy.linalg.norm(screen_xy[last] - screen_xy[first], axis=1))
+
     res = []
-    for i in range(n):
-        p = Vector3(radius, 0, z)
-        p.rotate_ip(i * 360 / n + rotation, Vector3(0, 0, 1))
-        res.append(p)
+    i = cell_start
+    while i < cell_end:
+        k = 1
+        while (2 * k <= LOD_MAX_MERGE and i % (2 * k) == 0 and i + 2 * k <= cell_end
+               and screen_length(i - cell_start, i + 2 * k - cell_start) < LOD_MERGE_PX):
+            k *= 2
+        res.append((i, k, screen_length(i - cell_start, i + k - cell_start) >= LOD_MIN_EDGE_PX))
+        i += k
     return res
 
 
-def build_section(z, length, level) -> List[threedee.Line3D]:
-    ground_lines = []
-    near_ring = get_ring_points(z, level)
-    far_ring = get_ring_points(z + length, level)
+class CullingStats:
+    """Keeps count of how many (lane, cell)s get_visible_cells has checked, and how many it culled."""
+
+    def __init__(self):
+        self.checked = 0
+        self.culled = 0
+
+    def __repr__(self):
+        return "culled {}/{}".format(self.culled, self.checked)
+
+    def reset(self):
+        self.checked = 0
+        self.culled = 0
+
+
+def get_visible_cells(cell_start, cell_end, cell_length, level, camera, surface_size, height=0,
+                      stats: CullingStats = None) -> numpy.ndarray:
+    """Finds which (lane, cell)s of the level could be visible, so that nothing gets built for the ones that aren't.
+    :param height: how far the geometry in the cells extends towards the center of the level, as a fraction of the
+                   radius. 0 is enough for the level's surface, 1 covers anything standing in the lane.
+    :param stats: if provided, the results are counted into this.
+    :return: a lanes x cells boolean array, where [n, i] is whether (lane n, cell cell_start + i) may be visible.
+             Cell i's lane n is the same as the lines at index n of build_section's output.
+    """
+    n_lanes = level.number_of_lanes()
+    n_cells = cell_end - cell_start
+    if n_cells <= 0:
+        return numpy.zeros((n_lanes, 0), dtype=bool)
+    rings = get_ring_arrays([(cell_start + i) * cell_length for i in range(n_cells + 1)], level, rotation=0)
+
+    # bounding volume of each lane in each cell, from the corners of its patch of the level's surface
+    right = rings.transpose((1, 0, 2))  # lane x ring x 3
+    left = numpy.roll(right, 1, axis=0)
+    corners = [left[:, :-1], right[:, :-1], left[:, 1:], right[:, 1:]]
+    if height > 0:
+        corners.extend([c - height * c * numpy.array((1, 1, 0), dtype=numpy.float32) for c in corners])
+    volumes = numpy.stack(corners, axis=2)
+
+    res = camera.get_visibility_mask(surface_size, volumes)
+    if stats is not None:
+        stats.checked += res.size
+        stats.culled += res.size - numpy.count_nonzero(res)
+    return res
+
+
+class GeometryCache:
+    """
+    Holds on to level geometry between frames, so it only needs to be built once, when it comes into view.
+    Works as a drop-in replacement for build_section, and for build_obstacle on many obstacles at once. Should only be
+    used with a single level.
+    """
 
-    for i in range(level.number_of_lanes()):
-        ground_lines.append(threedee.Line3D(near_ring[i], far_ring[i], color=level.get_color(z)))
-        ground_lines.append(threedee.Line3D(far_ring[i], far_ring[i - 1], color=level.get_color(z)))
+    def __init__(self):
+        # both in the order they were built, which is (roughly) the order they pass behind the camera in
+        self._sections = OrderedDict()   # (z, length, longitudinal_edges) -> Line3DBuffer, with every lane
+        self._obstacles = OrderedDict()  # Obstacle -> Line3DBuffer
+
+    def clear(self):
+        self._sections.clear()
+        self._obstacles.clear()
+
+    def evict_before(self, z):
+        """Forgets the oldest geometry, for as long as it's completely behind the given z coordinate. Anything built
+        after something that's still in front sticks around until that's gone too, which doesn't take long since
+        things get built as they come into view.
+        """
+        while self._sections:
+            z_start, length, _ = next(iter(self._sections))
+            if z_start + length >= z:
+                break
+            self._sections.popitem(last=False)
+        while self._obstacles:
+            obs = next(iter(self._obstacles))
+            if obs.z + obs.length >= z:
+                break
+            self._obstacles.popitem(last=False)
+
+    def build_section(self, z, length, level, out: threedee.Line3DBuffer = None, lanes=None,
+                      longitudinal_edges=True) -> threedee.Line3DBuffer:
+        key = (z, length, longitudinal_edges)
+        if key not in self._sections:
+            self._sections[key] = build_section(z, length, level, longitudinal_edges=longitudinal_edges)
+        section = self._sections[key]
+
+        if out is None:
+            out = threedee.Line3DBuffer()
+        if lanes is None:
+            return out.extend(section)
+        else:
+            n_lanes = level.number_of_lanes()
+            lines_per_lane = len(section) // n_lanes
+            return out.append_arrays(section.points.reshape((n_lanes, lines_per_lane, 2, 3))[lanes],
+                                     section.colors.reshape((n_lanes, lines_per_lane, 3))[lanes].reshape((-1, 3)),
+                                     section.widths.reshape((n_lanes, lines_per_lane))[lanes].reshape((-1,)))
+
+    def build_obstacles(self, obstacles, level, player, out: threedee.Line3DBuffer = None) -> threedee.Line3DBuffer:
+        """Builds the obstacles in the order they're given, so they overlap properly."""
+        if out is None:
+            out = threedee.Line3DBuffer()
+
+        animating = [_is_animating(obs) for obs in obstacles]
+        still_obstacles = [obs for obs, is_animating in zip(obstacles, animating) if not is_animating]
+
+        # build all the new ones together, then split them up
+        for instances in _group_by_type([obs for obs in still_obstacles if obs not in self._obstacles]):
+            built = _build_obstacle_instances(instances, level)
+            lines_per_obs = len(built) // len(instances)
+            for i, obs in enumerate(instances):
+                self._obstacles[obs] = built[i * lines_per_obs:(i + 1) * lines_per_obs]
+
+        # runs of still obstacles in between the animating ones get appended all at once
+        run = []
+        for obs, is_animating in zip(obstacles, animating):
+            if is_animating:
+                self._append_cached(run, out)
+                run = []
+                self._obstacles.pop(obs, None)
+                build_obstacle(obs, level, player, out=out)
+            else:
+                run.append(self._obstacles[obs])
+        self._append_cached(run, out)
+        return out
+
+    @staticmethod
+    def _append_cached(cached, out: threedee.Line3DBuffer):
+        if len(cached) > 0:
+            out.append_arrays(numpy.concatenate([c.points for c in cached]),
+                              numpy.concatenate([c.colors for c in cached]),
+                              numpy.concatenate([c.widths for c in cached]))
+
+
+def can_project_sections_directly(level, camera, surface_size) -> bool:
+    """Whether project_sections can be used, which needs the level to be the same radius everywhere and the camera to
+    be looking straight down the z-axis."""
+    if not level.has_constant_radius():
+        return False
+    xform = camera.get_xform(surface_size)
+    return abs(xform[3, 0]) < 1e-9 and abs(xform[3, 1]) < 1e-9 and xform[3, 2] > 0
+
+
+def project_sections(sections, level, camera, surface, depth_shading=None, clip_margin=None):
+    """Same as building the sections with build_section and projecting them with Camera3D.project_batch_to_surface,
+    but without building anything in 3D first. Only works where can_project_sections_directly says so.
+
+    When the camera's looking straight down the z-axis, its w only depends on z. So every ring is the same polygon on
+    screen, just moved and scaled by its depth, and the lines along the z-axis are rays from the vanishing point.
+    :param sections: list of (z, length, lanes, longitudinal_edges), same as build_section's params.
+    :param clip_margin: same as Camera3D.project_batch_to_surface's.
+    :return: (points_2d, colors, inner_colors, widths), same as Camera3D.project_batch_to_surface.
+    """
+    screen_dims = surface.get_size()
+    if clip_margin is None:
+        clip_margin = neon.get_glow_margin(screen_dims, 1)
+    near_w = camera.get_near_clip_w()
+    xform = camera.get_xform(screen_dims).astype(numpy.float64)
+    n = level.number_of_lanes()
 
-    return ground_lines
+    # clipping against the near plane only ever moves the near end of a line along the z-axis, and it moves it to
+    # wherever w = near_w. sections whose far ring is behind that are dropped before projecting anything, since
+    # their rings can be at (or behind) the camera, where dividing by w blows up.
+    far_ws = numpy.array([z + length for z, length, _, _ in sections], dtype=numpy.float32).astype(numpy.float64) \
+        * xform[3, 2] + xform[3, 3]
+    sections = [section for section, w in zip(sections, far_ws) if w >= near_w]
+    if len(sections) == 0:
+        return (numpy.empty((0, 2, 2), dtype=numpy.float32), numpy.empty((0, 3), dtype=numpy.uint8),
+                numpy.empty((0, 3), dtype=numpy.uint8), numpy.empty((0,), dtype=numpy.float32))
+
+    near_zs = numpy.array([z for z, _, _, _ in sections], dtype=numpy.float32)
+    far_zs = numpy.array([z + length for z, length, _, _ in sections], dtype=numpy.float32)
+    lanes = numpy.array([numpy.ones(n, dtype=bool) if l is None else l for _, _, l, _ in sections], dtype=bool)
+    edges = numpy.array([e for _, _, _, e in sections], dtype=bool)
+
+    # the lanes' unit offsets from the ring's center, in clip space, which are the same for every ring
+    ring = get_ring_array(0, level, rotation=0)
+    ring_xy = ring[:, :2].astype(numpy.float64) @ xform[:2, :2].T
+
+    def to_screen(zs):
+        zs = zs.astype(numpy.float64)
+        w = zs * xform[3, 2] + xform[3, 3]
+        centers = zs[:, numpy.newaxis] * xform[:2, 2] + xform[:2, 3]
+        return (0.5 + (ring_xy + centers[:, numpy.newaxis]) / w[:, numpy.newaxis, numpy.newaxis]) * screen_dims
+
+    clip_z = (near_w - xform[3, 3]) / xform[3, 2]
+    near_rings = to_screen(numpy.maximum(near_zs, clip_z))
+    far_rings = to_screen(far_zs)
+
+    # same layout as build_section's output: for each lane, a line along its edge and a line across its far end
+    pts = numpy.empty((len(sections), n, 2, 2, 2), dtype=numpy.float64)
+    pts[:, :, 0, 0] = near_rings
+    pts[:, :, 0, 1] = far_rings
+    pts[:, :, 1, 0] = far_rings
+    pts[:, :, 1, 1] = numpy.roll(far_rings, 1, axis=1)
+    keep = numpy.repeat(lanes[:, :, numpy.newaxis], 2, axis=2)
+    keep[:, :, 0] &= edges[:, numpy.newaxis]
+
+    clip_rect = (-clip_margin, -clip_margin, screen_dims[0] + clip_margin, screen_dims[1] + clip_margin)
+    points_2d, on_screen = threedee.clip_segments_to_rect(pts[keep], clip_rect)
+    points_2d = points_2d.astype(numpy.float32)
+
+    colors = numpy.empty((len(sections), 1, 1, 3), dtype=numpy.uint8)
+    colors[:, 0, 0] = [tuple(level.get_color(z))[:3] for z, _, _, _ in sections]
+    colors = numpy.broadcast_to(colors, keep.shape + (3,))[keep][on_screen]
+
+    centers = None
+    if depth_shading is not None:
+        # the middle of each line in 3D (before clipping), same as project_batch_to_surface uses
+        centers = numpy.empty((len(sections), n, 2, 3), dtype=numpy.float32)
+        centers[:, :, 0, :2] = ring[:, :2]
+        centers[:, :, 0, 2] = ((near_zs + far_zs) / 2)[:, numpy.newaxis]
+        centers[:, :, 1, :2] = (ring[:, :2] + numpy.roll(ring[:, :2], 1, axis=0)) / 2
+        centers[:, :, 1, 2] = far_zs[:, numpy.newaxis]
+        centers = centers[keep][on_screen]
+    colors, inner_colors = camera.get_shaded_colors(centers, colors, depth_shading)
+
+    return points_2d, colors, inner_colors, numpy.ones(len(points_2d), dtype=numpy.float32)
+
+
+def project_level_surface(cell_start, cell_end, cell_length, level, camera, surface, depth_shading=None,
+                          geometry_cache: GeometryCache = None, stats: CullingStats = None,
+                          out: threedee.Line3DBuffer = None):
+    """Builds and projects the level's surface between two cells, skipping the parts that are out of view and merging
+    far away cells together (see get_visible_cells and get_section_lods).
+    Levels with a constant radius get projected directly (see project_sections), anything else is built in 3D first.
+    :param geometry_cache: if provided, sections that need to be built in 3D are built with this.
+    :param stats: if provided, culling results are counted into this.
+    :param out: if provided, sections that need to be built in 3D are appended to this buffer instead of a new one.
+    :return: (points_2d, colors, inner_colors, widths), same as Camera3D.project_batch_to_surface.
+    """
+    surface_size = surface.get_size()
+    visible = get_visible_cells(cell_start, cell_end, cell_length, level, camera, surface_size, stats=stats)
+    sections = [(i * cell_length, n_cells * cell_length,
+                 visible[:, i - cell_start:i - cell_start + n_cells].any(axis=1), longitudinal_edges)
+                for i, n_cells, longitudinal_edges in get_section_lods(cell_start, cell_end, cell_length, level,
+                                                                       camera, surface_size)]
+    if can_project_sections_directly(level, camera, surface_size):
+        return project_sections(sections, level, camera, surface, depth_shading=depth_shading)
+
+    if out is None:
+        out = threedee.Line3DBuffer()
+    build = geometry_cache.build_section if geometry_cache is not None else build_section
+    for z, length, lanes, longitudinal_edges in sections:
+        build(z, length, level, out=out, lanes=lanes, longitudinal_edges=longitudinal_edges)
+    return camera.project_batch_to_surface(surface, out.points, out.colors, out.widths, depth_shading=depth_shading)
 
 
 def get_rotation_to_make_lane_at_bottom(z, lane, level):
@@ -51,23 +408,46 @@ EXPLOSION_DURATION = 1  # second
 EXPLOSION_DIST = 0.75      # units
 EXPLOSION_ROT_SPEED = 20
 EXPLOSION_SRC_POINT = Vector3(0, 0, 0)
+EXPLOSION_KEYFRAMES = 32   # per EXPLOSION_DURATION, in between these are interpolated
+
+_CACHED_EXPLOSIONS = OrderedDict()  # (model's points, rotation speed) -> K x N x 2 x 3 array, least recently used first
+_MAX_CACHED_EXPLOSIONS = 64
+
+
+def get_explosion_frame(lines: threedee.Line3DBuffer, time_dead, rotation_speed=EXPLOSION_ROT_SPEED) -> threedee.Line3DBuffer:
+    """Same as blowing up the lines by EXPLOSION_DIST * (time_dead / EXPLOSION_DURATION), but the animation is only
+    computed once per model (at a fixed number of keyframes) and interpolated after that."""
+    if len(lines) == 0:
+        return lines
+    key = (lines.points.tobytes(), rotation_speed)
+    if key in _CACHED_EXPLOSIONS:
+        _CACHED_EXPLOSIONS.move_to_end(key)
+    else:
+        amounts = numpy.linspace(0, EXPLOSION_DIST, EXPLOSION_KEYFRAMES + 1)
+        _CACHED_EXPLOSIONS[key] = numpy.stack([blow_up(lines, EXPLOSION_SRC_POINT, a, rotation_speed=rotation_speed).points
+                                               for a in amounts])
+        if len(_CACHED_EXPLOSIONS) > _MAX_CACHED_EXPLOSIONS:
+            _CACHED_EXPLOSIONS.popitem(last=False)
+    keyframes = _CACHED_EXPLOSIONS[key]
 
+    t = min(max(time_dead / EXPLOSION_DURATION, 0), 1) * EXPLOSION_KEYFRAMES
+    i = min(int(t), EXPLOSION_KEYFRAMES - 1)
+    pts = keyframes[i] + (t - i) * (keyframes[i + 1] - keyframes[i])
+    return threedee.Line3DBuffer.from_arrays(pts, lines.colors, lines.widths, copy=False)
 
-def build_obstacle(obs, level, player) -> List[threedee.Line3D]:
+
+def build_obstacle(obs, level, player, out: threedee.Line3DBuffer = None) -> threedee.Line3DBuffer:
     model = obs.get_model()
 
     if not config.Debug.jumping_enemies:
         # This makes enemies explode when you slide through them.
         time_dead = obs.get_time_dead()
         if time_dead > 1:
-            return []  # it's gone
+            return out if out is not None else threedee.Line3DBuffer()  # it's gone
         elif time_dead <= 0:
             pass
         elif time_dead > 0:
-            model = blow_up(model,
-                            EXPLOSION_SRC_POINT,
-                            EXPLOSION_DIST * (time_dead / EXPLOSION_DURATION),
-                            rotation_speed=EXPLOSION_ROT_SPEED)
+            model = get_explosion_frame(model, time_dead, rotation_speed=EXPLOSION_ROT_SPEED)
     else:
         # this makes enemies jump when the player approaches, so the player slides underneath them
         # instead of killing them. It makes it a little more clear that you can't jump over them,
@@ -76,62 +456,90 @@ def build_obstacle(obs, level, player) -> List[threedee.Line3D]:
             z_range = 30
             z_dist = abs(obs.z - player.z)
             if z_dist < z_range:
-                model = [l.shift(dy=0.4 * (1 - z_dist / z_range)) for l in model]
+                model = model.shifted(dy=0.4 * (1 - z_dist / z_range))
     return align_shape_to_level_surface(model,
                                         obs.z,
                                         obs.z + obs.length,
                                         obs.lane,
                                         level,
-                                        obs.should_squeeze())
-
-
-def blow_up(lines: List[threedee.Line3D], from_pt: Vector3, amount, rotation_speed=30, axis=(0, 1)) -> List[threedee.Line3D]:
-    res = []
-    for l in lines:
-        c = l.center()
-        direction = c - from_pt
-        if direction.length() < 0.001 or amount == 0:
-            res.append(l)
-        else:
-            direction.scale_to_length(amount)
-            dx = direction.x if 0 in axis else 0
-            dy = direction.y if 1 in axis else 0
-            dz = direction.z if 2 in axis else 0
-            rot = rotation_speed * amount
-            if direction.x < 0:
-                rot = -rot
-            res.append(l.rotate_on_z_axis(rot).shift(dx, dy, dz))
-    return res
-
-
-def build_rect(z_start, length, level, lane_n, hover_height, color, width, with_x=False) -> List[threedee.Line3D]:
+                                        obs.should_squeeze(),
+                                        out=out)
+
+
+def _is_animating(obs):
+    return obs.get_time_dead() > 0 or (config.Debug.jumping_enemies and obs.should_rise_with_player())
+
+
+def _group_by_type(obstacles) -> List[list]:
+    # obstacles of the same type and color have the same model
+    by_type = {}
+    for obs in obstacles:
+        by_type.setdefault((type(obs), tuple(obs.get_color())), []).append(obs)
+    return list(by_type.values())
+
+
+def _build_obstacle_instances(instances, level, out: threedee.Line3DBuffer = None) -> threedee.Line3DBuffer:
+    """Builds obstacles that all share the first one's model, and aren't animating."""
+    return align_instances_to_level_surface(instances[0].get_model(),
+                                            [obs.z for obs in instances],
+                                            [obs.z + obs.length for obs in instances],
+                                            [obs.lane for obs in instances],
+                                            level,
+                                            [obs.should_squeeze() for obs in instances],
+                                            out=out)
+
+
+def blow_up(lines: threedee.Line3DBuffer, from_pt: Vector3, amount, rotation_speed=30, axis=(0, 1)) -> threedee.Line3DBuffer:
+    if amount == 0:
+        return lines
+    pts = lines.points
+    centers = (pts[:, 0] + pts[:, 1]) / 2
+    directions = centers - numpy.array(from_pt, dtype=numpy.float32)
+    dists = numpy.linalg.norm(directions, axis=1)
+    moving = dists >= 0.001
+
+    shifts = numpy.zeros_like(directions)
+    shifts[moving] = directions[moving] / dists[moving, numpy.newaxis] * amount
+    for i in range(3):
+        if i not in axis:
+            shifts[:, i] = 0
+
+    # spin each line around its center (in the xy-plane), in the direction it's flying
+    rots = numpy.where(directions[:, 0] < 0, -1, 1) * numpy.radians(rotation_speed * amount)
+    rots[~moving] = 0
+    cos, sin = numpy.cos(rots)[:, numpy.newaxis], numpy.sin(rots)[:, numpy.newaxis]
+    res = pts - centers[:, numpy.newaxis]
+    x, y = res[:, :, 0].copy(), res[:, :, 1].copy()
+    res[:, :, 0] = x * cos - y * sin
+    res[:, :, 1] = x * sin + y * cos
+    res += (centers + shifts)[:, numpy.newaxis]
+
+    return threedee.Line3DBuffer.from_arrays(res, lines.colors, lines.widths, copy=False)
+
+
+def build_rect(z_start, length, level, lane_n, hover_height, color, width, with_x=False,
+               out: threedee.Line3DBuffer = None) -> threedee.Line3DBuffer:
     """Builds a 3D rectangle lying flat against the surface of the level."""
-    near_ring = get_ring_points(z_start, level)
-    far_ring = get_ring_points(z_start + length, level)
-    corners = [near_ring[lane_n % level.number_of_lanes()],
-               near_ring[(lane_n - 1) % level.number_of_lanes()],
-               far_ring[(lane_n - 1) % level.number_of_lanes()],
-               far_ring[lane_n % level.number_of_lanes()]]
+    if out is None:
+        out = threedee.Line3DBuffer()
+    n = level.number_of_lanes()
+    near_ring, far_ring = get_ring_arrays([z_start, z_start + length], level, rotation=0)
+    corners = numpy.array([near_ring[lane_n % n],
+                           near_ring[(lane_n - 1) % n],
+                           far_ring[(lane_n - 1) % n],
+                           far_ring[lane_n % n]])
 
     # make the rect hover a bit
-    inset_corners = []
-    for c in corners:
-        hover_offset = Vector3(-c[0], -c[1], 0)
-        hover_offset.scale_to_length(hover_height)
-        inset_corners.append(c + hover_offset)
-
-    res = [
-        threedee.Line3D(inset_corners[0], inset_corners[1], color=color, width=width),
-        threedee.Line3D(inset_corners[1], inset_corners[2], color=color, width=width),
-        threedee.Line3D(inset_corners[2], inset_corners[3], color=color, width=width),
-        threedee.Line3D(inset_corners[3], inset_corners[0], color=color, width=width)
-    ]
+    hover_offsets = -corners[:, :2]
+    hover_offsets *= hover_height / numpy.linalg.norm(hover_offsets, axis=1)[:, numpy.newaxis]
+    inset_corners = corners.copy()
+    inset_corners[:, :2] += hover_offsets
 
+    idxs = [(0, 1), (1, 2), (2, 3), (3, 0)]
     if with_x:
-        res.append(threedee.Line3D(inset_corners[0], inset_corners[2], color=color, width=width))
-        res.append(threedee.Line3D(inset_corners[1], inset_corners[3], color=color, width=width))
+        idxs.extend([(0, 2), (1, 3)])
 
-    return res
+    return out.append_arrays(inset_corners[numpy.array(idxs)], color, width)
 
 
 _CACHED_PLAYER_ART = {}
@@ -197,14 +605,14 @@ def load_player_art(w=0.8, h=0.5):
                                                                    Vector3(norm_pts[1][0], norm_pts[1][1], 0)))
                             lines_for_frame_xflip.append(threedee.Line3D(Vector3(norm_pts_xflip[0][0], norm_pts_xflip[0][1], 0),
                                                                    Vector3(norm_pts_xflip[1][0], norm_pts_xflip[1][1], 0)))
-                frames.append(lines_for_frame)
-                frames.append(lines_for_frame_xflip)
+                frames.append(threedee.Line3DBuffer.from_lines(lines_for_frame))
+                frames.append(threedee.Line3DBuffer.from_lines(lines_for_frame_xflip))
             _CACHED_PLAYER_ART[anim_name] = frames
         except Exception:
             pass
 
 
-def get_player_shape_at_origin(player) -> List[threedee.Line3D]:
+def get_player_shape_at_origin(player) -> threedee.Line3DBuffer:
 
     player_mode = player.get_mode() if not player.is_dead() else player.get_last_mode_before_death()
 
@@ -229,32 +637,30 @@ def get_player_shape_at_origin(player) -> List[threedee.Line3D]:
         bot_left = Vector3(-width / 2.0, dist_from_ground, 0)
         bot_right = Vector3(width / 2.0, dist_from_ground, 0)
 
-        return [threedee.Line3D(top_left, top_right, color=color, width=width),
-                threedee.Line3D(top_right, bot_right, color=color, width=width),
-                threedee.Line3D(bot_right, bot_left, color=color, width=width),
-                threedee.Line3D(bot_left, top_left, color=color, width=width)]
+        return threedee.Line3DBuffer.from_lines([threedee.Line3D(top_left, top_right, color=color, width=width),
+                                                 threedee.Line3D(top_right, bot_right, color=color, width=width),
+                                                 threedee.Line3D(bot_right, bot_left, color=color, width=width),
+                                                 threedee.Line3D(bot_left, top_left, color=color, width=width)])
     else:
         frame_n = int(player.z) // 20
         all_frames = _CACHED_PLAYER_ART[art_to_use]
         lines_in_frame = all_frames[frame_n % len(all_frames)]
-        return [l.shift(dy=dist_from_ground, new_color=color, new_width=width) for l in lines_in_frame]
+        return lines_in_frame.shifted(dy=dist_from_ground, new_color=color, new_width=width)
 
 
-def get_player_shape(player, level) -> List[threedee.Line3D]:
+def get_player_shape(player, level, out: threedee.Line3DBuffer = None) -> threedee.Line3DBuffer:
     shape_2d = get_player_shape_at_origin(player)
     if player.is_dead():
         death_dur = player.get_time_dead()
         if death_dur > EXPLOSION_DURATION:
-            return []
+            return out if out is not None else threedee.Line3DBuffer()
         elif death_dur > 0:
-            shape_2d = blow_up(shape_2d,
-                               EXPLOSION_SRC_POINT,
-                               EXPLOSION_DIST * (death_dur / EXPLOSION_DURATION),
-                               2 * EXPLOSION_ROT_SPEED)
-    return align_shape_to_level_surface(shape_2d, player.z, player.z, player.lane, level, squeeze=False)
+            shape_2d = get_explosion_frame(shape_2d, death_dur, rotation_speed=2 * EXPLOSION_ROT_SPEED)
+    return align_shape_to_level_surface(shape_2d, player.z, player.z, player.lane, level, squeeze=False, out=out)
 
 
-def align_shape_to_level_surface(lines_to_xform: List[threedee.Line3D], z_start: float, z_end: float, lane_n: int, level, squeeze=False) -> List[threedee.Line3D]:
+def align_shape_to_level_surface(lines_to_xform: threedee.Line3DBuffer, z_start: float, z_end: float, lane_n: int, level,
+                                 squeeze=False, out: threedee.Line3DBuffer = None) -> threedee.Line3DBuffer:
     """
     :param lines_to_xform: the shape to transform
     :param z_start: z position of the object in the level
@@ -262,49 +668,64 @@ def align_shape_to_level_surface(lines_to_xform: List[threedee.Line3D], z_start:
     :param lane_n: lane the object is in
     :param squeeze: whether the object should be "squeezed" inward as it approaches the center of the level
                     (this is needed for things like walls that should meet each other cleanly at their boundaries).
-    :return: a new set of Line3Ds, aligned to the level
+    :param out: if provided, the transformed lines are appended to this buffer instead of a new one.
+    :return: the set of lines, aligned to the level
     """
-    if z_start == z_end:
-        z_end += 0.001
-
-    near_ring_pts = get_ring_points(z_start, level)
-    far_ring_pts = get_ring_points(z_end, level)
+    return align_instances_to_level_surface(lines_to_xform, [z_start], [z_end], [lane_n], level, [squeeze], out=out)
 
-    near_left = near_ring_pts[(lane_n - 1) % level.number_of_lanes()]
-    near_right = near_ring_pts[lane_n % level.number_of_lanes()]
-    near_top = Vector3(0, 0, z_start)
-    near_bottom = (near_left + near_right) / 2
 
-    near_normal_vec = near_top - near_bottom
-    near_normal_vec.scale_to_length(1)
-
-    far_left = far_ring_pts[(lane_n - 1) % level.number_of_lanes()]
-    far_right = far_ring_pts[lane_n % level.number_of_lanes()]
-    far_top = Vector3(0, 0, z_end)
-    far_bottom = (far_left + far_right) / 2
-
-    far_normal_vec = far_top - far_bottom
-    far_normal_vec.scale_to_length(1)
-
-    res = []
-
-    def convert_pt(pt):
-        z_factor = utility_functions.map_from_interval_to_interval(pt.z, [-1, 1], [0, 1])
-        vert_factor = pt.y
-        horz_factor = utility_functions.map_from_interval_to_interval(pt.x, [-1, 1], [0, 1])
-
-        if not squeeze:
-            near_pt = near_left + horz_factor * (near_right - near_left) + vert_factor * (near_top - near_bottom)
-            far_pt = far_left + horz_factor * (far_right - far_left) + vert_factor * (far_top - far_bottom)
-            return utility_functions.lerp(z_factor, near_pt, far_pt)
-        else:
-            near_pt = utility_functions.lerp(vert_factor, near_left + horz_factor * (near_right - near_left), near_top)
-            far_pt = utility_functions.lerp(vert_factor, far_left + horz_factor * (far_right - far_left), far_top)
-            return utility_functions.lerp(z_factor, near_pt, far_pt)
-
-    for l in lines_to_xform:
-        new_p1 = convert_pt(l.p1)
-        new_p2 = convert_pt(l.p2)
-        res.append(threedee.Line3D(new_p1, new_p2, color=l.color, width=l.width))
+def align_instances_to_level_surface(lines_to_xform: threedee.Line3DBuffer, z_starts, z_ends, lanes, level, squeezes,
+                                     out: threedee.Line3DBuffer = None) -> threedee.Line3DBuffer:
+    """Like align_shape_to_level_surface, but places several copies of the same shape at once.
+    :param z_starts: for each copy, the z position of the object in the level
+    :param z_ends: for each copy, the end z position of the object in the level
+    :param lanes: for each copy, the lane the object is in
+    :param squeezes: for each copy, whether the object should be "squeezed" inward
+    :return: the aligned lines of each copy, one after the other
+    """
+    if out is None:
+        out = threedee.Line3DBuffer()
+    k = len(z_starts)
+    if k == 0 or len(lines_to_xform) == 0:
+        return out
 
-    return res
+    n = level.number_of_lanes()
+    z_starts = numpy.array(z_starts, dtype=numpy.float32)
+    z_ends = numpy.array(z_ends, dtype=numpy.float32)
+    z_ends[z_starts == z_ends] += 0.001
+    lanes = numpy.array(lanes)
+
+    def get_basis(zs):
+        # each of these is a K x 1 x 1 x 3 array, one vector per instance
+        rings = get_ring_arrays(zs.tolist(), level, rotation=0)
+        left = rings[numpy.arange(k), (lanes - 1) % n]
+        right = rings[numpy.arange(k), lanes % n]
+        top = numpy.zeros_like(left)
+        top[:, 2] = zs
+        bottom = (left + right) / 2
+        return [v[:, numpy.newaxis, numpy.newaxis] for v in (left, right, top, bottom)]
+
+    near_left, near_right, near_top, near_bottom = get_basis(z_starts)
+    far_left, far_right, far_top, far_bottom = get_basis(z_ends)
+
+    # each of these is a 1 x N x 2 x 1 array, one factor per endpoint of the shape
+    pts = lines_to_xform.points[numpy.newaxis]
+    z_factor = numpy.clip((pts[..., 2:] + 1) / 2, 0, 1)
+    vert_factor = pts[..., 1:2]
+    horz_factor = (pts[..., 0:1] + 1) / 2
+
+    near_pts = near_left + horz_factor * (near_right - near_left)
+    far_pts = far_left + horz_factor * (far_right - far_left)
+
+    squeezes = numpy.array(squeezes, dtype=bool)[:, numpy.newaxis, numpy.newaxis, numpy.newaxis]
+    clipped_vert_factor = numpy.clip(vert_factor, 0, 1)
+    near_pts += numpy.where(squeezes,
+                            clipped_vert_factor * (near_top - near_pts),
+                            vert_factor * (near_top - near_bottom))
+    far_pts += numpy.where(squeezes,
+                           clipped_vert_factor * (far_top - far_pts),
+                           vert_factor * (far_top - far_bottom))
+
+    return out.append_arrays(near_pts + z_factor * (far_pts - near_pts),
+                             numpy.tile(lines_to_xform.colors, (k, 1)),
+                             numpy.tile(lines_to_xform.widths, k))
@@ -1,8 +1,15 @@
 from typing import List, Iterable
+import copy
+import os
+import concurrent.futures
+import weakref
 import pygame
 import cv2
 import numpy
 import config
+import rendering.postprocessing as postprocessing
+import rendering.governor as governor
+import rendering.presentation as presentation
 
 
 # taken from https://www.coolneon.com/wp-content/uploads/2014/11/color-chart.png
@@ -34,7 +41,7 @@ class NeonLine:
 
         self.vector_points = points
         # x and y are flipped intentionally... this is what cv2 understands, don't ask me~
-        self.np_points = numpy.array([[round(p.y), round(p.x)] for p in points], numpy.int32).reshape((-1, 1, 2))
+        self.np_points = numpy.rint(numpy.array(points, dtype=numpy.float64)[:, ::-1]).astype(numpy.int32).reshape((-1, 1, 2))
         self.width = width
         self.inner_width = inner_width or 1
         self.inner_color = inner_color or WHITE
@@ -47,6 +54,213 @@ class NeonLine:
         return [NeonLine([l.p1, l.p2], l.width, l.color, inner_color=l.inner_color) for l in line2ds]
 
 
+class NeonLineBatch:
+    """
+    A batch of straight line segments NeonRenderer can draw, stored as contiguous arrays.
+    """
+    def __init__(self,
+                 points: numpy.ndarray,
+                 colors: numpy.ndarray,
+                 widths: numpy.ndarray,
+                 inner_colors: numpy.ndarray = None,
+                 inner_widths: numpy.ndarray = None):
+        """
+        :param points: an N x 2 x 2 array of the segments' endpoints, in screen coordinates.
+        :param colors: an N x 3 array of the segments' colors.
+        :param widths: a length N array of the segments' widths.
+        :param inner_colors: an N x 3 array of the segments' highlight colors (defaults to WHITE).
+        :param inner_widths: a length N array of the segments' highlight widths (defaults to 1).
+        """
+        self.points = numpy.asarray(points, dtype=numpy.float32).reshape((-1, 2, 2))
+        # flipped, same as NeonLine.np_points
+        self.np_points = numpy.rint(self.points[:, :, ::-1]).astype(numpy.int32)
+
+        n = len(self.points)
+        self.colors = numpy.asarray(colors, dtype=numpy.uint8).reshape((n, 3))
+        self.widths = numpy.maximum(1, numpy.asarray(widths)).astype(numpy.int32).reshape((n,))
+
+        if inner_colors is None:
+            self.inner_colors = numpy.empty((n, 3), dtype=numpy.uint8)
+            self.inner_colors[:] = WHITE[:3]
+        else:
+            self.inner_colors = numpy.asarray(inner_colors, dtype=numpy.uint8).reshape((n, 3))
+
+        if inner_widths is None:
+            self.inner_widths = numpy.ones((n,), dtype=numpy.int32)
+        else:
+            self.inner_widths = numpy.maximum(1, numpy.asarray(inner_widths)).astype(numpy.int32).reshape((n,))
+
+    def __len__(self):
+        return len(self.points)
+
+    def with_colors(self, colors: numpy.ndarray, inner_colors: numpy.ndarray) -> 'NeonLineBatch':
+        """:return: a copy of the batch with different colors (the rest of the arrays are shared)."""
+        res = copy.copy(self)
+        res.colors = colors
+        res.inner_colors = inner_colors
+        return res
+
+    def scaled(self, factor) -> 'NeonLineBatch':
+        """:return: a copy of the batch for drawing onto a surface that's factor times the size."""
+        return NeonLineBatch(self.points * factor, self.colors, numpy.rint(self.widths * factor),
+                             inner_colors=self.inner_colors, inner_widths=numpy.rint(self.inner_widths * factor))
+
+    @staticmethod
+    def from_neon_lines(lines: Iterable[NeonLine]) -> 'NeonLineBatch':
+        """Packs NeonLines into a batch. Lines with more than two points are split into segments."""
+        points, colors, widths, inner_colors, inner_widths = [], [], [], [], []
+        for line in lines:
+            for i in range(len(line.vector_points) - 1):
+                points.append((line.vector_points[i], line.vector_points[i + 1]))
+                colors.append(tuple(line.color)[:3])
+                widths.append(line.width)
+                inner_colors.append(tuple(line.inner_color)[:3])
+                inner_widths.append(line.inner_width)
+        return NeonLineBatch(points, colors, widths, inner_colors=inner_colors, inner_widths=inner_widths)
+
+    @staticmethod
+    def group_by_color_and_width(colors: numpy.ndarray, widths: numpy.ndarray):
+        """Splits the segments into groups that can be drawn with a single call to cv2.polylines.
+        :return: a list of (color, width, indices), ordered by each group's first appearance.
+        """
+        if len(colors) == 0:
+            return []
+        rgb = colors.astype(numpy.int64)
+        keys = (widths.astype(numpy.int64) << 24) | (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+        _, first_idxs, group_of_each = numpy.unique(keys, return_index=True, return_inverse=True)
+
+        order = numpy.argsort(group_of_each, kind='stable')
+        counts = numpy.bincount(group_of_each)
+        idxs_per_group = numpy.split(order, numpy.cumsum(counts)[:-1])
+
+        res = []
+        for g in numpy.argsort(first_idxs, kind='stable'):
+            first = first_idxs[g]
+            res.append((tuple(colors[first].tolist()), int(widths[first]), idxs_per_group[g]))
+        return res
+
+
+REFERENCE_HEIGHT = 540  # the default kernel sizes look right at this resolution
+MAX_BLOOM_HEIGHT = 540  # when picking the bloom downsampling automatically, the glow won't be rendered any bigger than this
+
+
+_ALL_RENDERERS = weakref.WeakSet()  # so their temporal bloom can be reset all at once
+_GLOW_MARGINS = {}  # (surface size, line width, renderer settings) -> margin, see get_glow_margin
+
+
+def reset_temporal_buffers():
+    """Makes every renderer forget its previous frames' glow, so nothing trails over from the last thing on screen."""
+    for renderer in list(_ALL_RENDERERS):
+        renderer.reset_temporal_buffer()
+
+
+def scale_kernel(kernel, factor):
+    """Scales a blur kernel's size, keeping it odd. A kernel of None stays None."""
+    if kernel is None or factor == 1:
+        return kernel
+    res = []
+    for k in kernel:
+        k = max(1, round(k * factor))
+        res.append(k + (1 - k % 2))  # gotta be odd
+    return tuple(res)
+
+
+# indices of the red, green and blue channels in a native pixel format -> how to convert RGB into it
+RGB_TO_NATIVE = {
+    (2, 1, 0): cv2.COLOR_RGB2BGRA,
+    (0, 1, 2): cv2.COLOR_RGB2RGBA
+}
+
+
+def to_native_color(color, channels, n_channels):
+    """Converts an RGB color into a native pixel format.
+    :param channels: the indices of the red, green and blue channels in the format, or None if it's just RGB.
+    :param n_channels: the number of channels in the format.
+    """
+    if channels is None:
+        return color
+    res = [0] * n_channels
+    for channel, value in zip(channels, color):
+        res[channel] = value
+    return tuple(res)
+
+
+def get_native_pixel_view(surface: pygame.Surface):
+    """Gets the surface's pixels as an H x W x 4 array that can be drawn into directly, without any copying.
+    The surface stays locked for as long as the array is around.
+    :return: (the array, the indices of the red, green and blue channels), or (None, None) if the surface's
+             pixel format isn't supported.
+    """
+    if surface.get_bytesize() != 4 or surface.get_masks()[3] != 0 or pygame.get_sdl_byteorder() != pygame.LIL_ENDIAN:
+        return None, None
+    w, h = surface.get_size()
+    try:
+        # W x H pixels -> H x W pixels -> H x W x 4 bytes, all without copying
+        pixels = numpy.asarray(surface.get_view("2")).T.view(numpy.uint8).reshape((h, w, 4))
+    except (ValueError, pygame.error):
+        return None, None
+    channels = tuple(shift // 8 for shift in surface.get_shifts()[:3])
+    return pixels, channels
+
+
+def scale_surface(src: pygame.Surface, dst: pygame.Surface):
+    """Scales src to fill dst, with bilinear filtering."""
+    src_pixels, src_channels = get_native_pixel_view(src)
+    dst_pixels, dst_channels = get_native_pixel_view(dst)
+    if src_pixels is not None and dst_pixels is not None and src_channels == dst_channels:
+        res = cv2.resize(src_pixels, dst.get_size(), dst=dst_pixels, interpolation=cv2.INTER_LINEAR)
+        if res is not dst_pixels:
+            dst_pixels[...] = res
+        del src_pixels, dst_pixels
+    else:
+        del src_pixels, dst_pixels
+        pygame.transform.smoothscale(src, dst.get_size(), dst)
+
+
+def get_renderer_settings() -> dict:
+    """:return: the NeonRenderer constructor's arguments, based on the settings in config.Rendering."""
+    return {
+        "kernel_reference_height": REFERENCE_HEIGHT if config.Rendering.scale_bloom_with_resolution else None,
+        "bloom_downsample": config.Rendering.bloom_downsample,
+        "scanline_darkness": config.Rendering.scanline_darkness,
+        "threads": config.Rendering.threads,
+        "temporal_bloom": config.Rendering.temporal_bloom
+    }
+
+
+def get_renderer_class() -> type:
+    """:return: the NeonRenderer (sub)class for the algorithm picked in config.Rendering."""
+    if config.Rendering.neon_algorithm == "stamp":
+        import rendering.glowstamp as glowstamp  # these import this module
+        return glowstamp.GlowStampRenderer
+    if config.Rendering.neon_algorithm == "jit":
+        import rendering.jitneon as jitneon
+        if jitneon.AVAILABLE:
+            return jitneon.JitNeonRenderer
+        print("WARN: numba isn't installed, using the normal neon renderer")
+    return NeonRenderer
+
+
+def get_glow_margin(surface_size, line_width=4) -> int:
+    """:return: how far (in pixels) the glow of a line can reach past it, with the settings in config.Rendering. Lines
+                that are farther than this outside of the surface can't show up on it.
+    :param line_width: the width of the widest line. The default covers every line in the game.
+    """
+    settings = get_renderer_settings()
+    key = (tuple(surface_size), line_width, tuple(settings.items()))
+    if key not in _GLOW_MARGINS:
+        _GLOW_MARGINS[key] = NeonRenderer(**settings).get_glow_margin(surface_size, line_width)
+    return _GLOW_MARGINS[key]
+
+
+def create_renderer() -> 'NeonRenderer':
+    """Creates a NeonRenderer using the settings in config.Rendering."""
+    if config.Rendering.pipelined:
+        import rendering.pipelined as pipelined  # it imports this module
+        return pipelined.get_instance()
+    return get_renderer_class()(**get_renderer_settings())
+
+
 class NeonRenderer:
     """
     A class that renders lines with a cool neon effect.
@@ -55,52 +269,355 @@ class NeonRenderer:
     def __init__(self,
                  ambient_bloom_kernel=(15, 15),
                  mid_tone_bloom_kernel=(3, 3),
-                 highlight_bloom_kernel=None):
+                 highlight_bloom_kernel=None,
+                 kernel_reference_height=None,
+                 bloom_downsample=1,
+                 scanline_darkness=0,
+                 threads=1,
+                 temporal_bloom=0):
+        """
+        :param kernel_reference_height: if provided, the kernels are scaled by the surface's height divided by this.
+        :param bloom_downsample: the glow passes are drawn and blurred at 1 / this of the resolution, then scaled
+                                 back up underneath the full resolution highlights. Use 0 to pick it based on the
+                                 surface's size, so the glow is never bigger than MAX_BLOOM_HEIGHT.
+        :param scanline_darkness: a value from 0 to 1, how much to darken every other row of pixels by.
+        :param threads: if more than 1, the screen is split into horizontal bands that are rendered in parallel.
+                        Use 0 for one per CPU core.
+        :param temporal_bloom: a value from 0 to 1, how much of the previous frames' ambient glow to keep around.
+                               If it's more than 0, the ambient glow is blurred a little every frame and builds up
+                               over time instead of getting the full blur, which is cheaper and leaves trails behind
+                               things that move. Rendering in parallel is turned off, since the bands would drift
+                               apart over time.
+        """
         self.ambient_bloom_kernel = ambient_bloom_kernel
         self.mid_tone_bloom_kernel = mid_tone_bloom_kernel
         self.highlight_bloom_kernel = highlight_bloom_kernel
+        self.kernel_reference_height = kernel_reference_height
+        self.bloom_downsample = bloom_downsample
         self.darkness_factor = 1  # this is pretty krangled now, off by default~
+        self.scanline_darkness = scanline_darkness
+        self.threads = threads
+        self.temporal_bloom = temporal_bloom
 
         self._buf = None  # a buffer for intermediate drawing operations
-
-    def draw_lines(self, surface: pygame.Surface, lines: Iterable[NeonLine], extra_darkness_factor=1):
+        self._scaled_surface = None  # for rendering at a lower resolution than the screen's
+        self._scratch = {}  # buffers for the glow and such, kept between frames
+        self._band_scratch = []  # same, but for each band when rendering in parallel
+        self._executor = None
+        self._executor_threads = 0
+        _ALL_RENDERERS.add(self)
+
+    def get_glow_margin(self, size, line_width=1) -> int:
+        """:return: how far (in pixels) the glow of a line of the given width can reach past it, on a surface of the
+                    given size."""
+        kernel_scale = 1
+        if self.kernel_reference_height is not None:
+            kernel_scale = size[1] / self.kernel_reference_height
+        return self._get_band_overlap(kernel_scale, self.get_bloom_downsample(size)) + -(-line_width // 2)
+
+    def get_bloom_downsample(self, size) -> int:
+        if self.bloom_downsample > 0:
+            return self.bloom_downsample
+        res = 1
+        while size[1] / res > MAX_BLOOM_HEIGHT and res < 4:
+            res *= 2
+        return res
+
+    def draw_lines(self, surface: pygame.Surface, lines, extra_darkness_factor=1, tint=None, tint_amount=0):
         """Draws lines with a fancy neon effect.
         :param surface: the surface to draw them onto
-        :param lines: the lines to draw
+        :param lines: the lines to draw, either as a NeonLineBatch or an iterable of NeonLines.
         :param extra_darkness_factor: a value from 0 to 1 that will control the 'extra darkness' of the lines (0 being completely dark).
+        :param tint: a color to fade the lines towards.
+        :param tint_amount: a value from 0 to 1 that controls how much they're faded towards the tint.
         """
+        presentation.flush_text(surface)
+        lines = self.prepare_lines(lines, extra_darkness_factor, tint, tint_amount)
+
         if not config.Debug.use_neon:
-            for line in lines:
-                pygame.draw.lines(surface, line.color, False, line.vector_points, width=line.width)
+            self.draw_lines_without_neon(surface, lines)
             return
 
-        if self._buf is None or (self._buf.shape[0], self._buf.shape[1]) != surface.get_size():
-            self._buf = pygame.surfarray.array3d(surface)
+        scale = governor.get_instance().get_scale()
+        target = self.get_render_target(surface, scale)
+        if target is not surface:
+            lines = lines.scaled(scale)
+        self.render_to_surface(target, lines)
+        if target is not surface:
+            scale_surface(target, surface)
+
+    def get_render_target(self, surface: pygame.Surface, scale) -> pygame.Surface:
+        """:return: the surface to render onto, so it comes out at scale times the resolution of the given surface."""
+        if scale >= 1:
+            return surface
+        w, h = surface.get_size()
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        if (self._scaled_surface is None or self._scaled_surface.get_size() != size
+                or self._scaled_surface.get_bitsize() != surface.get_bitsize()):
+            self._scaled_surface = pygame.Surface(size, 0, surface)
+        return self._scaled_surface
+
+    def render_to_surface(self, surface: pygame.Surface, lines: NeonLineBatch):
+        """Renders the lines (with the neon effect) onto the surface, overwriting everything that was there."""
+        native_buf, channels = get_native_pixel_view(surface)
+        if native_buf is not None and channels in RGB_TO_NATIVE:
+            # draw straight into the surface's pixels, no copies needed
+            self.render_to_array(native_buf, lines, transposed=False, channels=channels)
+            del native_buf  # unlocks the surface, so it can be blitted onto again
+        else:
+            del native_buf
+            if self._buf is None or (self._buf.shape[0], self._buf.shape[1]) != surface.get_size():
+                self._buf = pygame.surfarray.array3d(surface)
+            self.render_to_array(self._buf, lines)
+            pygame.surfarray.blit_array(surface, self._buf)
+
+    def prepare_lines(self, lines, extra_darkness_factor=1, tint=None, tint_amount=0) -> NeonLineBatch:
+        """:return: the lines as a NeonLineBatch, with darkening and tinting applied to their colors."""
+        if not isinstance(lines, NeonLineBatch):
+            lines = NeonLineBatch.from_neon_lines(lines)
+
+        # darkening and tinting are done to the lines' colors, so they cost (basically) nothing
+        darkness_factor = self.darkness_factor * extra_darkness_factor
+        if postprocessing.affects_colors(darkness_factor, tint, tint_amount):
+            lines = lines.with_colors(postprocessing.apply_to_colors(lines.colors, darkness_factor, tint, tint_amount),
+                                      postprocessing.apply_to_colors(lines.inner_colors, darkness_factor, tint, tint_amount))
+        return lines
+
+    def draw_lines_without_neon(self, surface: pygame.Surface, lines: NeonLineBatch):
+        for (p1, p2), color, width in zip(lines.points.tolist(), lines.colors.tolist(), lines.widths.tolist()):
+            pygame.draw.line(surface, color, p1, p2, width=width)
+
+    def render_to_array(self, buf, lines: NeonLineBatch, transposed=True, channels=None):
+        """Renders the lines (with post processing) into an array, overwriting everything that was there.
+        :param buf: either a W x H x 3 RGB array (if transposed), or an H x W x 4 array in a native pixel format.
+        :param channels: for native pixel formats, the indices of the red, green and blue channels in buf.
+        """
+        size = (buf.shape[0], buf.shape[1]) if transposed else (buf.shape[1], buf.shape[0])
+        kernel_scale = 1
+        if self.kernel_reference_height is not None:
+            kernel_scale = size[1] / self.kernel_reference_height
+        downsample = self.get_bloom_downsample(size)
+
+        self._render(buf, lines, kernel_scale, downsample, transposed=transposed, channels=channels)
+        self._post_process(buf, transposed=transposed)
+
+    def _render(self, buf, lines: NeonLineBatch, kernel_scale, downsample, transposed=True, channels=None):
+        n_threads = self.threads if self.threads > 0 else (os.cpu_count() or 1)
+        if n_threads > 1 and self.temporal_bloom <= 0:
+            self._render_bands(buf, lines, kernel_scale, downsample, n_threads, transposed=transposed, channels=channels)
+        else:
+            self._render_passes(buf, lines, kernel_scale, downsample, transposed=transposed, channels=channels,
+                                scratch=self._scratch)
+
+    def _get_band_overlap(self, kernel_scale, downsample):
+        """:return: how far (in pixels) the blurring can spread a line's pixels."""
+        glow_radius = 0
+        for kernel in (self.ambient_bloom_kernel, self.mid_tone_bloom_kernel):
+            kernel = scale_kernel(kernel, kernel_scale / downsample)
+            if kernel is not None:
+                glow_radius += kernel[1] // 2
+        res = (glow_radius + 1) * downsample  # +1 for the bilinear upscaling
+        highlight_kernel = scale_kernel(self.highlight_bloom_kernel, kernel_scale)
+        if highlight_kernel is not None:
+            res += highlight_kernel[1] // 2
+        return res
+
+    def _render_bands(self, buf, lines: NeonLineBatch, kernel_scale, downsample, n_threads, transposed=True,
+                      channels=None):
+        """Splits the image into horizontal bands and renders each one on its own thread.
+        Each band is rendered with enough extra room around it that the glow bleeding in from the neighboring bands
+        comes out the same as it would if the whole image was rendered at once. Only the middle gets copied into buf.
+        """
+        height = buf.shape[1] if transposed else buf.shape[0]
+        overlap = self._get_band_overlap(kernel_scale, downsample)
+        overlap = -(-overlap // downsample) * downsample  # bands have to line up with the downsampled pixels
+
+        band_height = -(-height // n_threads)
+        band_height = max(-(-band_height // downsample) * downsample, overlap)
+
+        if self._executor is None or self._executor_threads != n_threads:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=n_threads)
+            self._executor_threads = n_threads
+
+        # lines get binned by the rows they cover
+        stroke_margin = max(int(lines.widths.max()), int(lines.inner_widths.max())) + 1 if len(lines) > 0 else 0
+        ys = lines.points[:, :, 1]
+        min_ys = ys.min(axis=1) - stroke_margin
+        max_ys = ys.max(axis=1) + stroke_margin
+
+        futures = []
+        for i, y_start in enumerate(range(0, height, band_height)):
+            y_end = min(height, y_start + band_height)
+            rows = (max(0, y_start - overlap), min(height, y_end + overlap))
+            lines_in_band = (max_ys >= rows[0]) & (min_ys < rows[1])
+            while len(self._band_scratch) <= i:
+                self._band_scratch.append({})
+            futures.append(self._executor.submit(self._render_band, buf, lines, kernel_scale, downsample,
+                                                 y_start, y_end, rows, lines_in_band, transposed, channels,
+                                                 self._band_scratch[i]))
+        for future in futures:
+            future.result()
+
+    def _render_band(self, buf, lines, kernel_scale, downsample, y_start, y_end, rows, lines_in_band,
+                     transposed, channels, scratch):
+        # Each band gets a full size buffer, even though only some of its rows are used. cv2 draws lines a little
+        # differently depending on where they get clipped, so they're only clipped at the edges of the screen,
+        # like normal, to keep the bands from having seams.
+        if scratch.get("band") is None or scratch["band"].shape != buf.shape:
+            scratch["band"] = numpy.zeros(buf.shape, dtype=numpy.uint8)
+        band_buf = scratch["band"]
+
+        self._render_passes(band_buf, lines, kernel_scale, downsample, transposed=transposed, channels=channels,
+                            scratch=scratch, rows=rows, subset=lines_in_band)
+
+        # the bands' middles don't overlap, so they can all be copied in at the same time
+        if transposed:
+            buf[:, y_start:y_end] = band_buf[:, y_start:y_end]
+        else:
+            buf[y_start:y_end] = band_buf[y_start:y_end]
+
+    def _render_passes(self, buf, lines: NeonLineBatch, kernel_scale, downsample, transposed=True, channels=None,
+                       scratch=None, rows=None, subset=None):
+        """Draws the lines into buf, overwriting everything that was there.
+        :param buf: either a W x H x 3 RGB array (if transposed), or an H x W x 4 array in a native pixel format.
+        :param channels: for native pixel formats, the indices of the red, green and blue channels in buf.
+        :param scratch: a dict to keep intermediate buffers in between calls.
+        :param rows: if provided, the (start, end) of the only rows of the screen that need to be drawn.
+                     The rest of buf is left with garbage in it.
+        :param subset: if provided, a mask of which lines to draw.
+        """
+        if scratch is None:
+            scratch = {}
+        height = buf.shape[1] if transposed else buf.shape[0]
+        if rows is None:
+            rows = (0, height)
 
-        # # fill screen with black
-        self._buf[...] = 0
+        def get_rows(array, start, end):
+            return array[:, start:end] if transposed else array[start:end]
+
+        points = lines.np_points if transposed else numpy.ascontiguousarray(lines.np_points[:, :, ::-1])
+
+        def groups(colors, widths):
+            # groups are made from all the lines, so they're drawn in the same order no matter the subset
+            for color, width, idxs in NeonLineBatch.group_by_color_and_width(colors, widths):
+                if subset is not None:
+                    idxs = idxs[subset[idxs]]
+                if len(idxs) > 0:
+                    yield color, width, idxs
 
         # Ghast's Neon Line Drawing AlgorithmTM
+        # each pass draws all the lines sharing a color and width with a single call.
+
+        # 1st and 2nd passes (the glow) get drawn in RGB (blurring 4 channels is a lot slower than 3),
+        # and at a lower resolution if downsampling
+        if downsample == 1 and channels is None:
+            glow_buf = buf
+            glow_points = points
+        else:
+            glow_size = (-(-buf.shape[0] // downsample), -(-buf.shape[1] // downsample), 3)
+            if scratch.get("glow") is None or scratch["glow"].shape != glow_size:
+                scratch["glow"] = numpy.zeros(glow_size, dtype=numpy.uint8)
+            glow_buf = scratch["glow"]
+            if downsample == 1:
+                glow_points = points
+            else:
+                glow_points = numpy.rint((lines.points[:, :, ::-1] if transposed else lines.points) / downsample).astype(numpy.int32)
+        glow_rows = get_rows(glow_buf, rows[0] // downsample, -(-rows[1] // downsample))
+
+        if downsample == 1:
+            glow_widths = lines.widths
+            glow_inner_widths = lines.inner_widths
+            glow_dimming = glow_inner_dimming = 1
+        else:
+            glow_widths = numpy.maximum(1, numpy.rint(lines.widths / downsample)).astype(numpy.int32)
+            glow_inner_widths = numpy.maximum(1, numpy.rint(lines.inner_widths / downsample)).astype(numpy.int32)
+            # lines that are too thin get rounded up to a whole (big) pixel, so dim them to keep the glow's brightness
+            glow_dimming = numpy.minimum(1, lines.widths / (glow_widths * downsample))
+            glow_inner_dimming = numpy.minimum(1, lines.inner_widths / (glow_inner_widths * downsample))
+
+        # # fill screen with black
+        glow_rows[...] = 0
 
         # 1st pass, draw large, dark, faint glow around line
-        for line in lines:
-            self.polylines(self._buf, [line.np_points], False, line.color.lerp((0, 0, 0), 0.15), line.width)
-        self._blur(self._buf, self.ambient_bloom_kernel)
+        dark_colors = numpy.rint(lines.colors * (0.85 * numpy.reshape(glow_dimming, (-1, 1)))).astype(numpy.uint8)
+        self._draw_glow_lines(glow_buf, glow_points, dark_colors, glow_widths, subset)
+        if self.temporal_bloom > 0:
+            self._accumulate_glow(glow_rows, scale_kernel(self.ambient_bloom_kernel, kernel_scale / downsample / 3),
+                                  scale_kernel(self.ambient_bloom_kernel, kernel_scale / downsample), scratch)
+        else:
+            self._blur(glow_rows, scale_kernel(self.ambient_bloom_kernel, kernel_scale / downsample), scratch)
 
         # 2nd pass, draw smaller, brighter glow
-        for line in lines:
-            self.polylines(self._buf, [line.np_points], False, line.color, line.inner_width)
-        self._blur(self._buf, self.mid_tone_bloom_kernel)
+        mid_colors = lines.colors if downsample == 1 else \
+            numpy.rint(lines.colors * numpy.reshape(glow_inner_dimming, (-1, 1))).astype(numpy.uint8)
+        self._draw_glow_lines(glow_buf, glow_points, mid_colors, glow_inner_widths, subset)
+        self._blur(glow_rows, scale_kernel(self.mid_tone_bloom_kernel, kernel_scale / downsample), scratch)
+
+        buf_rows = get_rows(buf, rows[0], rows[1])
+        if channels is not None:
+            # convert to the native format on the way into buf (and scale it up, if it's downsampled)
+            if downsample == 1:
+                cv2.cvtColor(glow_rows, RGB_TO_NATIVE[channels], dst=buf_rows)
+            else:
+                glow_size = glow_buf.shape[:2] + (4,)
+                if scratch.get("native_glow") is None or scratch["native_glow"].shape != glow_size:
+                    scratch["native_glow"] = numpy.zeros(glow_size, dtype=numpy.uint8)
+                native_glow_rows = get_rows(scratch["native_glow"], rows[0] // downsample, -(-rows[1] // downsample))
+                cv2.cvtColor(glow_rows, RGB_TO_NATIVE[channels], dst=native_glow_rows)
+                self._upscale(native_glow_rows, buf_rows, downsample, scratch)
+        elif downsample != 1:
+            self._upscale(glow_rows, buf_rows, downsample, scratch)
 
         # 3rd pass, draw anti-aliased highlight
-        for line in lines:
-            self.polylines(self._buf, [line.np_points], False, line.inner_color, line.inner_width, lineType=cv2.LINE_AA)
-        self._blur(self._buf, self.highlight_bloom_kernel)
-
-        # post processing effects
-        self._darken(self._buf, self.darkness_factor * extra_darkness_factor)
-
-        pygame.surfarray.blit_array(surface, self._buf)
+        for color, width, idxs in groups(lines.inner_colors, lines.inner_widths):
+            self.polylines(buf, points[idxs], False, to_native_color(color, channels, buf.shape[2]), width,
+                           lineType=cv2.LINE_AA)
+        self._blur(buf_rows, scale_kernel(self.highlight_bloom_kernel, kernel_scale), scratch)
+
+    def reset_temporal_buffer(self):
+        self._scratch.pop("temporal", None)
+
+    def _accumulate_glow(self, glow, kernel, full_kernel, scratch):
+        """Mixes the glow into the previous frames' glow, and blurs them together. Blurring a little bit every frame
+        adds up to a big blur for anything that stays still.
+        :param kernel: the kernel to blur with every frame.
+        :param full_kernel: the kernel to blur with when there's no previous frames to build on.
+        """
+        if scratch.get("temporal") is None or scratch["temporal"].shape != glow.shape:
+            self._blur(glow, full_kernel, scratch)  # starting over, so it doesn't have to build up from nothing
+            scratch["temporal"] = glow.copy()
+            return
+        # -0.5 so it rounds down, otherwise faint glows would get stuck instead of fading away
+        cv2.addWeighted(scratch["temporal"], self.temporal_bloom, glow, 1 - self.temporal_bloom, -0.5, dst=glow)
+        self._blur(glow, kernel, scratch)
+        scratch["temporal"][...] = glow
+
+    def _upscale(self, src, dst, factor, scratch):
+        """scales src up by exactly factor into dst, cutting off whatever doesn't fit."""
+        size = (src.shape[0] * factor, src.shape[1] * factor, src.shape[2])
+        if size == dst.shape:
+            # cv2 wants the size as (columns, rows)
+            cv2.resize(src, (size[1], size[0]), dst=dst, interpolation=cv2.INTER_LINEAR)
+        else:
+            if scratch.get("upscaled") is None or scratch["upscaled"].shape != size:
+                scratch["upscaled"] = numpy.zeros(size, dtype=numpy.uint8)
+            cv2.resize(src, (size[1], size[0]), dst=scratch["upscaled"], interpolation=cv2.INTER_LINEAR)
+            dst[...] = scratch["upscaled"][:dst.shape[0], :dst.shape[1]]
+
+    def _draw_glow_lines(self, array, points, colors, widths, subset=None):
+        """Draws the lines for one of the glow passes, on top of whatever's there.
+        :param array: an RGB image.
+        :param points: an N x 2 x 2 array of the lines' endpoints, as (column, row) in array.
+        :param subset: if provided, a mask of which lines to draw.
+        """
+        # groups are made from all the lines, so they're drawn in the same order no matter the subset
+        for color, width, idxs in NeonLineBatch.group_by_color_and_width(colors, widths):
+            if subset is not None:
+                idxs = idxs[subset[idxs]]
+            if len(idxs) > 0:
+                self.polylines(array, points[idxs], False, color, width)
 
     def polylines(self, array, pts, connected, color, width, lineType=cv2.LINE_4):
         """calls cv2.polylines with the given params.
@@ -108,22 +625,19 @@ class NeonRenderer:
         """
         cv2.polylines(array, pts, connected, color, width, lineType=lineType)
 
-    def _blur(self, array, kernel):
+    def _blur(self, array, kernel, scratch=None):
         """blurs the image using cv2.blur
         The only reason this method is split off like this is to make things easier to profile.
+        :param scratch: a dict to keep intermediate buffers in between calls, for subclasses that need them.
         """
         if kernel is not None:
             cv2.blur(array, kernel, dst=array)
 
-    def _darken(self, array, darkness_factor):
-        """darkens the image
-        :param darkness_factor: a value from 0 to 1 that determines how dark it will be
+    def _post_process(self, array, transposed=True):
+        """adds the effects that can't be done to the lines' colors (just scanlines, for now)
+        The only reason this method is split off like this is to make things easier to profile.
         """
-        if darkness_factor < 1:
-            # apparently multiplying by a float is too expensive (ask bydario~)
-            denominator = 100
-            numerator = int(darkness_factor * denominator)
-            array[...] = array // denominator * numerator
+        postprocessing.apply_scanlines(array, self.scanline_darkness, transposed=transposed)
 
 
 if __name__ == "__main__":
@@ -141,14 +655,13 @@ if __name__ == "__main__":
             [rand_pt(), rand_pt()],
             random.randint(1, 1),
             random.choice(ALL_COLORS)))
+    lines = NeonLineBatch.from_neon_lines(lines)
 
-    # values determined empirically
-    big_bloom = round(25 * W / 300)
-    big_bloom = big_bloom + (1 - big_bloom % 2)  # gotta be odd
-    mid_bloom = round(3 * W / 300)
-    mid_bloom = mid_bloom + (1 - mid_bloom % 2)  # gotta be odd
-    renderer = NeonRenderer(ambient_bloom_kernel=(big_bloom, big_bloom),
-                            mid_tone_bloom_kernel=(mid_bloom, mid_bloom))
+    # values determined empirically, the kernels get scaled up to fit the window
+    renderer = NeonRenderer(ambient_bloom_kernel=(25, 25),
+                            mid_tone_bloom_kernel=(3, 3),
+                            kernel_reference_height=200,
+                            bloom_downsample=0)
 
     pygame.init()
     pygame.display.set_mode((W, H), pygame.SCALED | pygame.RESIZABLE)
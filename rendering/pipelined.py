@@ -0,0 +1,309 @@
+import multiprocessing
+import multiprocessing.connection
+from multiprocessing import shared_memory
+import traceback
+import pygame
+import numpy
+import config
+import rendering.neon as neon
+import rendering.governor as governor
+import rendering.presentation as presentation
+
+
+# Renders the neon effect in a separate process, so the game can work on the next frame while the current one is
+# being rendered. Each frame's snapshot is the packed arrays of its projected lines, so the game objects never have
+# to be pickled: they go to the worker (and pixels come back) through shared memory, only a small header gets sent
+# through the pipe. Frames come out one frame late, except right after a flush().
+
+_instance = None
+
+WORKER_TIMEOUT = 5  # seconds to wait for a frame before giving up on the worker
+
+
+def get_instance():
+    global _instance
+    if _instance is None:
+        _instance = PipelinedNeonRenderer(**neon.get_renderer_settings())
+
+    return _instance
+
+
+def stop():
+    if _instance is not None:
+        _instance.stop()
+
+
+def flush():
+    """Throws away the frame that's waiting to be shown, so the next one drawn is shown right away. Call this when
+    switching modes, otherwise the first frame of the new mode would be the last one of the old mode."""
+    if _instance is not None:
+        _instance.flush()
+
+
+def _line_layout(capacity):
+    return [("points", (capacity, 2, 2), numpy.float32),
+            ("colors", (capacity, 3), numpy.uint8),
+            ("inner_colors", (capacity, 3), numpy.uint8),
+            ("widths", (capacity,), numpy.int32),
+            ("inner_widths", (capacity,), numpy.int32)]
+
+
+def _frame_layout(shape):
+    return [("pixels", shape, numpy.uint8)]
+
+
+class SharedArrays:
+    """A few numpy arrays, packed into one block of shared memory."""
+
+    def __init__(self, layout, name=None):
+        """
+        :param layout: a list of (name, shape, dtype) for each array.
+        :param name: the name of an existing block to attach to, or None to create a new one.
+        """
+        offsets = []
+        size = 0
+        for _, shape, dtype in layout:
+            size = -(-size // 16) * 16  # keep everything aligned
+            offsets.append(size)
+            size += int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize
+
+        self.layout = layout
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=max(1, size))
+        self.arrays = {}
+        for (array_name, shape, dtype), offset in zip(layout, offsets):
+            self.arrays[array_name] = numpy.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+
+    def get_name(self):
+        return self.shm.name
+
+    def close(self):
+        self.arrays = {}  # the memory can't be closed while anything still points into it
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _worker_main(conn, renderer_class, renderer_settings):
+    renderer = renderer_class(**renderer_settings)
+    lines_mem = None
+    frame_mem = None
+    try:
+        while True:
+            msg = conn.recv()
+            if msg is None:
+                break
+            frame_id, lines_name, capacity, n_lines, frame_name, frame_shape, transposed, channels, reset = msg
+            if reset:
+                renderer.reset_temporal_buffer()
+
+            if lines_mem is None or lines_mem.get_name() != lines_name:
+                if lines_mem is not None:
+                    lines_mem.close()
+                lines_mem = SharedArrays(_line_layout(capacity), name=lines_name)
+            if frame_mem is None or frame_mem.get_name() != frame_name:
+                if frame_mem is not None:
+                    frame_mem.close()
+                frame_mem = SharedArrays(_frame_layout(frame_shape), name=frame_name)
+
+            arrays = lines_mem.arrays
+            lines = neon.NeonLineBatch(arrays["points"][:n_lines],
+                                       arrays["colors"][:n_lines],
+                                       arrays["widths"][:n_lines],
+                                       inner_colors=arrays["inner_colors"][:n_lines],
+                                       inner_widths=arrays["inner_widths"][:n_lines])
+            renderer.render_to_array(frame_mem.arrays["pixels"], lines, transposed=transposed, channels=channels)
+            conn.send(frame_id)
+    except (EOFError, KeyboardInterrupt):
+        pass  # the game's gone
+    finally:
+        if lines_mem is not None:
+            lines_mem.close()
+        if frame_mem is not None:
+            frame_mem.close()
+
+
+class PipelinedNeonRenderer(neon.NeonRenderer):
+    """
+    A NeonRenderer that does its rendering in a worker process. Each call to draw_lines shows the lines from the
+    previous call, and hands the new ones off to the worker.
+    """
+
+    def __init__(self, **renderer_settings):
+        super().__init__(**renderer_settings)
+        self.renderer_settings = renderer_settings
+        self.neon_algorithm = config.Rendering.neon_algorithm
+
+        self._process = None
+        self._conn = None
+        self._lines_mem = None
+        self._frame_mem = None
+        self._frame_layout = None  # (shape, transposed, channels) of the frame in _frame_mem
+        self._frame_scale = 1  # the resolution scale the frame in _frame_mem was rendered at
+        self._pending_frame = None  # id of the frame the worker is working on, if any
+        self._next_frame_id = 0
+        self._broken = False  # if the worker died, everything is rendered normally instead
+        self._reset_worker = False  # whether the worker needs to reset its temporal bloom
+
+    def start(self):
+        if self._process is not None:
+            return
+        ctx = multiprocessing.get_context("spawn")  # forking a process with SDL in it is asking for trouble
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(target=_worker_main,
+                                    args=(child_conn, neon.get_renderer_class(), self.renderer_settings), daemon=True)
+        self._process.start()
+        child_conn.close()
+
+    def stop(self):
+        if self._process is not None:
+            try:
+                self._wait_for_pending_frame()
+                self._conn.send(None)
+            except (EOFError, OSError, TimeoutError):
+                pass
+            self._process.join(timeout=1)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._conn.close()
+            self._process = None
+            self._conn = None
+        self._pending_frame = None
+        for mem in (self._lines_mem, self._frame_mem):
+            if mem is not None:
+                mem.close()
+        self._lines_mem = None
+        self._frame_mem = None
+        self._frame_layout = None
+
+    def reset_temporal_buffer(self):
+        super().reset_temporal_buffer()
+        self._reset_worker = True
+
+    def flush(self):
+        self._discard_pending_frame()
+
+    def update_settings(self):
+        """Restarts the worker if the settings in config.Rendering have changed since it was started."""
+        renderer_settings = neon.get_renderer_settings()
+        if renderer_settings == self.renderer_settings and config.Rendering.neon_algorithm == self.neon_algorithm:
+            return
+        self.stop()
+        for name, value in renderer_settings.items():
+            setattr(self, name, value)
+        self.renderer_settings = renderer_settings
+        self.neon_algorithm = config.Rendering.neon_algorithm
+        self._scratch = {}
+        self._band_scratch = []
+        self._broken = False  # might as well give the worker another shot
+
+    def draw_lines(self, surface: pygame.Surface, lines, extra_darkness_factor=1, tint=None, tint_amount=0):
+        if self._broken or not config.Debug.use_neon:
+            self._discard_pending_frame()
+            super().draw_lines(surface, lines, extra_darkness_factor=extra_darkness_factor, tint=tint,
+                               tint_amount=tint_amount)
+            return
+
+        presentation.flush_text(surface)
+        lines = self.prepare_lines(lines, extra_darkness_factor, tint, tint_amount)
+        try:
+            self.update_settings()
+            self.start()
+            if self._pending_frame is not None:
+                self._present_pending_frame(surface)
+                self._submit_lines(surface, lines)
+            else:
+                # there's nothing to show yet, so this frame gets waited on instead of leaving the screen blank, then
+                # handed off again so the next call has something to show while the worker's busy
+                self._submit_lines(surface, lines)
+                self._present_pending_frame(surface)
+                self._submit_lines(surface, lines)
+        except (EOFError, OSError, TimeoutError):
+            print("ERROR: neon render worker died, rendering normally from now on")
+            traceback.print_exc()
+            self._broken = True
+            self.stop()
+            super().draw_lines(surface, lines)
+
+    def _submit_lines(self, surface: pygame.Surface, lines: neon.NeonLineBatch):
+        scale = governor.get_instance().get_scale()
+        target = self.get_render_target(surface, scale)
+        self._submit_frame(target, lines.scaled(scale) if target is not surface else lines)
+        self._frame_scale = scale
+
+    def _wait_for_pending_frame(self):
+        if self._pending_frame is None:
+            return
+        while True:
+            if not self._conn.poll(WORKER_TIMEOUT):
+                raise TimeoutError("neon render worker took too long")
+            if self._conn.recv() == self._pending_frame:
+                break
+        self._pending_frame = None
+
+    def _discard_pending_frame(self):
+        if self._pending_frame is not None:
+            try:
+                self._wait_for_pending_frame()
+            except (EOFError, OSError, TimeoutError):
+                self._broken = True
+                self.stop()
+
+    def _get_layout(self, surface: pygame.Surface):
+        native_buf, channels = neon.get_native_pixel_view(surface)
+        del native_buf
+        w, h = surface.get_size()
+        if channels in neon.RGB_TO_NATIVE:
+            return (h, w, 4), False, channels
+        return (w, h, 3), True, None
+
+    def _present_pending_frame(self, surface: pygame.Surface):
+        self._wait_for_pending_frame()
+
+        target = self.get_render_target(surface, self._frame_scale)
+        shape, transposed, channels = self._frame_layout
+        if (shape, transposed, channels) != self._get_layout(target):
+            surface.fill((0, 0, 0))  # the surface changed, so the frame's no good
+            return
+
+        pixels = self._frame_mem.arrays["pixels"]
+        if transposed:
+            pygame.surfarray.blit_array(target, pixels)
+        else:
+            native_buf, _ = neon.get_native_pixel_view(target)
+            native_buf[...] = pixels
+            del native_buf  # unlocks the surface
+        if target is not surface:
+            neon.scale_surface(target, surface)
+
+    def _submit_frame(self, surface: pygame.Surface, lines: neon.NeonLineBatch):
+        # the worker's done with the last frame at this point, so it's safe to write over its inputs
+        n = len(lines)
+        if self._lines_mem is None or self._lines_mem.arrays["points"].shape[0] < n:
+            if self._lines_mem is not None:
+                self._lines_mem.close()
+            capacity = 1024
+            while capacity < n:
+                capacity *= 2
+            self._lines_mem = SharedArrays(_line_layout(capacity))
+
+        layout = self._get_layout(surface)
+        if self._frame_mem is None or self._frame_layout != layout:
+            if self._frame_mem is not None:
+                self._frame_mem.close()
+            self._frame_mem = SharedArrays(_frame_layout(layout[0]))
+            self._frame_layout = layout
+
+        arrays = self._lines_mem.arrays
+        arrays["points"][:n] = lines.points
+        arrays["colors"][:n] = lines.colors
+        arrays["inner_colors"][:n] = lines.inner_colors
+        arrays["widths"][:n] = lines.widths
+        arrays["inner_widths"][:n] = lines.inner_widths
+
+        shape, transposed, channels = layout
+        self._pending_frame = self._next_frame_id
+        self._next_frame_id += 1
+        self._conn.send((self._pending_frame, self._lines_mem.get_name(), arrays["points"].shape[0], n,
+                         self._frame_mem.get_name(), shape, transposed, channels, self._reset_worker))
+        self._reset_worker = False
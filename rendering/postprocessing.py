@@ -0,0 +1,94 @@
+import cv2
+import numpy
+
+
+# Post processing effects, done with 256-entry lookup tables. Parameters are rounded off, so there's only so many
+# different tables and they can be reused between frames.
+#
+# Effects that only change colors (darkening, tinting) don't need to touch the image at all. The neon effect is
+# (pretty much) linear, so they can be applied to the lines' colors before they're drawn instead, which is free.
+# Only the effects that depend on where a pixel is (scanlines) need a pass over the image.
+
+_QUANTIZATION = 100
+_CACHED_LUTS = {}  # (darkness, tint, tint amount) -> 256 x 3 array, or (scanline darkness, n_channels) -> 256 x 1 x N
+_MAX_CACHED_LUTS = 256
+
+
+def _quantize(val):
+    return int(round(min(1, max(0, val)) * _QUANTIZATION))
+
+
+def _cache_lut(key, lut):
+    if len(_CACHED_LUTS) >= _MAX_CACHED_LUTS:
+        _CACHED_LUTS.clear()
+    _CACHED_LUTS[key] = lut
+    return lut
+
+
+def get_color_lut(darkness_factor=1, tint=None, tint_amount=0) -> numpy.ndarray:
+    """
+    :param darkness_factor: a value from 0 to 1 that determines how dark it will be (0 being completely dark).
+    :param tint: the color to fade towards.
+    :param tint_amount: a value from 0 to 1, how much to fade towards tint.
+    :return: a 256 x 3 lookup table, one column for each of red, green and blue.
+    """
+    darkness_q = _quantize(darkness_factor)
+    tint_q = tuple(tint)[:3] if tint is not None else (255, 255, 255)
+    tint_amount_q = _quantize(tint_amount) if tint is not None else 0
+
+    key = (darkness_q, tint_q, tint_amount_q)
+    if key in _CACHED_LUTS:
+        return _CACHED_LUTS[key]
+
+    # fading to a color is done by multiplying, so black stays black
+    multipliers = darkness_q / _QUANTIZATION * (1 + tint_amount_q / _QUANTIZATION * (numpy.array(tint_q) / 255 - 1))
+    lut = numpy.arange(256, dtype=numpy.float64)[:, numpy.newaxis] * multipliers
+    return _cache_lut(key, numpy.clip(numpy.rint(lut), 0, 255).astype(numpy.uint8))
+
+
+def get_scanline_lut(scanline_darkness, n_channels=3) -> numpy.ndarray:
+    """:return: a 256 x 1 x n_channels lookup table (usable with cv2.LUT) that darkens a row of pixels."""
+    scanline_q = _quantize(scanline_darkness)
+    key = (scanline_q, n_channels)
+    if key in _CACHED_LUTS:
+        return _CACHED_LUTS[key]
+
+    lut = numpy.rint(numpy.arange(256) * (1 - scanline_q / _QUANTIZATION)).astype(numpy.uint8)
+    return _cache_lut(key, numpy.tile(lut.reshape((256, 1, 1)), (1, 1, n_channels)))
+
+
+def affects_colors(darkness_factor=1, tint=None, tint_amount=0) -> bool:
+    return _quantize(darkness_factor) < _QUANTIZATION or (tint is not None and _quantize(tint_amount) > 0)
+
+
+def apply_to_colors(colors: numpy.ndarray, darkness_factor=1, tint=None, tint_amount=0) -> numpy.ndarray:
+    """
+    :param colors: an N x 3 array of RGB colors
+    :return: the colors, darkened and tinted.
+    """
+    if not affects_colors(darkness_factor, tint, tint_amount):
+        return colors
+    return get_color_lut(darkness_factor, tint, tint_amount)[colors, numpy.arange(3)]
+
+
+def apply_scanlines(buf: numpy.ndarray, scanline_darkness, transposed=True):
+    """Darkens every other row of pixels, in place.
+    :param buf: either a W x H x N array (if transposed) or an H x W x N array.
+    :param scanline_darkness: a value from 0 to 1, how much to darken the rows by.
+    """
+    if _quantize(scanline_darkness) == 0:
+        return
+    n_channels = buf.shape[2]
+    lut = get_scanline_lut(scanline_darkness, n_channels)
+    if not transposed:
+        # rows are the first axis, so every other row is just a strided view
+        odd_rows = buf[1::2]
+        cv2.LUT(odd_rows, lut, dst=odd_rows)
+    elif buf.shape[1] % 2 == 0 and buf.flags.c_contiguous:
+        # rows are the second axis, so pair each pixel up with the one below it and treat them as one big pixel
+        # whose second half gets darkened.
+        pairs = buf.reshape((buf.shape[0], buf.shape[1] // 2, 2 * n_channels))
+        identity = numpy.tile(numpy.arange(256, dtype=numpy.uint8).reshape((256, 1, 1)), (1, 1, n_channels))
+        cv2.LUT(pairs, numpy.concatenate([identity, lut], axis=2), dst=pairs)
+    else:
+        buf[:, 1::2] = lut[buf[:, 1::2], 0, numpy.arange(n_channels)]
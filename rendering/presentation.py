@@ -0,0 +1,154 @@
+import pygame
+import config
+
+
+# Gets finished frames onto the window. Everything is drawn onto a screen surface like normal, then either:
+#  - "surface": the screen is the window's own surface (pygame.SCALED), and SDL scales it when it's flipped.
+#  - "texture": the screen is a plain surface that gets streamed into a texture each frame, and SDL's renderer
+#    scales it to the window. Text is kept out of the screen, it's drawn on top from textures that get reused
+#    for as long as the text doesn't change. Works with SDL's software renderer too, so a GPU isn't needed.
+
+_instance = None
+
+_CACHED_TEXTS = {}  # (font: Font, text: str, antialias: bool, color: tuple) -> Surface
+MAX_CACHED_TEXTS = 256
+
+
+def get_instance():
+    global _instance
+    if _instance is None:
+        if config.Rendering.presentation == "texture":
+            _instance = TexturePresenter()
+        else:
+            _instance = SurfacePresenter()
+
+    return _instance
+
+
+def get_screen() -> pygame.Surface:
+    """:return: the surface to draw the frame onto. Use this instead of pygame.display.get_surface(), which is None
+                when presenting with textures."""
+    return get_instance().get_screen()
+
+
+def render_text(font: pygame.font.Font, text, antialias, color) -> pygame.Surface:
+    """Same as font.render, but the same text gives back the same surface (so it's only rendered once, and the
+    texture presentation can keep using the same texture for it)."""
+    key = (font, text, antialias, tuple(color))
+    if key not in _CACHED_TEXTS:
+        if len(_CACHED_TEXTS) >= MAX_CACHED_TEXTS:
+            _CACHED_TEXTS.clear()  # probably a counter or something, that isn't worth keeping around
+        _CACHED_TEXTS[key] = font.render(text, antialias, color)
+    return _CACHED_TEXTS[key]
+
+
+def blit_text(screen: pygame.Surface, text_surface: pygame.Surface, dest):
+    """Draws text (or anything else that doesn't change much) on top of what's been drawn so far.
+    :param text_surface: preferably from render_text, so it doesn't need a new texture every frame.
+    :param dest: where its top left corner goes, as (x, y) or a Rect.
+    """
+    get_instance().blit_text(screen, text_surface, dest)
+
+
+def flush_text(screen: pygame.Surface):
+    """Puts the text drawn with blit_text so far into the screen itself. Anything that draws onto the screen has to
+    call this first, so it ends up on top of that text (instead of the text being drawn over everything at the end)."""
+    get_instance().flush_text(screen)
+
+
+class SurfacePresenter:
+    """Presents frames the plain pygame way, by flipping the display surface."""
+
+    def create_window(self, size, title, icon=None):
+        pygame.display.set_mode(size, pygame.SCALED | pygame.RESIZABLE)
+        self.set_caption(title)
+        if icon is not None:
+            pygame.display.set_icon(icon)
+
+    def get_screen(self) -> pygame.Surface:
+        return pygame.display.get_surface()
+
+    def set_caption(self, caption):
+        pygame.display.set_caption(caption)
+
+    def blit_text(self, screen, text_surface, dest):
+        screen.blit(text_surface, dest)
+
+    def flush_text(self, screen):
+        pass  # it's already in there
+
+    def present(self):
+        pygame.display.flip()
+
+
+class TexturePresenter:
+    """Presents frames through pygame._sdl2's Renderer, with the screen streamed into one texture."""
+
+    def __init__(self):
+        self.window = None
+        self.renderer = None
+        self.screen = None
+        self.screen_texture = None
+        self.text_textures = {}  # text surface -> Texture
+        self.texts = []  # (Texture, Rect, text surface) to draw on top of this frame
+
+    def create_window(self, size, title, icon=None):
+        from pygame._sdl2 import video
+
+        if self.window is None:
+            self.window = video.Window(title, size, resizable=True)
+            try:
+                self.renderer = video.Renderer(self.window)
+            except pygame.error:
+                print("WARN: couldn't create an SDL renderer, trying the software one")
+                self.renderer = video.Renderer(self.window, accelerated=0)
+        else:
+            self.window.size = size
+        self.set_caption(title)
+        if icon is not None:
+            self.window.set_icon(icon)
+
+        # the renderer does the scaling (and letterboxing) to whatever size the window really is
+        self.renderer.logical_size = size
+        self.screen = pygame.Surface(size, depth=32)
+        self.screen_texture = video.Texture(self.renderer, size, streaming=True)
+        self.text_textures.clear()
+        self.texts.clear()
+
+    def get_screen(self) -> pygame.Surface:
+        return self.screen
+
+    def set_caption(self, caption):
+        if self.window is not None:
+            self.window.title = caption
+
+    def blit_text(self, screen, text_surface, dest):
+        if screen is not self.screen:
+            screen.blit(text_surface, dest)  # drawing into something else, it's not going straight onto the window
+            return
+        if text_surface not in self.text_textures:
+            from pygame._sdl2 import video
+            self.text_textures[text_surface] = video.Texture.from_surface(self.renderer, text_surface)
+        self.texts.append((self.text_textures[text_surface], pygame.Rect(dest[0], dest[1], *text_surface.get_size()),
+                           text_surface))
+
+    def flush_text(self, screen):
+        if screen is not self.screen:
+            return
+        # something's about to be drawn over the text, so it can't wait to be drawn from its texture at the end
+        for _, rect, text_surface in self.texts:
+            screen.blit(text_surface, rect)
+        self.texts.clear()
+
+    def present(self):
+        self.screen_texture.update(self.screen)
+        self.renderer.clear()
+        self.screen_texture.draw()
+        for texture, rect, _ in self.texts:
+            texture.draw(dstrect=rect)
+        self.renderer.present()
+
+        # only keep the textures for text that's still being shown
+        used = set(texture for texture, _, _ in self.texts)
+        self.text_textures = {surface: texture for surface, texture in self.text_textures.items() if texture in used}
+        self.texts.clear()
@@ -57,6 +57,137 @@ class Line3D:
         return res
 
 
+class Line3DBuffer:
+    """
+    A growable, array-backed list of 3D line segments. Builders append into these instead of allocating a Line3D
+    for every segment. Slices share memory with the buffer they came from.
+    """
+
+    def __init__(self, capacity=64):
+        self._points = numpy.empty((capacity, 2, 3), dtype=numpy.float32)
+        self._colors = numpy.empty((capacity, 3), dtype=numpy.uint8)
+        self._widths = numpy.empty((capacity,), dtype=numpy.float32)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return "{}(size={})".format(type(self).__name__, self._size)
+
+    def __getitem__(self, item) -> 'Line3DBuffer':
+        if not isinstance(item, slice):
+            raise TypeError("{} only supports slicing, not: {}".format(type(self).__name__, item))
+        return Line3DBuffer.from_arrays(self.points[item], self.colors[item], self.widths[item], copy=False)
+
+    @property
+    def points(self) -> numpy.ndarray:
+        """N x 2 x 3 float32 array of the segments' endpoints."""
+        return self._points[:self._size]
+
+    @property
+    def colors(self) -> numpy.ndarray:
+        """N x 3 uint8 array of the segments' colors."""
+        return self._colors[:self._size]
+
+    @property
+    def widths(self) -> numpy.ndarray:
+        """Length N float32 array of the segments' widths."""
+        return self._widths[:self._size]
+
+    def clear(self):
+        """Empties the buffer, keeping its memory around for reuse."""
+        self._size = 0
+
+    def _reserve(self, n):
+        if self._size + n > len(self._points):
+            capacity = max(self._size + n, 2 * len(self._points), 16)
+            points = numpy.empty((capacity, 2, 3), dtype=numpy.float32)
+            colors = numpy.empty((capacity, 3), dtype=numpy.uint8)
+            widths = numpy.empty((capacity,), dtype=numpy.float32)
+            points[:self._size] = self.points
+            colors[:self._size] = self.colors
+            widths[:self._size] = self.widths
+            self._points, self._colors, self._widths = points, colors, widths
+
+    def append_arrays(self, points, colors, widths) -> 'Line3DBuffer':
+        """Appends segments to the end of the buffer.
+        :param points: an N x 2 x 3 array of endpoints.
+        :param colors: an N x 3 array of colors, or a single color for all of them.
+        :param widths: a length N array of widths, or a single width for all of them.
+        :return: this buffer
+        """
+        points = numpy.asarray(points, dtype=numpy.float32).reshape((-1, 2, 3))
+        n = len(points)
+        self._reserve(n)
+        start, end = self._size, self._size + n
+        self._points[start:end] = points
+        if isinstance(colors, pygame.Color):
+            colors = colors[:3]
+        self._colors[start:end] = numpy.asarray(colors, dtype=numpy.uint8)[..., :3]
+        self._widths[start:end] = widths
+        self._size = end
+        return self
+
+    def extend(self, other: 'Line3DBuffer') -> 'Line3DBuffer':
+        """Appends all of another buffer's segments to this one.
+        :return: this buffer
+        """
+        return self.append_arrays(other.points, other.colors, other.widths)
+
+    def append_lines(self, lines: List[Line3D]) -> 'Line3DBuffer':
+        """Appends a list of Line3Ds to this buffer.
+        :return: this buffer
+        """
+        points, colors, widths = pack_lines(lines)
+        return self.append_arrays(points, colors, widths)
+
+    def shifted(self, dx=0, dy=0, dz=0, new_color=None, new_width=None) -> 'Line3DBuffer':
+        """Like Line3D.shift, but for every segment in the buffer at once."""
+        return Line3DBuffer.from_arrays(self.points + numpy.array((dx, dy, dz), dtype=numpy.float32),
+                                        self.colors if new_color is None else new_color,
+                                        self.widths if new_width is None else new_width)
+
+    def to_lines(self) -> List[Line3D]:
+        res = []
+        for (p1, p2), color, width in zip(self.points.tolist(), self.colors.tolist(), self.widths.tolist()):
+            res.append(Line3D(Vector3(p1), Vector3(p2), color=pygame.Color(color), width=width))
+        return res
+
+    @staticmethod
+    def from_arrays(points, colors, widths, copy=True) -> 'Line3DBuffer':
+        """Creates a buffer holding the given segments.
+        :param copy: if False and the arrays are already full-sized and of the right types (N x 2 x 3 float32,
+                     N x 3 uint8 and length N float32), the buffer will use them directly instead of copying them.
+                     Anything else gets copied. Appending to the buffer later moves it to arrays of its own, so it
+                     never writes into the given ones.
+        """
+        if (not copy and isinstance(points, numpy.ndarray) and points.dtype == numpy.float32
+                and points.ndim == 3 and points.shape[1:] == (2, 3)
+                and isinstance(colors, numpy.ndarray) and colors.dtype == numpy.uint8
+                and colors.shape == (len(points), 3)
+                and isinstance(widths, numpy.ndarray) and widths.dtype == numpy.float32
+                and widths.shape == (len(points),)):
+            res = Line3DBuffer(capacity=0)
+            res._points, res._colors, res._widths = points, colors, widths
+            res._size = len(points)
+            return res
+        else:
+            return Line3DBuffer(capacity=len(points)).append_arrays(points, colors, widths)
+
+    @staticmethod
+    def from_lines(lines: List[Line3D]) -> 'Line3DBuffer':
+        return Line3DBuffer(capacity=len(lines)).append_lines(lines)
+
+    @staticmethod
+    def concatenate(buffers: Iterable['Line3DBuffer']) -> 'Line3DBuffer':
+        buffers = list(buffers)
+        res = Line3DBuffer(capacity=sum(len(b) for b in buffers))
+        for b in buffers:
+            res.extend(b)
+        return res
+
+
 class Line2D:
 
     def __init__(self, p1: Vector2, p2: Vector2, color=neon.WHITE, inner_color=None, width=1):
@@ -113,6 +244,16 @@ def get_matrix_looking_at(eye_xyz, target_xyz, up_vec):
     return res
 
 
+def z_rotation_matrix(angle_degrees):
+    """Rotates points around the z-axis, the same way Vector3.rotate(angle, Vector3(0, 0, 1)) does."""
+    c = math.cos(math.radians(angle_degrees))
+    s = math.sin(math.radians(angle_degrees))
+    return numpy.array([[c, -s, 0, 0],
+                        [s, c, 0, 0],
+                        [0, 0, 1, 0],
+                        [0, 0, 0, 1]], dtype=numpy.float32)
+
+
 class Camera3D:
 
     def __init__(self):
@@ -120,57 +261,207 @@ class Camera3D:
         self.direction: Vector3 = Vector3(0, 0, 1)
         self.up: Vector3 = Vector3(0, -1, 0)
         self.fov_degrees: float = 45  # vertical field of view
+        self.z_near: float = 0.5  # anything closer to the camera than this gets clipped
+        self.z_far: float = 100000
+
+        # rotation (in degrees) applied to everything around the world's z-axis, before it's viewed. this lets
+        # geometry be built without the level's rotation baked in (and reused while the level rotates).
+        self.roll: float = 0
 
     def __repr__(self):
-        return "{}(pos={}, dir={})".format(type(self).__name__, self.position, self.direction)
+        return "{}(pos={}, dir={}, roll={})".format(type(self).__name__, self.position, self.direction, self.roll)
 
     def get_xform(self, surface_size):
         view_mat = get_matrix_looking_at(self.position, self.position + self.direction, self.up)
-        proj_mat = perspective_matrix(self.fov_degrees / 180 * math.pi, surface_size[0] / surface_size[1], 0.5, 100000)
-        return proj_mat @ view_mat
+        proj_mat = perspective_matrix(self.fov_degrees / 180 * math.pi, surface_size[0] / surface_size[1],
+                                      self.z_near, self.z_far)
+        if self.roll == 0:
+            return proj_mat @ view_mat
+        else:
+            return proj_mat @ view_mat @ z_rotation_matrix(self.roll)
+
+    def get_near_clip_w(self) -> float:
+        """:return: the w (see get_xform) of points on the near plane. Points with a smaller w are closer than z_near,
+                    or behind the camera."""
+        # perspective_matrix makes w = depth * 2 * z_far * z_near / (z_far - z_near)
+        return self.z_near * 2 * self.z_far * self.z_near / (self.z_far - self.z_near)
+
+    def project_points_to_screen(self, surface_size, points: numpy.ndarray):
+        """Projects points onto the screen, without any clipping.
+        :param points: a ... x 3 array of points.
+        :return: (screen_xy, w), where screen_xy is a ... x 2 array of screen coordinates, which are only meaningful
+                 where the corresponding entry in w is positive.
+        """
+        camera_xform = self.get_xform(surface_size)
+        xformed = points @ camera_xform[:, :3].T + camera_xform[:, 3]
+        w = xformed[..., 3]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            screen_xy = (0.5 + xformed[..., :2] / w[..., numpy.newaxis]) * numpy.array(surface_size, dtype=numpy.float32)
+        return screen_xy, w
+
+    def get_visibility_mask(self, surface_size, volumes: numpy.ndarray, margin=None) -> numpy.ndarray:
+        """Checks which convex volumes could be visible to the camera.
+        :param volumes: a ... x K x 3 array, where each volume is the convex hull of K points.
+        :param margin: how far (in pixels) past the edges of the surface a volume can be and still count as visible.
+                       By default, as far as the glow of the lines in it can reach (see neon.get_glow_margin).
+        :return: a boolean array of shape (...), False for volumes that are definitely out of view.
+        """
+        if margin is None:
+            margin = neon.get_glow_margin(surface_size)
+        camera_xform = self.get_xform(surface_size)
+        xformed = volumes @ camera_xform[:, :3].T + camera_xform[:, 3]
+        x, y, w = xformed[..., 0], xformed[..., 1], xformed[..., 3]
+
+        # the visible region, in clip space. points outside it map to screen coords past the margin.
+        x_limit = (0.5 + margin / surface_size[0]) * w
+        y_limit = (0.5 + margin / surface_size[1]) * w
+
+        # a volume is culled if all of its points are on the wrong side of the same plane
+        culled = numpy.all(w < self.get_near_clip_w(), axis=-1)
+        culled |= numpy.all(x > x_limit, axis=-1)
+        culled |= numpy.all(x < -x_limit, axis=-1)
+        culled |= numpy.all(y > y_limit, axis=-1)
+        culled |= numpy.all(y < -y_limit, axis=-1)
+        return ~culled
 
     def project_to_surface(self, surface, lines: List[Line3D], depth_shading=None) -> List[Line2D]:
+        points, colors, widths = pack_lines(lines)
+        points_2d, colors, inner_colors, widths = self.project_batch_to_surface(surface, points, colors, widths,
+                                                                               depth_shading=depth_shading)
         res = []
+        for (p1, p2), color, inner_color, width in zip(points_2d.tolist(), colors.tolist(), inner_colors.tolist(),
+                                                       widths.tolist()):
+            res.append(Line2D(Vector2(p1), Vector2(p2), color=pygame.Color(color), inner_color=pygame.Color(inner_color),
+                              width=width))
+        return res
+
+    def project_batch_to_surface(self, surface, points: numpy.ndarray, colors: numpy.ndarray, widths: numpy.ndarray,
+                                 depth_shading=None, clip_margin=None):
+        """Projects a batch of 3D line segments onto the surface, all at once.
+        :param points: an N x 2 x 3 array of the segments' endpoints.
+        :param colors: an N x 3 array of the segments' colors.
+        :param widths: a length N array of the segments' widths.
+        :param depth_shading: optional (start, end) distances over which lines fade to black.
+        :param clip_margin: how far (in pixels) segments can extend past the edges of the surface before they're
+                            clipped. This should be big enough to cover any glow drawn around the lines, which is
+                            what it is by default (see neon.get_glow_margin).
+        :return: (points_2d, colors, inner_colors, widths), where points_2d is an M x 2 x 2 float32 array of screen
+                 coordinates, colors and inner_colors are M x 3 uint8 arrays, and widths is a length M array. Segments
+                 are clipped against the near plane and the (expanded) surface, and ones that end up completely
+                 outside are dropped, so M <= N.
+        """
         screen_dims = surface.get_size()
         camera_xform = self.get_xform(screen_dims)
-        point_list = numpy.ndarray((len(lines) * 2, 4), dtype=numpy.float32)
-        for i in range(len(lines) * 2):
-            pt = lines[i // 2].p1 if i % 2 == 0 else lines[i // 2].p2
-            point_list[i] = (pt[0], pt[1], pt[2], 1)
-
-        point_list = point_list.transpose()
-        point_list = camera_xform.dot(point_list)
-        point_list = point_list.transpose()
-
-        for i in range(len(lines)):
-            w1 = point_list[i * 2][3]
-            w2 = point_list[i * 2 + 1][3]
-            if w1 > 0.001 and w2 > 0.001:
-                x1 = screen_dims[0] * (0.5 + point_list[i * 2][0] / w1)
-                y1 = screen_dims[1] * (0.5 + point_list[i * 2][1] / w1)
-                x2 = screen_dims[0] * (0.5 + point_list[i * 2 + 1][0] / w2)
-                y2 = screen_dims[1] * (0.5 + point_list[i * 2 + 1][1] / w2)
-                p1 = Vector2(x1, y1)
-                p2 = Vector2(x2, y2)
-                if depth_shading is None:
-                    inner_color = neon.WHITE
-                    line_color = lines[i].color
-                else:
-                    depth = ((lines[i].p1 + lines[i].p2) / 2 - self.position).length()
-                    if depth <= depth_shading[0]:
-                        inner_color = neon.WHITE
-                        line_color = lines[i].color
-                    elif depth >= depth_shading[1]:
-                        inner_color = neon.BLACK
-                        line_color = neon.BLACK
-                    else:
-                        lerp_amt = (depth - depth_shading[0]) / (depth_shading[1] - depth_shading[0])
-                        line_color = lines[i].color.lerp(neon.BLACK, lerp_amt)
-                        inner_color = neon.WHITE.lerp(neon.BLACK, lerp_amt)
-
-                res.append(Line2D(p1, p2, color=line_color, inner_color=inner_color, width=lines[i].width))
 
-        return res
+        points = numpy.asarray(points, dtype=numpy.float32).reshape((-1, 2, 3))
+        colors = numpy.asarray(colors, dtype=numpy.uint8).reshape((-1, 3))
+        widths = numpy.asarray(widths).reshape((-1,))
+
+        # same as multiplying [x, y, z, 1] by the xform, without building the 4th column.
+        # float64 because clipping against the near plane can produce huge screen coordinates.
+        xformed = points @ camera_xform[:, :3].T.astype(numpy.float64) + camera_xform[:, 3]
+
+        xformed, visible = clip_segments_to_near_plane(xformed, self.get_near_clip_w())
+        points_2d = (0.5 + xformed[:, :, :2] / xformed[:, :, 3:]) * screen_dims
+
+        if clip_margin is None:
+            clip_margin = neon.get_glow_margin(screen_dims, math.ceil(widths.max(initial=1)))
+        clip_rect = (-clip_margin, -clip_margin, screen_dims[0] + clip_margin, screen_dims[1] + clip_margin)
+        points_2d, on_screen = clip_segments_to_rect(points_2d, clip_rect)
+        visible[visible] = on_screen
+        points_2d = points_2d.astype(numpy.float32)
+
+        points = points[visible]
+        colors, inner_colors = self.get_shaded_colors((points[:, 0] + points[:, 1]) / 2, colors[visible],
+                                                      depth_shading)
+        return points_2d, colors, inner_colors, widths[visible]
+
+    def get_shaded_colors(self, centers: numpy.ndarray, colors: numpy.ndarray, depth_shading=None):
+        """Works out the colors of projected segments, see project_batch_to_surface.
+        :param centers: an N x 3 array of the segments' (un-rolled) midpoints. Only used for depth shading.
+        :param colors: an N x 3 uint8 array of the segments' colors.
+        :return: (colors, inner_colors)
+        """
+        if depth_shading is None:
+            inner_colors = numpy.empty_like(colors)
+            inner_colors[:] = neon.WHITE[:3]
+            return colors, inner_colors
+
+        # the points haven't been rolled, so un-roll the camera instead
+        position = numpy.array(self.position.rotate(-self.roll, Vector3(0, 0, 1)), dtype=numpy.float32)
+        depths = numpy.linalg.norm(centers - position, axis=1)
+        lerp_amt = numpy.clip((depths - depth_shading[0]) / (depth_shading[1] - depth_shading[0]), 0, 1)
+        brightness = (1 - lerp_amt)[:, numpy.newaxis]
+        inner_colors = numpy.rint(numpy.array(neon.WHITE[:3], dtype=numpy.float32) * brightness).astype(numpy.uint8)
+        colors = numpy.rint(colors * brightness).astype(numpy.uint8)
+        return colors, inner_colors
+
+
+def clip_segments_to_near_plane(xformed: numpy.ndarray, near_w: float):
+    """Clips segments in homogeneous (clip) space so that both endpoints have w >= near_w.
+    :param xformed: an N x 2 x 4 array of transformed endpoints.
+    :return: (clipped, mask), where clipped is an M x 2 x 4 array of the segments that survived, and mask is a
+             length N boolean array of which segments those were.
+    """
+    w = xformed[:, :, 3]
+    inside = w >= near_w
+    mask = inside[:, 0] | inside[:, 1]
+    res = xformed[mask]
+    inside = inside[mask]
+
+    # segments with one endpoint behind the near plane get that endpoint moved onto the plane
+    for out_idx in (0, 1):
+        needs_clip = ~inside[:, out_idx]
+        p_out = res[needs_clip, out_idx]
+        p_in = res[needs_clip, 1 - out_idx]
+        t = (p_in[:, 3] - near_w) / (p_in[:, 3] - p_out[:, 3])
+        res[needs_clip, out_idx] = p_in + t[:, numpy.newaxis] * (p_out - p_in)
+
+    return res, mask
+
+
+def clip_segments_to_rect(points_2d: numpy.ndarray, rect):
+    """Clips 2D segments against a rectangle, using the Liang-Barsky algorithm.
+    :param points_2d: an N x 2 x 2 array of endpoints.
+    :param rect: (min_x, min_y, max_x, max_y)
+    :return: (clipped, mask), where clipped is an M x 2 x 2 array of the segments that overlap the rectangle, and mask
+             is a length N boolean array of which segments those were.
+    """
+    p0 = points_2d[:, 0]
+    delta = points_2d[:, 1] - p0
+
+    # the segment is p0 + t * delta, for t in [t_min, t_max]
+    t_min = numpy.zeros(len(points_2d))
+    t_max = numpy.ones(len(points_2d))
+    mask = numpy.ones(len(points_2d), dtype=bool)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for axis in (0, 1):
+            for p, q in ((-delta[:, axis], p0[:, axis] - rect[axis]),
+                         (delta[:, axis], rect[axis + 2] - p0[:, axis])):
+                mask &= (p != 0) | (q >= 0)  # parallel to this edge and outside of it
+                r = q / p
+                entering = p < 0
+                leaving = p > 0
+                t_min = numpy.where(entering, numpy.maximum(t_min, r), t_min)
+                t_max = numpy.where(leaving, numpy.minimum(t_max, r), t_max)
+    mask &= t_min <= t_max
+
+    p0, delta = p0[mask], delta[mask]
+    res = numpy.empty((len(p0), 2, 2), dtype=points_2d.dtype)
+    res[:, 0] = p0 + t_min[mask, numpy.newaxis] * delta
+    res[:, 1] = p0 + t_max[mask, numpy.newaxis] * delta
+    return res, mask
+
+
+def pack_lines(lines: List[Line3D]):
+    """Packs a list of Line3Ds into arrays, for use with Camera3D.project_batch_to_surface.
+    :return: (points, colors, widths), an N x 2 x 3 float32 array of endpoints, an N x 3 uint8 array of colors,
+             and a length N array of widths.
+    """
+    points = numpy.array([(l.p1, l.p2) for l in lines], dtype=numpy.float32).reshape((-1, 2, 3))
+    colors = numpy.array([tuple(l.color)[:3] for l in lines], dtype=numpy.uint8).reshape((-1, 3))
+    widths = numpy.array([l.width for l in lines])
+    return points, colors, widths
 
 
 def gen_cube(angle, size, center, color):
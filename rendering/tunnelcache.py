@@ -0,0 +1,171 @@
+import collections
+import copy
+import cv2
+import numpy
+import pygame
+import config
+import rendering.neon as neon
+import rendering.presentation as presentation
+
+
+# The tunnel looks the same every cell length along the z-axis (apart from its color, which changes slowly), and the
+# same every 360 / number of lanes degrees of rotation. So instead of building, projecting and blurring it every frame,
+# rendered frames of just the tunnel are kept around, keyed by where the camera is within its cell, the rotation, and
+# so on, and reused whenever the camera comes back to (about) the same spot. Everything else (obstacles, the player)
+# is rendered on its own and put on top.
+#
+# The camera is snapped to its key before the tunnel gets rendered, so a frame looks the same whether it was just
+# rendered or came out of the cache. Far away sections get merged at cell boundaries that are a multiple of their
+# size (see levelbuilder3d.get_section_lods), which isn't part of the key, so those can come out a little different.
+# The snapping is much coarser than a pixel up close, so anything that sits in the tunnel's cells (the obstacles) has
+# to be projected with the snapped camera too (see snap_camera), or it slides around against the cells' lines.
+#
+# The layer gets put under everything else by taking the brighter of the two at each pixel. That's not quite the same
+# as rendering the tunnel first and everything else over it: where an obstacle's line crosses a brighter tunnel line,
+# the tunnel wins, and the glows don't add up. With both being glowing lines on black, it's hard to tell apart.
+
+_instance = None
+
+PHASE_STEPS = 64  # positions per cell
+ROTATION_STEP = 0.25  # degrees
+CAMERA_STEP = 0.02  # for the camera's height (and sideways position)
+COLOR_STEP = 16  # per channel, for the level's color
+DARKNESS_STEPS = 64  # for extra_darkness_factor and tint_amount
+
+
+def get_instance():
+    global _instance
+    if _instance is None:
+        _instance = TunnelLayerCache(config.Rendering.tunnel_cache_mb)
+
+    return _instance
+
+
+def is_enabled() -> bool:
+    return config.Rendering.tunnel_cache_mb > 0 and config.Debug.use_neon
+
+
+def _quantize(val, step):
+    return int(round(val / step))
+
+
+class TunnelLayerCache:
+    """
+    Rendered frames of the tunnel, with the least recently used ones thrown out once they take up too much memory.
+    """
+
+    def __init__(self, max_megabytes):
+        self.max_bytes = int(max_megabytes * 1024 * 1024)
+        self._layers = collections.OrderedDict()  # key -> H x W x 4 array, least recently used first
+        self._n_bytes = 0
+        self._renderer = None
+        self._surface = None  # what the layers get rendered onto
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "tunnel cache {}/{} hits, {} MB".format(self.hits, self.hits + self.misses, self._n_bytes >> 20)
+
+    def clear(self):
+        self._layers.clear()
+        self._n_bytes = 0
+
+    def get_key(self, level, camera, surface_size, depth_shading=None, extra_darkness_factor=1, tint=None,
+                tint_amount=0):
+        """:return: (the key, the camera snapped to it)"""
+        cell_length = level.get_cell_length()
+        z_step = cell_length / PHASE_STEPS
+        z_idx = _quantize(camera.position.z, z_step)
+
+        # the lanes all look the same, so turning by one lane's worth doesn't change anything
+        rotation_idx = _quantize(camera.roll, ROTATION_STEP)
+        rotation_period = 360 / level.number_of_lanes() / ROTATION_STEP
+        if rotation_period != int(rotation_period):
+            rotation_period = 360 / ROTATION_STEP
+        rotation_idx %= int(rotation_period)
+
+        x_idx, y_idx = _quantize(camera.position.x, CAMERA_STEP), _quantize(camera.position.y, CAMERA_STEP)
+        color = tuple(_quantize(c, COLOR_STEP) for c in tuple(level.get_color(camera.position.z))[:3])
+        tint = None if tint is None or tint_amount <= 0 else tuple(tint)[:3]
+        darkness_idx = _quantize(extra_darkness_factor, 1 / DARKNESS_STEPS)
+        tint_idx = _quantize(tint_amount, 1 / DARKNESS_STEPS) if tint is not None else 0
+
+        key = (tuple(surface_size), level.number_of_lanes(), cell_length, level.get_radius(camera.position.z),
+               z_idx % PHASE_STEPS, rotation_idx, x_idx, y_idx, camera.fov_degrees, color, depth_shading,
+               darkness_idx, tint, tint_idx)
+
+        return key, self.snap_camera(level, camera)
+
+    @staticmethod
+    def snap_camera(level, camera):
+        """:return: a copy of the camera, moved to where the tunnel gets rendered from (for get_key's key)."""
+        z_step = level.get_cell_length() / PHASE_STEPS
+        snapped = copy.copy(camera)
+        snapped.position = pygame.Vector3(_quantize(camera.position.x, CAMERA_STEP) * CAMERA_STEP,
+                                          _quantize(camera.position.y, CAMERA_STEP) * CAMERA_STEP,
+                                          _quantize(camera.position.z, z_step) * z_step)
+        snapped.roll = _quantize(camera.roll, ROTATION_STEP) * ROTATION_STEP
+        return snapped
+
+    def get_layer(self, screen: pygame.Surface, level, camera, project_tunnel, depth_shading=None,
+                  extra_darkness_factor=1, tint=None, tint_amount=0):
+        """Finds (or renders) the tunnel, as seen from the camera.
+        :param project_tunnel: a function taking (camera, surface, depth_shading) and returning the tunnel projected
+                               onto the surface, like levelbuilder3d.project_level_surface does. It's only called if
+                               the tunnel isn't cached already.
+        :return: the tunnel as an array in screen's native pixel format, to pass to draw_layer. Or None if the screen's
+                 pixel format isn't supported, in which case the tunnel needs to be drawn the normal way.
+        """
+        native_screen, channels = neon.get_native_pixel_view(screen)
+        if native_screen is None:
+            return None
+        del native_screen
+
+        key, snapped_camera = self.get_key(level, camera, screen.get_size(), depth_shading, extra_darkness_factor,
+                                           tint, tint_amount)
+        layer = self._layers.get(key)
+        if layer is not None:
+            self._layers.move_to_end(key)
+            self.hits += 1
+            return layer
+        self.misses += 1
+
+        if self._renderer is None:
+            # a renderer of its own, since the layer is needed right away (so it can't be pipelined), and it shouldn't
+            # get trails from whatever was rendered before it
+            self._renderer = neon.get_renderer_class()(**{**neon.get_renderer_settings(), "temporal_bloom": 0})
+        if self._surface is None or self._surface.get_size() != screen.get_size():
+            self._surface = pygame.Surface(screen.get_size(), 0, screen)
+
+        points_2d, colors, inner_colors, widths = project_tunnel(snapped_camera, self._surface, depth_shading)
+        lines = self._renderer.prepare_lines(neon.NeonLineBatch(points_2d, colors, widths, inner_colors=inner_colors),
+                                             extra_darkness_factor, tint, tint_amount)
+        self._renderer.render_to_surface(self._surface, lines)
+
+        native_layer, _ = neon.get_native_pixel_view(self._surface)
+        layer = native_layer.copy()
+        del native_layer
+
+        if layer.nbytes <= self.max_bytes:
+            self._layers[key] = layer
+            self._n_bytes += layer.nbytes
+            while self._n_bytes > self.max_bytes:
+                _, old_layer = self._layers.popitem(last=False)
+                self._n_bytes -= old_layer.nbytes
+        return layer
+
+    @staticmethod
+    def draw_layer(screen: pygame.Surface, layer, on_top=True):
+        """
+        :param layer: from get_layer.
+        :param on_top: whether to keep what's already on the screen, where it's brighter than the tunnel (which is how
+                       the tunnel ends up underneath everything else, more or less). Otherwise the screen is
+                       overwritten.
+        """
+        presentation.flush_text(screen)
+        native_screen, _ = neon.get_native_pixel_view(screen)
+        if on_top:
+            cv2.max(native_screen, layer, dst=native_screen)
+        else:
+            numpy.copyto(native_screen, layer)
+        del native_screen
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the game's modules are imported from the repo's root, same as when running main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
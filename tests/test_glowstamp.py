@@ -0,0 +1,108 @@
+import random
+
+import numpy
+import pygame
+import pytest
+
+import gameplay.levels as levels
+import rendering.glowstamp as glowstamp
+import rendering.levelbuilder3d as levelbuilder3d
+import rendering.neon as neon
+import rendering.threedee as threedee
+
+
+def _render(renderer_class, lines, size, always_stamp=True):
+    buf = numpy.zeros((size[0], size[1], 3), dtype=numpy.uint8)
+    renderer = renderer_class(kernel_reference_height=neon.REFERENCE_HEIGHT, bloom_downsample=1)
+    renderer.always_stamp = always_stamp
+    renderer.render_to_array(buf, lines)
+    return buf
+
+
+def _make_gameplay_scene(size):
+    """The tunnel, seen from where the camera is during gameplay."""
+    random.seed(0)
+    level = levels.InfiniteGeneratingLevel(8)
+    camera = threedee.Camera3D()
+    camera.position.y = -1
+    camera.position.z = 100
+    cell_length = level.get_cell_length()
+    points_2d, colors, inner_colors, widths = levelbuilder3d.project_level_surface(
+        int(camera.position.z / cell_length), int((camera.position.z + 150) / cell_length + 1), cell_length, level,
+        camera, pygame.Surface(size))
+    return neon.NeonLineBatch(points_2d, colors, widths, inner_colors=inner_colors)
+
+
+@pytest.mark.parametrize("size, n_squares", [((960, 540), 5), ((960, 540), 25), ((1920, 1080), 5)])
+def test_stamp_matches_blur_for_sparse_scenes(size, n_squares):
+    random.seed(n_squares)
+    lines = glowstamp.make_square_scene(size, n_squares)
+
+    diff = numpy.abs(_render(neon.NeonRenderer, lines, size).astype(numpy.int16)
+                     - _render(glowstamp.GlowStampRenderer, lines, size))
+
+    # the stamps are separable approximations of the blurs, so they're a bit off where lines' glows meet and near
+    # their ends, but should be close everywhere else
+    assert diff.mean() < 1.5
+    assert numpy.percentile(diff, 99) <= 32
+    assert numpy.percentile(diff, 99.9) <= 64
+
+
+@pytest.mark.parametrize("size", [(960, 540), (1920, 1080)])
+def test_stamp_matches_blur_for_gameplay(size):
+    lines = _make_gameplay_scene(size)
+
+    diff = numpy.abs(_render(neon.NeonRenderer, lines, size).astype(numpy.int16)
+                     - _render(glowstamp.GlowStampRenderer, lines, size))
+    assert diff.mean() < 1.5
+    assert numpy.percentile(diff, 99) <= 32
+    assert numpy.percentile(diff, 99.9) <= 64
+
+
+def test_stamp_blurs_dense_scenes():
+    size = (960, 540)
+    lines = _make_gameplay_scene(size)
+    # the tunnel's long diagonal lines are a lot slower to stamp than to blur
+    assert numpy.array_equal(_render(glowstamp.GlowStampRenderer, lines, size, always_stamp=False),
+                             _render(neon.NeonRenderer, lines, size))
+
+    random.seed(2)
+    sparse_lines = glowstamp.make_square_scene(size, 3)
+    assert not numpy.array_equal(_render(glowstamp.GlowStampRenderer, sparse_lines, size, always_stamp=False),
+                                 _render(neon.NeonRenderer, sparse_lines, size))
+
+
+def test_stamp_draws_native_pixel_formats():
+    size = (960, 540)
+    random.seed(0)
+    lines = glowstamp.make_square_scene(size, 3)
+    rgb = _render(glowstamp.GlowStampRenderer, lines, size)
+
+    bgra = numpy.zeros((size[1], size[0], 4), dtype=numpy.uint8)
+    glowstamp.GlowStampRenderer(kernel_reference_height=neon.REFERENCE_HEIGHT)._render(
+        bgra, lines, 1, 1, transposed=False, channels=(2, 1, 0))
+    # same picture, give or take the blur rounding differently along rows and columns
+    diff = numpy.abs(bgra[:, :, 2::-1].astype(numpy.int16) - rgb.transpose((1, 0, 2)))
+    assert diff.max() <= 4
+
+
+def test_stamp_keeps_temporal_bloom():
+    size = (960, 540)
+    random.seed(1)
+    frames = [glowstamp.make_square_scene(size, 5) for _ in range(6)]
+
+    results = []
+    for renderer_class in (neon.NeonRenderer, glowstamp.GlowStampRenderer):
+        renderer = renderer_class(kernel_reference_height=neon.REFERENCE_HEIGHT, bloom_downsample=1,
+                                  temporal_bloom=0.6)
+        buf = numpy.zeros((size[0], size[1], 3), dtype=numpy.uint8)
+        for lines in frames:
+            renderer.render_to_array(buf, lines)
+        results.append(buf)
+    blurred, stamped = results
+
+    # the last frame's squares are the only thing without temporal bloom, so the trails have to show up elsewhere
+    assert not numpy.array_equal(stamped, _render(glowstamp.GlowStampRenderer, frames[-1], size))
+    diff = numpy.abs(blurred.astype(numpy.int16) - stamped)
+    assert diff.mean() < 1.5
+    assert numpy.percentile(diff, 99) <= 32
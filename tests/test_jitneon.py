@@ -0,0 +1,63 @@
+import random
+
+import numpy
+import pytest
+
+pytest.importorskip("numba")
+
+import rendering.jitneon as jitneon
+import rendering.neon as neon
+
+
+def _random_lines(size, n, max_width=3, margin=0):
+    # some lines go off the screen (with a margin), to check they get clipped the same way
+    def random_point():
+        return random.uniform(-margin, size[0] + margin), random.uniform(-margin, size[1] + margin)
+    points = [(random_point(), random_point()) for _ in range(n)]
+    colors = [tuple(random.choice(neon.ALL_COLORS))[:3] for _ in range(n)]
+    return neon.NeonLineBatch(points, colors, [random.randint(1, max_width) for _ in range(n)])
+
+
+def _assert_close(expected, actual):
+    diff = numpy.abs(expected.astype(numpy.int16) - actual)
+    assert diff.mean() < 0.01
+    assert diff.max() <= 2
+
+
+@pytest.mark.parametrize("size, n_lines, bloom_downsample", [((960, 540), 50, 1), ((960, 540), 300, 2),
+                                                             ((640, 360), 100, 1)])
+def test_jit_matches_cv2(size, n_lines, bloom_downsample):
+    random.seed(n_lines)
+    lines = _random_lines(size, n_lines, margin=100)
+
+    bufs = []
+    for renderer_class in (neon.NeonRenderer, jitneon.JitNeonRenderer):
+        buf = numpy.zeros((size[0], size[1], 3), dtype=numpy.uint8)
+        renderer_class(kernel_reference_height=neon.REFERENCE_HEIGHT,
+                       bloom_downsample=bloom_downsample).render_to_array(buf, lines)
+        bufs.append(buf)
+    _assert_close(*bufs)
+
+
+def test_jit_matches_cv2_in_native_pixel_formats():
+    size = (960, 540)
+    random.seed(1)
+    lines = _random_lines(size, 100)
+
+    bufs = []
+    for renderer_class in (neon.NeonRenderer, jitneon.JitNeonRenderer):
+        buf = numpy.zeros((size[1], size[0], 4), dtype=numpy.uint8)
+        renderer_class(kernel_reference_height=neon.REFERENCE_HEIGHT, bloom_downsample=1).render_to_array(
+            buf, lines, transposed=False, channels=(2, 1, 0))
+        bufs.append(buf)
+    _assert_close(*bufs)
+
+
+def test_thick_lines_match_cv2():
+    random.seed(2)
+    lines = _random_lines((300, 200), 500, max_width=12, margin=60)
+    expected = numpy.zeros((200, 300, 3), dtype=numpy.uint8)
+    actual = expected.copy()
+    neon.NeonRenderer()._draw_glow_lines(expected, lines.np_points, lines.colors, lines.widths)
+    jitneon.JitNeonRenderer()._draw_glow_lines(actual, lines.np_points, lines.colors, lines.widths)
+    assert numpy.array_equal(expected, actual)
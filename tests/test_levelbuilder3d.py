@@ -0,0 +1,40 @@
+import warnings
+
+import numpy
+import pygame
+
+import gameplay.levels as levels
+import rendering.levelbuilder3d as levelbuilder3d
+import rendering.threedee as threedee
+
+
+def test_project_sections_skips_rings_at_the_camera():
+    surface = pygame.Surface((960, 540))
+    camera = threedee.Camera3D()
+    level = levels.InfiniteGeneratingLevel(8)
+    assert levelbuilder3d.can_project_sections_directly(level, camera, surface.get_size())
+
+    # the first section's far ring is exactly on the camera's plane, where w is 0
+    sections = [(-20, 20, None, True), (0, 20, None, True), (20, 20, None, True)]
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        points_2d, colors, inner_colors, widths = levelbuilder3d.project_sections(sections, level, camera, surface)
+    assert len(points_2d) > 0
+    assert numpy.isfinite(points_2d).all()
+    assert len(colors) == len(inner_colors) == len(widths) == len(points_2d)
+
+
+def test_geometry_cache_evicts_sections_behind(monkeypatch):
+    level = levels.InfiniteGeneratingLevel(8)
+    built = []
+    build_section = levelbuilder3d.build_section
+    monkeypatch.setattr(levelbuilder3d, "build_section",
+                        lambda z, length, level, **kwargs: built.append(z) or build_section(z, length, level, **kwargs))
+
+    cache = levelbuilder3d.GeometryCache()
+    for z in (0, 20, 40, 60):
+        cache.build_section(z, 20, level)
+    cache.evict_before(45)
+    for z in (0, 20, 40, 60):
+        cache.build_section(z, 20, level)
+    assert built == [0, 20, 40, 60, 0, 20]
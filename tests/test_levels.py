@@ -0,0 +1,123 @@
+import gameplay.levels as levels
+
+CELL_LENGTH = 20
+
+
+def _generate(n, i):
+    # an obstacle in every other cell of each lane, different for each (lane, cell)
+    if (n + i) % 2 == 0:
+        return levels.Spikes(n, i * CELL_LENGTH + 5, 2)
+    return None
+
+
+def _load(grid, cell_start, cell_end):
+    grid.load(cell_start, cell_end, _generate, CELL_LENGTH)
+
+
+def _check(grid, cell_start, cell_end):
+    """Checks the grid holds exactly what _generate makes for [cell_start, cell_end)."""
+    assert (grid.cell_start, grid.cell_end) == (cell_start, cell_end)
+    for n in range(grid.n_lanes):
+        for i in range(cell_start - 2, cell_end + 2):
+            obs = grid.get(n, i)
+            if cell_start <= i < cell_end and (n + i) % 2 == 0:
+                assert (obs.lane, obs.z) == (n, i * CELL_LENGTH + 5)
+            else:
+                assert obs is None
+
+        first_cell, types, z_offsets, _, obstacles = grid.get_lane(n, cell_start, cell_end)
+        assert first_cell == cell_start
+        assert len(types) == cell_end - cell_start
+        for i, obs in enumerate(obstacles, first_cell):
+            assert obs is grid.get(n, i)
+            assert (types[i - first_cell] != 0) == (obs is not None)
+            if obs is not None:
+                assert z_offsets[i - first_cell] == 5
+
+        assert grid.get_lane_obstacles(n, cell_start, cell_end) == [obs for obs in obstacles if obs is not None]
+
+
+def test_grid_wraps_around():
+    grid = levels.ObstacleGrid(3, capacity=8)
+    _load(grid, 0, 6)
+    for start in range(1, 30):
+        # moving forwards a cell at a time keeps going around the ring buffer
+        grid.unload_before(start)
+        _load(grid, start, start + 6)
+        _check(grid, start, start + 6)
+    assert grid.capacity == 8
+
+
+def test_grid_grows_past_capacity():
+    grid = levels.ObstacleGrid(3, capacity=8)
+    _load(grid, 5, 11)
+    _load(grid, 11, 30)
+    assert grid.capacity >= 25
+    _check(grid, 5, 30)
+
+    # loading before the start is fine too
+    _load(grid, 0, 5)
+    _check(grid, 0, 30)
+
+
+def test_grid_unloads_across_the_wrap_point():
+    grid = levels.ObstacleGrid(3, capacity=8)
+    _load(grid, 5, 12)  # cells 5 to 7 are at the end of the arrays, 8 to 11 at the start
+    grid.unload_before(10)
+    _check(grid, 10, 12)
+
+    _load(grid, 10, 18)
+    _check(grid, 10, 18)
+
+    grid.unload_before(50)
+    assert len(grid) == 0
+    assert grid.get(0, 10) is None
+    assert grid.get_lane_obstacles(0, 0, 100) == []
+
+
+def test_grid_has_no_obstacles_outside_its_lanes():
+    level = levels.InfiniteGeneratingLevel(3)
+    level.load_obstacles(0, 200)
+    for i in range(10):
+        assert level.get_obstacle_at_cell_if_loaded(-1, i) is None
+        assert level.get_obstacle_at_cell_if_loaded(3, i) is None
+
+
+def test_lane_queries_at_the_edges_of_the_cell_range():
+    grid = levels.ObstacleGrid(2, capacity=8)
+    _load(grid, 4, 10)  # lane 0 has obstacles in cells 4, 6 and 8, lane 1 in 5, 7 and 9
+
+    def cells(n, cell_start, cell_end):
+        return [int(obs.z // CELL_LENGTH) for obs in grid.get_lane_obstacles(n, cell_start, cell_end)]
+
+    assert cells(0, 4, 10) == [4, 6, 8]
+    assert cells(1, 4, 10) == [5, 7, 9]
+    assert cells(0, 4, 8) == [4, 6]  # the end's not included
+    assert cells(1, 5, 6) == [5]
+    assert cells(1, 5, 5) == []
+    assert cells(0, 8, 4) == []
+    # anything outside the loaded range is left out
+    assert cells(0, 0, 5) == [4]
+    assert cells(1, 9, 100) == [9]
+    assert cells(0, 10, 100) == []
+    assert grid.get_obstacles(4, 6) == [grid.get_lane_obstacles(0, 4, 6), grid.get_lane_obstacles(1, 4, 6)]
+
+    first_cell, types, _, _, _ = grid.get_lane(1, 0, 7)
+    assert first_cell == 4
+    assert len(types) == 3
+    first_cell, types, _, _, _ = grid.get_lane(1, 12, 20)
+    assert len(types) == 0
+
+
+def test_level_lane_queries_match_the_cells():
+    level = levels.InfiniteGeneratingLevel(3)
+    cell_length = level.get_cell_length()
+    level.load_obstacles(0, 50 * cell_length)
+    for n in range(3):
+        everything = level.get_lane_obstacles_between(n, 0, 50 * cell_length)
+        # z ranges get rounded out to whole cells
+        for i in range(1, 49):
+            found = level.get_lane_obstacles_between(n, i * cell_length, i * cell_length)
+            assert found == [obs for obs in everything if i <= obs.z / cell_length < i + 1]
+        # lanes wrap around, same as they always have
+        assert level.get_lane_obstacles_between(n + 3, 0, 50 * cell_length) == everything
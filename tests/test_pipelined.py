@@ -0,0 +1,71 @@
+import random
+
+import numpy
+import pygame
+import pytest
+
+import config
+import rendering.glowstamp as glowstamp
+import rendering.neon as neon
+import rendering.pipelined as pipelined
+
+SIZE = (320, 180)
+
+
+@pytest.fixture
+def renderer():
+    res = pipelined.PipelinedNeonRenderer(**neon.get_renderer_settings())
+    yield res
+    res.stop()
+
+
+def _draw(renderer, lines):
+    surface = pygame.Surface(SIZE)
+    renderer.draw_lines(surface, lines)
+    return pygame.surfarray.array3d(surface)
+
+
+def _draw_normally(lines):
+    return _draw(neon.NeonRenderer(**neon.get_renderer_settings()), lines)
+
+
+def test_worker_round_trips_frames(renderer):
+    random.seed(0)
+    frames = [glowstamp.make_square_scene(SIZE, 3) for _ in range(3)]
+
+    # the first frame gets waited on, after that each one shows up a frame late
+    assert numpy.array_equal(_draw(renderer, frames[0]), _draw_normally(frames[0]))
+    assert numpy.array_equal(_draw(renderer, frames[1]), _draw_normally(frames[0]))
+    assert numpy.array_equal(_draw(renderer, frames[2]), _draw_normally(frames[1]))
+
+
+def test_flush_drops_the_late_frame(renderer):
+    random.seed(1)
+    old, new = glowstamp.make_square_scene(SIZE, 3), glowstamp.make_square_scene(SIZE, 3)
+
+    _draw(renderer, old)
+    renderer.flush()
+    assert numpy.array_equal(_draw(renderer, new), _draw_normally(new))
+
+
+def test_falls_back_when_the_worker_dies(renderer):
+    random.seed(2)
+    frames = [glowstamp.make_square_scene(SIZE, 3) for _ in range(2)]
+
+    _draw(renderer, frames[0])
+    renderer._process.kill()
+    renderer._process.join()
+
+    assert numpy.array_equal(_draw(renderer, frames[1]), _draw_normally(frames[1]))
+    assert numpy.array_equal(_draw(renderer, frames[0]), _draw_normally(frames[0]))
+
+
+def test_restarts_when_the_settings_change(renderer, monkeypatch):
+    random.seed(3)
+    lines = glowstamp.make_square_scene(SIZE, 3)
+    _draw(renderer, lines)
+
+    monkeypatch.setattr(config.Rendering, "scanline_darkness", 0.5)
+    renderer.flush()
+    assert numpy.array_equal(_draw(renderer, lines), _draw_normally(lines))
+    assert renderer.scanline_darkness == 0.5
@@ -0,0 +1,86 @@
+import threading
+import time
+
+import gameplay.levels as levels
+import gameplay.pregeneration as pregeneration
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline
+        time.sleep(0.001)
+
+
+def _recording(calls, generate=lambda n, i: (n, i)):
+    def res(n, i):
+        calls.append((n, i))
+        return generate(n, i)
+    return res
+
+
+def test_takes_what_the_worker_generated():
+    calls = []
+    pregenerator = pregeneration.ObstaclePregenerator(_recording(calls), 2, 10)
+    pregenerator.request(30)
+    _wait_until(lambda: len(calls) == 40)
+
+    assert pregenerator.take(5) is None  # before first_cell
+    for i in range(10, 30):
+        assert pregenerator.take(i) == [(0, i), (1, i)]
+    assert pregenerator.take(30) is None  # past what was requested, so the main thread gets it
+    assert len(calls) == 40  # nothing got generated twice
+
+
+def test_forgotten_cells_are_left_to_the_main_thread():
+    calls = []
+    pregenerator = pregeneration.ObstaclePregenerator(_recording(calls), 1, 0)
+    pregenerator.request(16)
+    _wait_until(lambda: len(calls) == 16)
+    pregenerator.forget_before(12)
+
+    start_time = time.perf_counter()
+    assert pregenerator.take(3) is None
+    assert time.perf_counter() - start_time < pregeneration.WORKER_WAIT_TIMEOUT
+    assert pregenerator.take(12) == [(0, 12)]
+
+
+def test_gives_up_on_a_slow_worker():
+    release = threading.Event()
+    calls = []
+
+    def generate(n, i):
+        if i == 0:
+            release.wait(5)
+        return "worker"
+
+    pregenerator = pregeneration.ObstaclePregenerator(_recording(calls, generate), 1, 0)
+    pregenerator.request(1)
+    _wait_until(lambda: len(calls) > 0)
+
+    start_time = time.perf_counter()
+    assert pregenerator.take(0) is None
+    assert time.perf_counter() - start_time < pregeneration.WORKER_WAIT_TIMEOUT + 1
+
+    # what the worker comes up with afterwards doesn't replace what the main thread generated. it only starts on the
+    # next cell once it's handed in cell 0.
+    release.set()
+    pregenerator.request(2)
+    _wait_until(lambda: len(calls) == 2)
+    assert pregenerator.take(0) is None
+    assert pregenerator.take(1) == ["worker"]
+
+
+def test_levels_with_their_own_generation_are_not_pregenerated():
+    threads = set()
+
+    class CustomLevel(levels.InfiniteGeneratingLevel):
+        def generate_obstacle_at_cell(self, n, i):
+            threads.add(threading.current_thread())
+            return super().generate_obstacle_at_cell(n, i)
+
+    level = CustomLevel(3)
+    level.pregenerate_obstacles(0, 1000)
+    time.sleep(0.1)  # plenty of time for a worker to get going, if there was one
+    level.load_obstacles(0, 1000)
+    assert threads == {threading.main_thread()}
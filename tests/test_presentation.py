@@ -0,0 +1,59 @@
+import pygame
+import pytest
+
+import rendering.neon as neon
+import rendering.presentation as presentation
+
+SIZE = (64, 32)
+
+
+@pytest.fixture
+def presenter(monkeypatch):
+    pygame.init()
+    res = presentation.TexturePresenter()
+    res.create_window(SIZE, "test")
+    monkeypatch.setattr(presentation, "_instance", res)
+    return res
+
+
+def _make_text(color):
+    text = pygame.Surface((16, 16))
+    text.fill(color)
+    return text
+
+
+def _draw_text_then_lines(screen):
+    screen.fill((0, 0, 0))
+    presentation.blit_text(screen, _make_text((255, 0, 0)), (0, 0))
+    lines = [neon.NeonLine([(0, 8), (SIZE[0], 8)], 2, (0, 0, 255))]
+    neon.NeonRenderer(**neon.get_renderer_settings()).draw_lines(screen, lines)
+
+
+def test_text_stays_under_later_draws(presenter):
+    screen = presenter.get_screen()
+    _draw_text_then_lines(screen)
+    assert presenter.texts == []
+
+    # same as if the text had been blitted straight into the screen
+    expected = pygame.Surface(SIZE, depth=32)
+    _draw_text_then_lines(expected)
+    assert pygame.image.tobytes(screen, "RGB") == pygame.image.tobytes(expected, "RGB")
+
+
+def test_text_is_drawn_last_when_nothing_comes_after_it(presenter):
+    screen = presenter.get_screen()
+    screen.fill((0, 0, 0))
+    presentation.blit_text(screen, _make_text((255, 0, 0)), (0, 0))
+
+    assert len(presenter.texts) == 1
+    assert screen.get_at((4, 4))[:3] == (0, 0, 0)  # it's in a texture, not the screen
+    presenter.present()
+    assert presenter.texts == []
+
+
+def test_render_text_reuses_surfaces():
+    pygame.font.init()
+    font = pygame.font.Font(None, 12)
+    a = presentation.render_text(font, "abc", True, (255, 255, 255))
+    assert presentation.render_text(font, "abc", True, [255, 255, 255]) is a
+    assert presentation.render_text(font, "abd", True, (255, 255, 255)) is not a
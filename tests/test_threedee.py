@@ -0,0 +1,82 @@
+import numpy
+import pygame
+import pytest
+
+import rendering.neon as neon
+import rendering.threedee as threedee
+
+
+def _clip_to_rect(segments, rect=(0, 0, 100, 50)):
+    return threedee.clip_segments_to_rect(numpy.array(segments, dtype=numpy.float64).reshape((-1, 2, 2)), rect)
+
+
+def test_near_plane_clipping():
+    near_w = 0.5
+    segments = numpy.array([
+        [(1, 2, 3, 2), (3, 4, 5, 4)],      # in front
+        [(1, 2, 3, -1), (4, 5, 6, -3)],    # behind
+        [(0, 0, 0, -1), (4, 8, 4, 3)],     # crossing, from behind
+        [(4, 8, 4, 3), (0, 0, 0, -1)],     # crossing, from in front
+        [(2, 2, 2, 0.5), (9, 9, 9, -2)],   # touching the plane
+    ], dtype=numpy.float64)
+
+    clipped, mask = threedee.clip_segments_to_near_plane(segments.copy(), near_w)
+    assert mask.tolist() == [True, False, True, True, True]
+    assert numpy.array_equal(clipped[0], segments[0])
+    # the end behind the plane gets moved along the segment, onto it
+    assert numpy.allclose(clipped[1], [(1.5, 3, 1.5, 0.5), (4, 8, 4, 3)])
+    assert numpy.allclose(clipped[2], [(4, 8, 4, 3), (1.5, 3, 1.5, 0.5)])
+    assert numpy.allclose(clipped[3], [(2, 2, 2, 0.5), (2, 2, 2, 0.5)])
+
+
+def test_nothing_closer_than_z_near_gets_projected():
+    surface = pygame.Surface((960, 540))
+    camera = threedee.Camera3D()
+    colors, widths = numpy.full((3, 3), 255), numpy.ones(3)
+    points = numpy.array([
+        [(0, 0.1, 0.2), (0, 0.1, 0.4)],   # all of it's closer than z_near
+        [(0, 0.1, -5), (0, 0.1, 5)],      # goes right past the camera
+        [(0, 0.1, 1), (0, 0.1, 5)],
+    ], dtype=numpy.float32)
+
+    points_2d, _, _, _ = camera.project_batch_to_surface(surface, points, colors, widths)
+    assert len(points_2d) == 2
+    assert numpy.isfinite(points_2d).all()
+    # the one going past the camera gets cut off at z_near
+    near_end = camera.project_batch_to_surface(surface, numpy.array([[(0, 0.1, camera.z_near), (0, 0.1, 5)]]),
+                                               colors[:1], widths[:1])[0]
+    assert numpy.allclose(points_2d[0], near_end[0], atol=0.01)
+
+
+@pytest.mark.parametrize("segment, expected", [
+    ([(10, 10), (90, 40)], [(10, 10), (90, 40)]),        # inside
+    ([(-50, 10), (50, 10)], [(0, 10), (50, 10)]),        # crossing the left edge
+    ([(50, 60), (50, 20)], [(50, 50), (50, 20)]),        # crossing the bottom edge, going up
+    ([(-10, -10), (110, 60)], [(-10 + 120 / 7, 0), (110 - 120 / 7, 50)]),  # through the top and bottom
+    ([(0, 0), (0, 50)], [(0, 0), (0, 50)]),              # along an edge
+    ([(20, 20), (20, 20)], [(20, 20), (20, 20)]),        # just a point
+])
+def test_rect_clipping_keeps(segment, expected):
+    clipped, mask = _clip_to_rect(segment)
+    assert mask.tolist() == [True]
+    assert numpy.allclose(clipped[0], expected)
+
+
+@pytest.mark.parametrize("segment", [
+    [(-50, 10), (-1, 30)],      # left of it
+    [(10, 51), (90, 80)],       # below it
+    [(-10, 60), (110, 60)],     # parallel to an edge, outside
+    [(-20, 10), (10, -20)],     # past a corner, diagonally
+    [(120, 20), (120, 20)],     # a point outside
+])
+def test_rect_clipping_drops(segment):
+    clipped, mask = _clip_to_rect(segment)
+    assert mask.tolist() == [False]
+    assert len(clipped) == 0
+
+
+def test_glow_margin_scales_with_resolution():
+    small, big = neon.get_glow_margin((960, 540)), neon.get_glow_margin((3840, 2160))
+    assert big > 3 * small
+    # wider lines reach farther
+    assert neon.get_glow_margin((960, 540), 20) > small
@@ -17,7 +17,7 @@ _FONT_PATHS = {
 
 def get_font(size, name="lame", bold=False, normalized=True):
     if normalized:
-        size = int(size * pygame.display.get_surface().get_height() / 540)
+        size = int(size * config.Display.height / 540)  # the screen's always this tall, the window gets scaled
     if bold:
         name = name + "_bold"
     if name not in _FONT_PATHS: